@@ -0,0 +1,240 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+# audit.py
+#
+# Audit of the log sieve against the exact sieve on sampled intervals.
+
+import random
+import multiprocessing as mp
+from operator import mul
+from threading import Thread
+from concurrent.futures import (Future, ProcessPoolExecutor, 
+                                ThreadPoolExecutor)
+from sieve import SieveEngine
+from pte_solutions import check_interval, primorial, verify_large_primes
+
+# Exact sieve engine, solutions and large prime data of the audit worker.
+_worker = {}
+
+
+def init_worker(logB, primes, log_primes, use_c, logL, sols):
+    '''Prepare the exact sieve in the audit worker.'''
+    _worker['engine'] = SieveEngine(logB, primes, log_primes, use_c, 1,
+                                    None, logL, exact=True)
+    _worker['sols'] = sols
+    _worker['logL'] = logL
+    _worker['P'] = primorial(primes) if logL else None
+
+
+def result_key(found):
+    '''Identify a result by x and its solution.'''
+    return (found.x, tuple(found.solution.ui), tuple(found.solution.vi))
+
+
+def audit_interval(T, n, positions, keys):
+    '''Sieve [T, T+n) exactly and compare to the positions and the keys of
+    the results found with the log sieve.
+    Returns the counts of smooth positions found by both sieves, only by
+    the exact sieve and only by the log sieve, the same counts for the
+    results, and the lists of the missed and the false results as pairs of
+    their solution lists and their description.
+    '''
+    engine = _worker['engine']
+    sols = _worker['sols']
+    logL = _worker['logL']
+    size = n + sols.max_range
+    buffer = engine.new_buffer(size)
+    engine.sieve_threads(T, size, buffer)
+    exact = bytearray(buffer)
+
+    # Only the first n positions belong to this interval, the others are
+    # counted with the next one. A product is 1 only if both are 1.
+    smooth = exact[:n].count(1)
+    flagged = positions[:n].count(1)
+    both = bytes(map(mul, positions[:n], exact[:n])).count(1)
+
+    results = check_interval(T, n, exact, sols)
+    if logL:
+        results = verify_large_primes(T, exact, results, _worker['P'], logL)
+    exact_keys = {result_key(found) for found in results}
+    missed = [(found.solution.collections, repr(found)) for found in results
+              if result_key(found) not in keys]
+    false = [key for key in keys if key not in exact_keys]
+
+    return {'positions': (both, smooth - both, flagged - both),
+            'results': (len(exact_keys & keys), len(exact_keys - keys),
+                        len(keys - exact_keys)),
+            'missed': missed, 'false': false}
+
+
+def audit_server(requests, replies, initargs):
+    '''Run the audits of several worker processes in a process owned by 
+    their parent, e.g. for workers that are daemons and cannot have 
+    children. Requests are tuples (proc_num, ident, function, args), the
+    result or exception of each is put on the queue replies[proc_num] as
+    (ident, result, exception). A request with the function None is 
+    answered with ident None to end the client of the worker, None on 
+    requests stops the server.
+    '''
+    init_worker(*initargs)
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        proc_num, ident, function, args = request
+        if function is None:
+            replies[proc_num].put((None, None, None))
+            continue
+        try:
+            replies[proc_num].put((ident, function(*args), None))
+        except Exception as e:
+            replies[proc_num].put((ident, None, e))
+
+
+class AuditClient:
+    '''Class with the submit and shutdown methods of an executor that 
+    passes the audits of a worker to audit_server over a pair of queues. 
+    A thread receives the replies and completes the futures.
+    '''
+    def __init__(self, proc_num, requests, replies):
+        self.proc_num = proc_num
+        self.requests = requests
+        self.replies = replies
+        self.futures = {}
+        self.ident = 0
+        self.receiver = Thread(target=self.receive, daemon=True)
+        self.receiver.start()
+
+    def receive(self):
+        '''Complete the futures with the replies of the server.'''
+        while True:
+            ident, result, exception = self.replies.get()
+            if ident is None:
+                break
+            future = self.futures.pop(ident)
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+    def submit(self, function, *args):
+        '''Send a call to the server and return its future.'''
+        self.ident += 1
+        future = Future()
+        self.futures[self.ident] = future
+        self.requests.put((self.proc_num, self.ident, function, args))
+        return future
+
+    def shutdown(self):
+        '''Stop receiving after the replies to all submitted calls.'''
+        self.requests.put((self.proc_num, None, None, None))
+        self.receiver.join()
+
+
+def ratio(a, b):
+    '''Format a/b, or '-' if b is 0.'''
+    return f'{a/b:.6f}' if b else '-'
+
+
+class SieveAudit:
+    '''Class to compare the log sieve with the exact sieve on a random
+    fraction of the intervals. The exact sieve and scan of a sampled
+    interval run in a background worker process. With a pair channel of
+    a request queue and a reply queue of audit_server, they run in the 
+    process of the server instead, which is needed if this process is a
+    daemon and cannot have children. Without a channel, daemons audit in
+    a thread, which competes with the search for the GIL. Intervals are not
+    sampled while max_pending audits are still running, so that the
+    search is not slowed down.
+    The counts of smooth positions and of results found by both sieves,
+    missed by the log sieve (false negatives) and only found by the log
+    sieve (false positives) give running estimates of recall and
+    precision.
+    '''
+    def __init__(self, fraction, logB, primes, log_primes, use_c, logL,
+                 sols, seed=None, max_pending=2, channel=None, 
+                 proc_num=0):
+        self.fraction = fraction
+        self.max_pending = max_pending
+        self.random = random.Random(seed)
+        initargs = (logB, primes, log_primes, use_c, logL, sols)
+        if channel is not None:
+            self.executor = AuditClient(proc_num, *channel)
+        elif mp.current_process().daemon:
+            self.executor = ThreadPoolExecutor(1, initializer=init_worker,
+                                               initargs=initargs)
+        else:
+            self.executor = ProcessPoolExecutor(1, initializer=init_worker,
+                                                initargs=initargs)
+        # Start the worker now, before this process runs other threads.
+        self.executor.submit(int).result()
+        self.pending = []
+        self.intervals = 0
+        self.skipped = 0
+        self.positions = [0, 0, 0]
+        self.results = [0, 0, 0]
+
+    def submit(self, T, n, positions, results):
+        '''Audit [T, T+n) with probability fraction, given the positions
+        and results of the log sieve.
+        '''
+        if self.random.random() >= self.fraction:
+            return
+        running = sum(1 for _, future, _ in self.pending 
+                      if not future.done())
+        if running >= self.max_pending:
+            self.skipped += 1
+            return
+        found = {result_key(found): found for found in results}
+        future = self.executor.submit(audit_interval, T, n, bytes(positions),
+                                      set(found))
+        self.pending.append(((T, n), future, found))
+
+    def collect(self, wait=False):
+        '''Return the finished audits as a list of ((T, n), report) pairs
+        and add them to the counts. With wait, wait for all of them.
+        The false results of a report are the results of the log sieve.
+        '''
+        finished = []
+        remaining = []
+        for interval, future, found in self.pending:
+            if wait or future.done():
+                report = future.result()
+                report['false'] = [found[key] for key in report['false']]
+                self.intervals += 1
+                for i in range(3):
+                    self.positions[i] += report['positions'][i]
+                    self.results[i] += report['results'][i]
+                finished.append((interval, report))
+            else:
+                remaining.append((interval, future, found))
+        self.pending = remaining
+        return finished
+
+    def estimates(self):
+        '''Return the running recall and precision estimates for smooth
+        positions and results as strings, '-' if undefined.
+        '''
+        (tp, fn, fp), (rtp, rfn, rfp) = self.positions, self.results
+        return {'position recall': ratio(tp, tp + fn),
+                'position precision': ratio(tp, tp + fp),
+                'result recall': ratio(rtp, rtp + rfn),
+                'result precision': ratio(rtp, rtp + rfp)}
+
+    def summary(self):
+        '''Return a line with the running estimates.'''
+        e = self.estimates()
+        tp, fn, fp = self.positions
+        rtp, rfn, rfp = self.results
+        return (f'audit of {self.intervals} intervals ({self.skipped}'
+                + f' skipped): smooth positions recall'
+                + f' {e["position recall"]}, precision'
+                + f' {e["position precision"]} ({fn} missed, {fp} false);'
+                + f' results recall {e["result recall"]}, precision'
+                + f' {e["result precision"]} ({rfn} missed, {rfp} false)')
+
+    def close(self):
+        '''Wait for the running audits and stop the worker.'''
+        finished = self.collect(wait=True)
+        self.executor.shutdown()
+        return finished
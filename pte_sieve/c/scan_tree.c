@@ -0,0 +1,62 @@
+// Copyright (c) Microsoft Corporation.
+// Licensed under the MIT license.
+/******************************************************************************
+* Scan of the solution tree at the smooth positions of the sieve results,     *
+* linked into both the 64-bit and the 128-bit library                         *
+******************************************************************************/
+#include <stddef.h>
+#include "scan_tree.h"
+
+unsigned int scan_tree(unsigned char* positions, unsigned int start, 
+                       unsigned int n, int* node_number, int* child_start, 
+                       int* leaf_start, int* pattern_start, 
+                       int* pattern_roots, unsigned int num_patterns, 
+                       int* stack, unsigned int max_candidates, 
+                       unsigned int* candidates, unsigned int* next, 
+                       unsigned char* starts)
+{
+    unsigned int j, count = 0, top;
+    int node, child, first, last, k, i;
+
+    // Go through the smooth positions from start, as long as there is 
+    // room for the candidates of all patterns at one more position.
+    for (j = start; j < n; j++) {
+        if (!positions[j] || (starts != NULL && !starts[j]))
+            continue;
+        if (count + num_patterns > max_candidates)
+            break;
+        // Depth-first traversal of the solution tree with an explicit 
+        // stack of nodes, as Collection.traverse.
+        top = 0;
+        stack[top++] = 0;
+        while (top > 0) {
+            node = stack[--top];
+            first = child_start[node];
+            last = child_start[node+1];
+            if (first == last) {
+                // Check the patterns of the leaf node.
+                for (k = leaf_start[node]; k < leaf_start[node+1]; k++) {
+                    for (i = pattern_start[k]; i < pattern_start[k+1]; i++) {
+                        if (!positions[j + pattern_roots[i]])
+                            break;
+                    }
+                    if (i == pattern_start[k+1]) {
+                        candidates[2*count] = j;
+                        candidates[2*count+1] = (unsigned int)k;
+                        count++;
+                    }
+                }
+            } else {
+                // Push the smooth children in reverse order to visit them 
+                // in order.
+                for (child = last-1; child >= first; child--) {
+                    if (positions[j + node_number[child]])
+                        stack[top++] = child;
+                }
+            }
+        }
+    }
+
+    *next = j;
+    return count;
+}
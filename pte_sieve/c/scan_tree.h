@@ -0,0 +1,20 @@
+// Copyright (c) Microsoft Corporation.
+// Licensed under the MIT license.
+#ifndef __SCAN_TREE_H__
+#define __SCAN_TREE_H__
+
+// Scanning function checking the patterns of the flattened solution tree 
+// at the smooth positions in [start, n), writes pairs of a position and a 
+// pattern to candidates and returns their number. Stops early if fewer 
+// than num_patterns candidates could still be written, the position to 
+// continue from is written to next. If starts is not NULL, only the 
+// positions j with starts[j] set are checked as starts of patterns
+unsigned int scan_tree(unsigned char* positions, unsigned int start, 
+                       unsigned int n, int* node_number, int* child_start, 
+                       int* leaf_start, int* pattern_start, 
+                       int* pattern_roots, unsigned int num_patterns, 
+                       int* stack, unsigned int max_candidates, 
+                       unsigned int* candidates, unsigned int* next, 
+                       unsigned char* starts);
+
+#endif
\ No newline at end of file
@@ -9,6 +9,14 @@
 bool log_sieve(digit_t T, unsigned int b, unsigned int logB, unsigned int np, 
                unsigned int* primes, unsigned char* log_primes, 
                unsigned char* numbers)
+{
+    return log_sieve_lp(T, b, logB, 0, np, primes, log_primes, numbers);
+}
+
+
+bool log_sieve_lp(digit_t T, unsigned int b, unsigned int logB, 
+                  unsigned int logL, unsigned int np, unsigned int* primes, 
+                  unsigned char* log_primes, unsigned char* numbers)
 {
     unsigned int *num_bounds, i, j, exponent;
     digit_t q, k;
@@ -68,6 +76,10 @@ bool log_sieve(digit_t T, unsigned int b, unsigned int logB, unsigned int np,
         for (j = num_bounds[i]; j < num_bounds[i+1]; j++) {
             if (numbers[j] > threshold)
                 numbers[j] = true;  
+            else if (logL && numbers[j] > threshold + 0.75*logB - logL - 2)
+                // Smooth up to one large prime of at most logL bits, with 
+                // 2 bits of slack for the rounded logs.
+                numbers[j] = 2;
             else
                 numbers[j] = 0;              
         }    
@@ -79,6 +91,134 @@ bool log_sieve(digit_t T, unsigned int b, unsigned int logB, unsigned int np,
 }
 
 
+bool exact_sieve(digit_t T, unsigned int b, unsigned int logB, 
+                 unsigned int logL, unsigned int np, unsigned int* primes, 
+                 unsigned char* numbers)
+{
+    digit_t *cofactors, p, p_inv, q, k, last = T + b - 1;
+    unsigned int i, j;
+
+    // Start with the integers T+j as their own cofactors.
+    cofactors = malloc((size_t)b*sizeof(digit_t));
+    if (cofactors == NULL) {
+        return false;
+    }
+    for (j = 0; j < b; j++) {
+        cofactors[j] = T + j;
+    }
+
+    // Iterate through the primes
+    for (i = 0; i < np; i++) {
+        p = primes[i];
+        // Inverse of an odd p modulo 2^64 by Newton iteration, so that 
+        // exact divisions by p are multiplications.
+        p_inv = p;
+        for (j = 0; j < 5; j++) {
+            p_inv *= 2 - p*p_inv;
+        }
+        // Iterate through the prime powers q = p^a up to T+b-1, dividing 
+        // each position once by p for each prime power dividing it.
+        q = p;
+        while (true) {
+            // Determine the offset for sieving.
+            k = (q - T % q) % q;
+            // Sieve
+            if (p == 2) {
+                for (; k < b; k += q)
+                    cofactors[k] >>= 1;
+            } else {
+                for (; k < b; k += q)
+                    cofactors[k] *= p_inv;
+            }
+            if (q > last/p)
+                break;
+            q *= p;
+        }
+    }
+
+    // Mark the 2^logB-smooth numbers in the interval.
+    for (j = 0; j < b; j++) {
+        if (cofactors[j] == 1)
+            numbers[j] = 1;
+        else if (logL && (logL >= 64 || cofactors[j] >> logL == 0))
+            // The cofactor has no prime factors less than 2^logB and is 
+            // prime for logL <= 2*logB.
+            numbers[j] = 2;
+        else
+            numbers[j] = 0;
+    }
+
+    free(cofactors);
+    return true;
+}
+
+bool level_sieve(digit_t T, unsigned int b, unsigned int np, 
+                 unsigned int* primes, unsigned char* levels)
+{
+    digit_t *cofactors, p, p_inv, q, k, last = T + b - 1;
+    unsigned int i, j;
+    unsigned char level = 1;
+
+    // Start with the integers T+j as their own cofactors. Without prime 
+    // factors, the integer 1 is smooth for all bounds.
+    cofactors = malloc((size_t)b*sizeof(digit_t));
+    if (cofactors == NULL) {
+        return false;
+    }
+    for (j = 0; j < b; j++) {
+        cofactors[j] = T + j;
+        levels[j] = 1;
+    }
+
+    // Iterate through the primes in increasing order, so that the last 
+    // level written to a position is that of its largest prime factor.
+    for (i = 0; i < np; i++) {
+        p = primes[i];
+        // The smallest logB with p < 2^logB.
+        while (p >> level)
+            level++;
+        p_inv = p;
+        for (j = 0; j < 5; j++) {
+            p_inv *= 2 - p*p_inv;
+        }
+        // The multiples of p get its level.
+        k = (p - T % p) % p;
+        if (p == 2) {
+            for (; k < b; k += p) {
+                cofactors[k] >>= 1;
+                levels[k] = level;
+            }
+        } else {
+            for (; k < b; k += p) {
+                cofactors[k] *= p_inv;
+                levels[k] = level;
+            }
+        }
+        // Divide once more for each higher power q = p^a up to T+b-1.
+        q = p;
+        while (q <= last/p) {
+            q *= p;
+            k = (q - T % q) % q;
+            if (p == 2) {
+                for (; k < b; k += q)
+                    cofactors[k] >>= 1;
+            } else {
+                for (; k < b; k += q)
+                    cofactors[k] *= p_inv;
+            }
+        }
+    }
+
+    // Positions that are not smooth for the largest bound get level 0.
+    for (j = 0; j < b; j++) {
+        if (cofactors[j] != 1)
+            levels[j] = 0;
+    }
+
+    free(cofactors);
+    return true;
+}
+
 int main(int argc, char **argv)
 {
     bool help_flag = false;
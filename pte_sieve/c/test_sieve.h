@@ -18,4 +18,23 @@ bool log_sieve(digit_t T, unsigned int b, unsigned int logB, unsigned int np,
                unsigned int* primes, unsigned char* log_primes, 
                unsigned char* positions);
 
+// Sieving function that also marks positions that are smooth up to one 
+// large prime of at most logL bits with 2
+bool log_sieve_lp(digit_t T, unsigned int b, unsigned int logB, 
+                  unsigned int logL, unsigned int np, unsigned int* primes, 
+                  unsigned char* log_primes, unsigned char* positions);
+
+// Exact sieving function keeping the cofactor of each position in 64 bits, 
+// also marks positions that are smooth up to one large prime of at most 
+// logL bits with 2 if logL > 0
+bool exact_sieve(digit_t T, unsigned int b, unsigned int logB, 
+                 unsigned int logL, unsigned int np, unsigned int* primes, 
+                 unsigned char* positions);
+
+// Exact sieving function writing for each position the smallest logB for 
+// which it is 2^logB-smooth, at most the bit length of the largest prime, 
+// or 0 if it is not smooth for the primes given
+bool level_sieve(digit_t T, unsigned int b, unsigned int np, 
+                 unsigned int* primes, unsigned char* levels);
+
 #endif
\ No newline at end of file
@@ -0,0 +1,28 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+# compile_solutions.py
+#
+# Compile collections of PTE solutions into binary artifacts that 
+# pte_sieve.py memory-maps at startup instead of building them.
+
+from pte_solutions.compiled import compile_collection, COMPILED_PATH
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+                description='compile collections of PTE solutions')
+    parser.add_argument("solutions", type=str, nargs='+', 
+                        help="names of solution lists, several names"
+                        + " separated by commas compile a combined collection")
+    parser.add_argument("-x", "--relax", type=int, default=0, 
+                        help="relax to allow non-smooth factors")
+    parser.add_argument("-o", "--output", type=str, default=COMPILED_PATH,
+                        help="directory for the compiled artifacts")
+    args = parser.parse_args()
+
+    for name in args.solutions:
+        filename = compile_collection(name.split(','), args.relax, 
+                                      args.output)
+        print(f'Compiled {name} to {filename}')
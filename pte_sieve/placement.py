@@ -0,0 +1,187 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+# placement.py
+#
+# Placement of the worker processes on the CPUs and NUMA nodes of the host,
+# within the limits of its container.
+
+import os, mmap, ctypes
+from pathlib import Path
+
+# Size of a transparent huge page on x86-64 and arm64.
+HUGE_PAGE = 2**21
+
+
+def read_text(path):
+    '''Return the stripped contents of a file, or None if it is missing.'''
+    try:
+        return Path(path).read_text().strip()
+    except OSError:
+        return None
+
+
+def parse_cpulist(s):
+    '''Parse a list of CPUs such as 0-3,8,10-11.'''
+    cpus = []
+    for part in s.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus += range(int(first), int(last) + 1)
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def cgroup_file(controller, name):
+    '''Return the contents of a file of the cgroup of this process, for
+    cgroup v2 if controller is None and else for the cgroup v1 controller.
+    In a container, the cgroup is usually mounted at the root, otherwise
+    it is found with the path in /proc/self/cgroup.
+    '''
+    root = Path('/sys/fs/cgroup')
+    if controller is not None:
+        root /= controller
+    paths = [root / name]
+    for line in (read_text('/proc/self/cgroup') or '').splitlines():
+        _, controllers, path = line.split(':', 2)
+        if (controller is None and controllers == '' or
+            controller in controllers.split(',')):
+            paths.insert(0, root / path.lstrip('/') / name)
+    for path in paths:
+        value = read_text(path)
+        if value is not None:
+            return value
+    return None
+
+
+def cpu_quota():
+    '''Return the CPU quota of the cgroup in CPUs, or None if unlimited.'''
+    value = cgroup_file(None, 'cpu.max')
+    if value is not None:
+        quota, period = value.split()
+        return None if quota == 'max' else int(quota)/int(period)
+    quota = cgroup_file('cpu', 'cpu.cfs_quota_us')
+    period = cgroup_file('cpu', 'cpu.cfs_period_us')
+    if quota is None or period is None or int(quota) <= 0:
+        return None
+    return int(quota)/int(period)
+
+
+def memory_limit():
+    '''Return the memory limit in bytes of the cgroup, or of the host if
+    that is smaller, or None if unknown.
+    '''
+    limits = []
+    value = (cgroup_file(None, 'memory.max')
+             or cgroup_file('memory', 'memory.limit_in_bytes'))
+    # Without a limit, cgroup v1 reports a number close to 2**63.
+    if value is not None and value != 'max' and int(value) < 2**60:
+        limits.append(int(value))
+    for line in (read_text('/proc/meminfo') or '').splitlines():
+        if line.startswith('MemTotal:'):
+            limits.append(int(line.split()[1])*1024)
+    return min(limits) if limits else None
+
+
+def allowed_cpus():
+    '''Return the sorted list of CPUs this process may run on.'''
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def numa_nodes(cpus):
+    '''Return a dictionary from the NUMA nodes to their CPUs among cpus,
+    ordered such that the first hardware thread of each core comes before
+    the second ones. Without NUMA information, all CPUs are on node 0.
+    '''
+    nodes = {}
+    for path in sorted(Path('/sys/devices/system/node').glob('node[0-9]*')):
+        cpulist = read_text(path / 'cpulist')
+        node_cpus = [c for c in parse_cpulist(cpulist or '') if c in cpus]
+        if node_cpus:
+            nodes[int(path.name[4:])] = node_cpus
+    if not nodes:
+        nodes = {0: list(cpus)}
+
+    def thread_index(cpu):
+        # Index of the CPU among the hardware threads of its core.
+        siblings = read_text(f'/sys/devices/system/cpu/cpu{cpu}/topology/'
+                             + 'thread_siblings_list')
+        siblings = parse_cpulist(siblings) if siblings else [cpu]
+        return siblings.index(cpu) if cpu in siblings else 0
+
+    return {node: sorted(node_cpus, key=lambda c: (thread_index(c), c))
+            for node, node_cpus in nodes.items()}
+
+
+def default_workers(worker_memory, threads=1):
+    '''Return the number of worker processes with the given number of
+    sieve threads and bytes of memory each that fit into the CPUs, the CPU
+    quota and the memory limit of this process, and a line describing it.
+    '''
+    cpus = len(allowed_cpus())
+    quota = cpu_quota()
+    limit = memory_limit()
+    usable = cpus if quota is None else max(1, min(cpus, int(quota)))
+    workers = max(1, usable // threads)
+    text = f'{cpus} CPUs'
+    if quota is not None:
+        text += f', CPU quota {quota:g}'
+    if limit is not None:
+        workers = max(1, min(workers, limit // worker_memory))
+        text += f', memory limit {limit/2**30:.1f} GB'
+    text += (f', {worker_memory/2**20:.0f} MB and {threads} threads per'
+             + f' process: {workers} processes')
+    return workers, text
+
+
+def plan_layout(workers, threads=1):
+    '''Assign threads CPUs to each of the workers, all on one NUMA node.
+    Each worker goes to the node with the most free CPUs, the CPUs are
+    taken in the order of numa_nodes, so that the workers use separate
+    cores as long as there are enough of them. If there are fewer CPUs
+    than workers times threads, the CPUs are shared in turn.
+    Returns a list of pairs (node, cpus), one for each worker.
+    '''
+    nodes = numa_nodes(allowed_cpus())
+    free = {node: list(cpus) for node, cpus in nodes.items()}
+    layout = []
+    for _ in range(workers):
+        if not any(free.values()):
+            free = {node: list(cpus) for node, cpus in nodes.items()}
+        node = max(free, key=lambda node: len(free[node]))
+        cpus, free[node] = free[node][:threads], free[node][threads:]
+        layout.append((node, cpus))
+    return layout
+
+
+def describe(layout):
+    '''Return lines describing a layout of plan_layout.'''
+    return [f'Process {i}: node {node}, CPUs {",".join(map(str, cpus))}'
+            for i, (node, cpus) in enumerate(layout)]
+
+
+def pin(cpus):
+    '''Restrict this process and the threads it starts later to cpus.
+    With the default memory policy of Linux, memory touched afterwards is
+    then allocated on the NUMA node of these CPUs.
+    '''
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+
+
+def local_buffer(size, huge_pages=False):
+    '''Return a zeroed ctypes buffer of size bytes in an anonymous memory
+    map, optionally backed by transparent huge pages. All pages are touched
+    here, so that they are allocated on the NUMA node of the calling
+    thread, not on that of the first sieve thread writing to them.
+    '''
+    page = HUGE_PAGE if huge_pages else mmap.PAGESIZE
+    mm = mmap.mmap(-1, max(page, -(-size // page)*page))
+    if huge_pages and hasattr(mmap, 'MADV_HUGEPAGE'):
+        mm.madvise(mmap.MADV_HUGEPAGE)
+    # The buffer keeps the memory map alive.
+    buffer = (ctypes.c_char * size).from_buffer(mm)
+    ctypes.memset(buffer, 0, size)
+    return buffer
@@ -0,0 +1,385 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+# planner.py
+#
+# Estimate the x range, the number of results and the runtime of a search
+# with the PTE sieve before launching it.
+
+import time
+from itertools import combinations
+from math import log, ceil
+from primes.parse import read_primes
+from sieve import SieveEngine, TreeScan
+from pte_solutions import check_interval, load_collection
+
+def iroot(n, k):
+    '''Return the integer k-th root floor(n^(1/k)) of n >= 0.'''
+    if n < 2:
+        return n
+    # Start above the root and use Newton's method.
+    x = 1 << ((n.bit_length() + k - 1)//k)
+    while True:
+        y = ((k-1)*x + n//x**(k-1))//k
+        if y >= x:
+            return x
+        x = y
+
+
+def x_range(solution, min_bits, max_bits):
+    '''Return the range [xL, xR) of x for which p = 2*f(x)/c - 1 of the
+    solution has min_bits to max_bits bits.
+    '''
+    # p+1 = 2*f(x)/c and f(x) is about x^degree, the roots are small.
+    xL = iroot((abs(solution.c) << (min_bits-1))//2, solution.degree)
+    xR = iroot((abs(solution.c) << max_bits)//2, solution.degree) + 1
+    return xL, xR
+
+
+def dickman_rho(u, steps=100):
+    '''Compute the Dickman rho function by integrating the delay
+    differential equation u*rho'(u) = -rho(u-1) with the trapezoidal rule
+    with the given number of steps per unit interval.
+    '''
+    if u <= 1:
+        return 1.0
+    h = 1/steps
+    n = ceil(u*steps)
+    rho = [1.0]*(steps+1)
+    for i in range(steps+1, n+1):
+        # rho(t) = rho(t-h) - int_{t-h}^{t} rho(s-1)/s ds
+        t = i*h
+        rho.append(rho[i-1] - h/2*(rho[i-1-steps]/(t-h) + rho[i-steps]/t))
+    # Interpolate linearly between the last two grid points.
+    frac = (n - u*steps)
+    return max(rho[n] + frac*(rho[n-1] - rho[n]), 0.0)
+
+
+def prime_factor(solution, alpha=1.0, bound=100, max_modulus=2**16):
+    '''Return the factor by which p = 2*f(x)/c - 1 is more likely to be prime
+    than a random integer of its size: for each small prime q, the fraction
+    of residues x mod q^(e+1) with q^e || c, c | f(x) and p not divisible
+    by q, compared to (1 - 1/q). A residue is weighted by q^(1-alpha) for 
+    each linear term it makes divisible by q, since the terms are smooth.
+    '''
+    # p is odd.
+    factor = 2.0
+    for q in small_primes(bound)[1:]:
+        e = 0
+        c = solution.c
+        while c % q == 0:
+            c //= q
+            e += 1
+        m = q**(e+1)
+        if m > max_modulus:
+            continue
+        c_inv = pow(c, -1, q)
+        total = 0.0
+        nonzero = 0.0
+        for r in range(m):
+            f = solution.f_eval(r) % m
+            if f % q**e:
+                # c does not divide f(x).
+                continue
+            terms = sum(1 for u in solution.setroots if (r - u) % q == 0)
+            weight = q**((1 - alpha)*terms)
+            total += weight
+            # p = 2*f(x)/c - 1 mod q.
+            if (2*(f//q**e)*c_inv - 1) % q != 0:
+                nonzero += weight
+        if total:
+            factor *= nonzero/total/(1 - 1/q)
+    return factor
+
+
+def divisible_fraction(roots, q, e, alpha=1.0):
+    '''Return the fraction of x for which q^e divides prod(x - u) over
+    the roots u with multiplicity. The residue classes of x modulo powers
+    of q are refined only where they still contain roots. A class modulo m
+    has weight m^-alpha, where alpha < 1 accounts for smooth numbers being
+    divisible by small primes more often.
+    '''
+    fraction = 0.0
+    # Residue class r mod m of x and valuation of f(x) known so far.
+    stack = [(0, 1, 0)]
+    while stack:
+        r, m, v = stack.pop()
+        if v >= e:
+            fraction += m**-alpha
+            continue
+        m_next = m*q
+        children = {u % m_next for u in roots if u % m == r}
+        for r_next in children:
+            count = sum(1 for u in roots if u % m_next == r_next)
+            stack.append((r_next, m_next, v + count))
+    return fraction
+
+
+def c_fraction(solution, primes, alpha=1.0):
+    '''Return the fraction of x for which c divides f(x), i.e. for which 
+    p = 2*f(x)/c - 1 is an integer, see divisible_fraction.
+    '''
+    c = abs(solution.c)
+    fraction = 1.0
+    for q in primes:
+        if q*q > c:
+            break
+        e = 0
+        while c % q == 0:
+            c //= q
+            e += 1
+        if e:
+            fraction *= divisible_fraction(solution.ui, q, e, alpha)
+    if c > 1:
+        # The remaining cofactor is treated as a prime.
+        fraction *= divisible_fraction(solution.ui, c, 1, alpha)
+    return fraction
+
+
+def small_primes(bound):
+    '''Return the list of primes less than bound.'''
+    is_prime = bytearray([1])*bound
+    is_prime[:2] = b'\x00\x00'
+    for q in range(2, int(bound**0.5) + 1):
+        if is_prime[q]:
+            is_prime[q*q::q] = bytearray(len(range(q*q, bound, q)))
+    return [q for q in range(bound) if is_prime[q]]
+
+
+def relaxed_weights(solution, correlation, relax=0):
+    '''Return the list W, where W[k] is the sum of the pair correlation
+    products of the smooth roots over the ways to choose k non-smooth
+    roots, as allowed by relax: up to relax of the single roots of f and
+    up to relax of the single roots of g, see build_relaxed_patterns.
+    With relax = 0, W = [product over all pairs of roots].
+    '''
+    single_u = solution.single_ui if relax else []
+    single_v = solution.single_vi if relax else []
+    W = [0.0]*(2*relax + 1)
+    for i in range(min(relax, len(single_u)) + 1):
+        for j in range(min(relax, len(single_v)) + 1):
+            for failed_u in combinations(single_u, i):
+                for failed_v in combinations(single_v, j):
+                    failed = failed_u + failed_v
+                    roots = [r for r in solution.setroots if r not in failed]
+                    w = 1.0
+                    for m in range(len(roots)):
+                        for l in range(m):
+                            w *= correlation[roots[m] - roots[l]]
+                    W[i + j] += w
+    return W
+
+
+def sample(engine, T, b, sols, logB, tree_scan=None):
+    '''Sieve and scan one interval [T, T+b) as the PTE sieve does, with
+    tree_scan if given and check_interval otherwise. Returns the observed smooth density, the calibration factor against
+    the Dickman rho function, the exponent alpha such that a smooth x is
+    divisible by a small prime q with probability about q^-alpha, the 
+    pair correlations and the time per x.
+    The pair correlation for a gap d is the density of smooth pairs
+    (x, x+d) divided by the squared density, e.g. larger than 1 for even
+    d since both or none of x and x+d are even.
+    '''
+    # The patterns at the last positions reach max_range beyond b.
+    b_ext = b + sols.max_range
+    buffer = engine.new_buffer(b_ext)
+    start = time.time()
+    engine.sieve(T, b_ext, buffer)
+    if tree_scan is not None:
+        # The C scan reads the sieve result in place, as in the search.
+        tree_scan.scan(T, b, buffer)
+    else:
+        check_interval(T, b, bytearray(buffer), sols)
+    seconds = time.time() - start
+    positions = bytearray(buffer)
+
+    density = sum(positions[:b])/b
+    rho = dickman_rho(log(T + b//2)/(logB*log(2)))
+
+    # Fit alpha from the smooth x divisible by small primes.
+    smooth = sum(positions[:b])
+    alphas = []
+    for q in [2, 3, 5, 7]:
+        multiples = sum(positions[(-T) % q:b:q])
+        if smooth and multiples:
+            alphas.append(-log(multiples/smooth)/log(q))
+    alpha = sum(alphas)/len(alphas) if alphas else 1.0
+
+    # Count the smooth pairs with big integers holding one position per
+    # byte, as for the bit-sliced checks.
+    n = b - sols.max_range
+    bits = int.from_bytes(bytes(positions[:b]), 'little')
+    first = bits & ((1 << 8*n) - 1)
+    correlation = [1.0]
+    for d in range(1, sols.max_range + 1):
+        pairs = bin(first & (bits >> 8*d)).count('1')
+        correlation.append(pairs/n/density**2 if density else 1.0)
+
+    return density, density/rho, alpha, correlation, seconds/b
+
+
+def plan(names, min_bits, max_bits, logB, b, use_c=0, relax=0, samples=2,
+         L=None, R=None, c_scan=False):
+    '''Estimate a search for twin smooth integers with p of min_bits to
+    max_bits bits using the given solution lists. The search range [L, R)
+    is the union of the x ranges of the solutions unless it is given.
+    Returns a dictionary with the x range, the calibration, expected
+    results and primes per solution and the estimated CPU hours.
+    '''
+    sols = load_collection(names, relax)
+    primes, log_primes = read_primes(logB)
+
+    # x range for each solution such that p has the target size, the 
+    # search range covers all of them.
+    ranges = [x_range(sol, min_bits, max_bits) for sol in sols.solutions.values()]
+    if L is None:
+        L = min(xL for xL, _ in ranges)
+    if R is None:
+        R = max(xR for _, xR in ranges)
+
+    # Calibrate the smooth density on sample intervals spread over the
+    # range and benchmark the sieve and scan.
+    engine = SieveEngine(logB, primes, log_primes, use_c)
+    tree_scan = None
+    if c_scan and use_c in (64, 128) and relax == 0:
+        tree_scan = TreeScan(sols, use_c)
+    points = [L + (R - L - b)*i//max(samples-1, 1) for i in range(samples)]
+    calibration = [sample(engine, max(T, L), b, sols, logB, tree_scan)
+                   for T in points]
+    engine.close()
+    k = sum(c[1] for c in calibration)/len(calibration)
+    alpha = sum(c[2] for c in calibration)/len(calibration)
+    correlation = [sum(c[3][d] for c in calibration)/len(calibration)
+                   for d in range(sols.max_range + 1)]
+    seconds_per_x = sum(c[4] for c in calibration)/len(calibration)
+
+    def density(x):
+        return min(k*dickman_rho(log(x)/(logB*log(2))), 1.0)
+
+    # Integrate the hit probability over log-spaced subintervals. The 
+    # distinct linear terms are smooth with the calibrated density, 
+    # corrected by the pair correlations of their distances. With relax, 
+    # a hit may also have up to relax non-smooth single roots in each of
+    # f and g, which are not smooth with probability 1 - density.
+    per_solution = []
+    for sol, (xL, xR) in zip(sols.solutions.values(), ranges):
+        n = len(sol.setroots)
+        pf = prime_factor(sol, alpha)
+        # Patterns are checked for x and, unless the solution is 
+        # symmetric, for -x. A hit also needs c to divide f(x).
+        weight = (1 if sol.symmetric else 2)*c_fraction(sol, primes, alpha)
+        W = relaxed_weights(sol, correlation, relax)
+        hits = 0.0
+        primes_exp = 0.0
+        # Hits in the search range with p of the target size.
+        lo = max(L, xL)
+        hi = min(R, xR)
+        steps = 32 if lo < hi else 0
+        for i in range(steps):
+            a = lo*(hi/lo)**(i/steps)
+            e = lo*(hi/lo)**((i+1)/steps)
+            x = (a + e)/2
+            d = density(x)
+            h = (e - a)*weight*sum(w*d**(n - k)*(1 - d)**k 
+                                   for k, w in enumerate(W))
+            hits += h
+            # log(p) is about degree*log(x) + log(2/c).
+            log_p = sol.degree*log(x) + log(2/abs(sol.c))
+            primes_exp += h*min(pf/log_p, 1.0)
+        per_solution.append({'solution': [sol.ui, sol.vi],
+                             'collections': sol.collections,
+                             'x_range': (xL, xR), 'terms': n,
+                             'hits': hits, 'primes': primes_exp})
+
+    return {'L': L, 'R': R, 'calibration': k, 'alpha': alpha, 'b': b,
+            'densities': [c[0] for c in calibration],
+            'seconds_per_x': seconds_per_x,
+            'cpu_hours': seconds_per_x*(R - L)/3600,
+            'hits': sum(s['hits'] for s in per_solution),
+            'primes': sum(s['primes'] for s in per_solution),
+            'solutions': per_solution}
+
+
+
+def main(args):
+    '''Print the plan for a search.
+    Arguments:
+        args[0]: list of solution list names
+        args[1], args[2]: minimal and maximal bit size of p
+        args[3]: log of the smoothness bound
+        args[4]: length of the sample intervals
+        args[5]: sieve implementation used for the benchmark
+        args[6]: relax value
+        args[7]: number of sample intervals
+        args[8], args[9]: search range, or None for the computed range
+        args[10]: number of solutions to list
+        args[11]: number of cores
+        args[12]: check the patterns with the C code
+    '''
+    (names, min_bits, max_bits, logB, b, use_c, relax, samples, L, R, 
+     top, cores, c_scan) = args
+    p = plan(names, min_bits, max_bits, logB, b, use_c, relax, samples, L, R,
+             c_scan)
+
+    print(f'Search for 2^{logB}-smooth twins with {min_bits} to {max_bits}'
+          + f' bit p using {"+".join(names)}:')
+    print(f'x range: [{p["L"]}, {p["R"]}), log2 {log(p["L"], 2):.2f} to' 
+          + f' {log(p["R"], 2):.2f}')
+    print(f'Sampled smooth densities: ' 
+          + ', '.join(f'{d:.5f}' for d in p['densities']) 
+          + f', {p["calibration"]:.3f} times Dickman rho,'
+          + f' alpha = {p["alpha"]:.3f}')
+    print(f'Expected results: {p["hits"]:.1f}, primes: {p["primes"]:.2f}')
+    print(f'Sieve and scan: {p["seconds_per_x"]*1e9:.1f} ns per x value,' 
+          + f' {p["cpu_hours"]:.1f} CPU hours,'
+          + f' {p["cpu_hours"]/cores:.1f} hours on {cores} cores')
+    if p['hits']:
+        print(f'CPU hours per result: {p["cpu_hours"]/p["hits"]:.3g}'
+              + (f', per prime: {p["cpu_hours"]/p["primes"]:.3g}' 
+                 if p['primes'] else ''))
+
+    if top:
+        print(f'\nSolutions with the most expected results:')
+        ranked = sorted(p['solutions'], key=lambda s: -s['hits'])
+        for s in ranked[:top]:
+            print(f'{s["solution"][0]}, {s["solution"][1]}:'
+                  + f' x in [{s["x_range"][0]}, {s["x_range"][1]}),'
+                  + f' {s["hits"]:.2f} results, {s["primes"]:.3f} primes')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+                description='estimate yield and runtime of a PTE sieve search')
+    parser.add_argument("min_bits", type=int, 
+                        help="minimal bit size of p")
+    parser.add_argument("max_bits", type=int, 
+                        help="maximal bit size of p")
+    parser.add_argument("logB", type=int, 
+                        help="log of the smoothness bound")
+    parser.add_argument("-s", "--solutions", type=str, default="size-6", 
+                        help="solution lists, several lists separated by"
+                        + " commas are searched together")
+    parser.add_argument("-b", "--batch", type=int, default=2**16, 
+                        help="length of the sample intervals")
+    parser.add_argument("-c", "--use_c", type=int, default=0, 
+                        help="benchmark the C sieve (USE_C = 0/64/128)")
+    parser.add_argument("-x", "--relax", type=int, default=0, 
+                        help="relax to allow non-smooth factors")
+    parser.add_argument("-n", "--samples", type=int, default=2, 
+                        help="number of sample intervals")
+    parser.add_argument("-L", type=int, default=None, 
+                        help="left bound of the search range")
+    parser.add_argument("-R", type=int, default=None, 
+                        help="right bound of the search range")
+    parser.add_argument("--top", type=int, default=10, 
+                        help="number of solutions to list")
+    parser.add_argument("-p", "--processes", type=int, default=1, 
+                        help="number of cores for the wall time")
+    parser.add_argument("--c-scan", action="store_true", 
+                        help="benchmark the scan in C, with -c and without -x")
+    args = parser.parse_args()
+
+    main([args.solutions.split(','), args.min_bits, args.max_bits, 
+          args.logB, args.batch, args.use_c, args.relax, args.samples, 
+          args.L, args.R, args.top, args.processes, args.c_scan])
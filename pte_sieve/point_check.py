@@ -0,0 +1,245 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+# point_check.py
+#
+# Known-answer check of the sieve: the results recorded in results files
+# are searched for again in small windows around their x values.
+
+import re, sys, time
+from pathlib import Path
+from primes.parse import read_primes
+from sieve import SieveEngine, TreeScan, fastest_engine, C_LIMITS
+from pte_solutions import (check_interval, load_collection, primorial,
+                           verify_large_primes)
+from results import read_header, read_large_prime, read_results
+from audit import result_key
+
+# Results files are named {solutions name}_{logB}_{L}_to_{R}.txt.
+RESULTS_NAME = re.compile(r'(.+)_(\d+)_(\d+)_to_(\d+)\.txt$')
+
+
+def scan_position(x, solution):
+    '''Return the position xL at which the sieve finds x for solution,
+    the inverse of Collection.found_x. A positive x (after the shift) is
+    found in the plus direction at the end of the root set, a negative x
+    in the minus direction.
+    '''
+    x -= solution.shift
+    if x > 0:
+        return x - solution.maxroot
+    return -x
+
+
+def check_windows(engine, scan, starts, width):
+    '''Sieve the windows [T, T+width) for T in starts and scan their first
+    position. Returns a dictionary of the results by result_key.
+    '''
+    buffer = engine.new_buffer(len(starts)*width)
+    engine.sieve_windows(starts, width, buffer)
+    # One copy of all windows, the slices below are writable bytearrays.
+    positions = bytearray(buffer)
+    found = {}
+    for i, T in enumerate(starts):
+        for result in scan(T, positions[i*width:(i+1)*width]):
+            found[result_key(result)] = result
+    return found
+
+
+def same_result(record, result):
+    '''Whether a recorded result has the values of the new one.'''
+    return (record.p == result.p and record.isprime == result.isprime
+            and record.relaxed == result.relaxed
+            and record.large_primes == result.large_primes)
+
+
+def point_check(filename, use_c=None, exact=False, threads=1, relax=None,
+                logL=None, c_scan=False, batch=2**12, verbose=False):
+    '''Search for the results of a results file again. Each recorded x is
+    sieved in a window of the solution range at its scan position, so
+    that a run over a large range is checked in milliseconds. The
+    solution list and logB are taken from the file name and the header,
+    relax from the recorded results and logL from the header if None.
+    Returns a dictionary of the counts of the results that are
+    reproduced, changed (same x and solution, other values), missed,
+    new (found in a window but not recorded) and unknown (solution not
+    in the list), and the seconds spent sieving and scanning.
+    '''
+    m = RESULTS_NAME.search(Path(filename).name)
+    if m is None:
+        raise RuntimeError(f'{filename} is not named as a results file.')
+    solutions_name = m.group(1)
+    header = read_header(filename)
+    logB = header[0] if header is not None else int(m.group(2))
+    if logL is None:
+        logL = read_large_prime(filename)
+
+    # Keep one record per result, the files of resumed runs can repeat
+    # some of them.
+    records = {}
+    for record in read_results(filename):
+        records[(record.x, tuple(record.ui), tuple(record.vi))] = record
+    if relax is None:
+        # The smallest relax under which all recorded results are found.
+        relax = max((max(len([r for r in record.relaxed if r in record.ui]),
+                         len([r for r in record.relaxed if r in record.vi]))
+                     for record in records.values()
+                     if record.relaxed is not None), default=0)
+
+    primes, log_primes = read_primes(logB)
+    sols = load_collection([solutions_name], relax)
+    by_roots = {(tuple(sol.ui), tuple(sol.vi)): sol
+                for sol in sols.solutions.values()}
+
+    counts = {'reproduced': 0, 'changed': 0, 'missed': 0, 'new': 0,
+              'unknown': 0}
+    starts = set()
+    for key, record in records.items():
+        solution = by_roots.get(key[1:])
+        if solution is None:
+            counts['unknown'] += 1
+            if verbose:
+                print(f'unknown: {record}')
+            continue
+        starts.add(scan_position(record.x, solution))
+    starts = sorted(starts)
+    # The first position of a window and the solution range after it.
+    width = 1 + sols.max_range
+
+    end = starts[-1] + width if starts else 0
+    if use_c is None:
+        use_c = fastest_engine(end)
+    elif use_c in C_LIMITS and end > C_LIMITS[use_c]:
+        # The C sieve would overflow, e.g. with a SIGFPE.
+        raise RuntimeError(f'The windows reach {end}, beyond the'
+                           + f' {use_c}-bit C sieve.')
+    engine = SieveEngine(logB, primes, log_primes, use_c, threads, None,
+                         logL, exact)
+    tree_scan = None
+    if c_scan and use_c in (64, 128) and relax == 0:
+        tree_scan = TreeScan(sols, use_c)
+    P = primorial(primes) if logL else None
+
+    def scan(T, positions):
+        '''Return the results at T.'''
+        if tree_scan is not None:
+            results = tree_scan.scan(T, 1, positions)
+        else:
+            results = check_interval(T, 1, positions, sols)
+        if logL:
+            results = verify_large_primes(T, positions, results, P, logL)
+        return results
+
+    start_time = time.time()
+    found = {}
+    try:
+        # Bound the memory of the windows sieved at one time.
+        for i in range(0, len(starts), batch):
+            found.update(check_windows(engine, scan, starts[i:i+batch],
+                                       width))
+    finally:
+        engine.close()
+    counts['time'] = time.time() - start_time
+
+    for key, record in records.items():
+        if key[1:] not in by_roots:
+            continue
+        result = found.pop(key, None)
+        if result is None:
+            status = 'missed'
+        elif same_result(record, result):
+            status = 'reproduced'
+        else:
+            status = 'changed'
+        counts[status] += 1
+        if verbose and status != 'reproduced':
+            print(f'{status}: {record}')
+            if result is not None:
+                print(f'    now: {result}')
+    # Results at the scan positions of recorded ones for other solutions.
+    counts['new'] = len(found)
+    if verbose:
+        for result in found.values():
+            print(f'new: {result}')
+    return counts
+
+
+def main(args):
+    '''Check the results files.
+    Arguments:
+        args[0]: list of results files
+        args[1]: the sieve implementation (USE_C = 0/64/128), the fastest
+                 available one if None
+        args[2]: use the exact C sieve
+        args[3]: number of sieve threads
+        args[4]: relax, from the recorded results if None
+        args[5]: large prime bound logL, from the header if None
+        args[6]: check the patterns in C
+        args[7]: number of windows sieved at one time
+        args[8]: print the results that are not reproduced
+    Returns the number of results that are changed or missed, plus the
+    number of files that could not be checked.
+    '''
+    (filenames, use_c, exact, threads, relax, logL, c_scan, batch, 
+     verbose) = args
+    if exact and use_c not in (None, 64, 128):
+        raise RuntimeError('The exact sieve in C needs -c 64 or -c 128.')
+    failed = 0
+    for filename in filenames:
+        try:
+            counts = point_check(filename, use_c, exact, threads, relax,
+                                 logL, c_scan, batch, verbose)
+        except RuntimeError as e:
+            # E.g. a logB without prime tables, nothing is reproduced.
+            print(f'{filename}: not checked, {e}')
+            failed += 1
+            continue
+        total = sum(counts[status] for status in
+                    ('reproduced', 'changed', 'missed', 'unknown'))
+        print(f'{filename}: {total} results, {counts["reproduced"]}'
+              + f' reproduced, {counts["changed"]} changed,'
+              + f' {counts["missed"]} missed, {counts["new"]} new,'
+              + f' {counts["unknown"]} not in the solution list'
+              + f' - {1000*counts["time"]:.1f} ms')
+        failed += counts['changed'] + counts['missed']
+    if len(filenames) > 1:
+        print(f'Total changed, missed or not checked: {failed}')
+    return failed
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+                description='check that the sieve reproduces the results in'
+                + ' results files of the pte_sieve')
+    parser.add_argument("files", type=str, nargs='+',
+                        help="results files to check")
+    parser.add_argument("-c", "--use_c", type=int, default=None,
+                        choices=[0, 64, 128],
+                        help="sieve implementation (0 for python, 64 or 128"
+                        + " for C), the fastest available one by default")
+    parser.add_argument("-e", "--exact", default=False, action="store_true",
+                        help="use the exact sieve in C instead of the log"
+                        + " sieve")
+    parser.add_argument("-t", "--threads", type=int, default=1,
+                        help="number of threads sieving the windows")
+    parser.add_argument("-x", "--relax", type=int, default=None,
+                        help="allow up to RELAX non-smooth single roots in"
+                        + " f and g, from the recorded results by default")
+    parser.add_argument("-l", "--large-prime", type=int, default=None,
+                        help="large prime bound in bits, from the header of"
+                        + " the results file by default")
+    parser.add_argument("--c-scan", default=False, action="store_true",
+                        help="check the patterns of the solution tree in C")
+    parser.add_argument("--batch", type=int, default=2**12,
+                        help="number of windows sieved at one time")
+    parser.add_argument("-v", "--verbose", default=False,
+                        action="store_true",
+                        help="print the results that are not reproduced")
+    args = parser.parse_args()
+
+    failed = main([args.files, args.use_c, args.exact, args.threads,
+                   args.relax, args.large_prime, args.c_scan, args.batch,
+                   args.verbose])
+    # A nonzero exit status makes the check usable as a gate.
+    sys.exit(1 if failed else 0)
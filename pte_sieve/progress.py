@@ -0,0 +1,210 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+# progress.py
+#
+# Progress counters of the worker processes in shared memory and a live
+# summary of a search.
+
+import sys, time, struct
+from datetime import timedelta
+from threading import Thread, Event
+from multiprocessing import shared_memory
+
+# One slot per worker: a sequence number, L, R and T as pairs of 64-bit
+# words, the numbers of finished intervals, results and primes, the state
+# and the time of the last update.
+SLOT = struct.Struct('<Q2Q2Q2QQQQQd')
+
+# States of a worker.
+RUNNING = 0
+DONE = 1
+STOPPED = 2
+
+
+def split128(x):
+    '''Split 0 <= x < 2**128 into two 64-bit words.'''
+    return x & (2**64 - 1), x >> 64
+
+
+class ProgressBlock:
+    '''Class for a block of progress counters in shared memory, one slot
+    per worker. Each worker only writes its own slot. A sequence number
+    that is odd during an update lets readers retry instead of reading a
+    partly written slot, so no locks are needed.
+    The block is passed to the workers, which attach to it by name.
+    '''
+    def __init__(self, workers, name=None):
+        self.workers = workers
+        create = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=create,
+                                              size=workers*SLOT.size)
+        if create:
+            self.shm.buf[:workers*SLOT.size] = bytes(workers*SLOT.size)
+        self.seq = 0
+
+    def __reduce__(self):
+        # Attach to the same block in other processes.
+        return (self.__class__, (self.workers, self.shm.name))
+
+    def publish(self, i, L, R, T, intervals, hits, primes, state=RUNNING):
+        '''Write the counters of worker i.'''
+        offset = i*SLOT.size
+        buf = self.shm.buf
+        self.seq += 1
+        struct.pack_into('<Q', buf, offset, 2*self.seq - 1)
+        SLOT.pack_into(buf, offset, 2*self.seq - 1, *split128(L),
+                       *split128(R), *split128(T), intervals, hits, primes,
+                       state, time.time())
+        struct.pack_into('<Q', buf, offset, 2*self.seq)
+
+    def read(self, i):
+        '''Return a dictionary with the counters of worker i.'''
+        offset = i*SLOT.size
+        while True:
+            seq = struct.unpack_from('<Q', self.shm.buf, offset)[0]
+            values = SLOT.unpack_from(self.shm.buf, offset)
+            if seq % 2 == 0 and struct.unpack_from('<Q', self.shm.buf,
+                                                   offset)[0] == seq:
+                break
+            time.sleep(0)
+        (_, L0, L1, R0, R1, T0, T1, intervals, hits, primes, state,
+         updated) = values
+        return {'L': L0 + (L1 << 64), 'R': R0 + (R1 << 64),
+                'T': T0 + (T1 << 64), 'intervals': intervals, 'hits': hits,
+                'primes': primes, 'state': state, 'updated': updated}
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class ProgressMonitor:
+    '''Class to aggregate the progress counters of all workers and render
+    a summary with the rate, the lag of the slowest worker and the ETA.
+    A background thread prints a summary line every refresh seconds and,
+    with a port, serves the full summary as text on the local host.
+    '''
+    def __init__(self, block, refresh=5.0, port=None, out=sys.stderr):
+        self.block = block
+        self.refresh = refresh
+        self.port = port
+        self.out = out
+        self.start_time = time.time()
+        # Searched integers and time of the previous summary for the rate.
+        self.last = None
+        self.rate = 0.0
+        self.stopped = Event()
+        self.thread = None
+        self.server = None
+
+    def summary(self, update=True):
+        '''Return the aggregated progress as a dictionary. The rate is only
+        updated with update, i.e. by the summary lines.
+        '''
+        workers = [self.block.read(i) for i in range(self.block.workers)]
+        started = [w for w in workers if w['R'] > w['L']]
+        total = sum(w['R'] - w['L'] for w in started)
+        done = sum(w['T'] - w['L'] for w in started)
+        now = time.time()
+        if update:
+            if self.last is not None and now > self.last[1]:
+                rate = (done - self.last[0])/(now - self.last[1])
+                # Smooth the rate over the last summaries.
+                self.rate = (rate if not self.rate 
+                             else 0.5*self.rate + 0.5*rate)
+            elif self.last is None and now > self.start_time:
+                self.rate = done/(now - self.start_time)
+            self.last = (done, now)
+
+        fractions = [(w['T'] - w['L'])/(w['R'] - w['L']) for w in started]
+        mean = sum(fractions)/len(fractions) if fractions else 0.0
+        eta = None
+        if self.rate > 0:
+            # The slowest worker determines the end of the search.
+            remaining = max([w['R'] - w['T'] for w in started
+                             if w['state'] == RUNNING] or [0])
+            eta = remaining*len(started)/self.rate if started else 0.0
+        return {'done': done/total if total else 0.0, 'integers': done,
+                'rate': self.rate, 'eta': eta,
+                'intervals': sum(w['intervals'] for w in workers),
+                'hits': sum(w['hits'] for w in workers),
+                'primes': sum(w['primes'] for w in workers),
+                'running': sum(1 for w in started if w['state'] == RUNNING),
+                'workers': workers, 'fractions': fractions, 'mean': mean,
+                'now': now}
+
+    def line(self, s):
+        '''Return a one line summary.'''
+        eta = 'unknown' if s['eta'] is None else timedelta(
+                                                    seconds=round(s['eta']))
+        text = (f'{time.strftime("%H:%M:%S")} {s["done"]*100:.2f} %,'
+                + f' {s["rate"]:.4g} integers/s, {s["intervals"]} intervals,'
+                + f' {s["hits"]} results, {s["primes"]} primes,'
+                + f' {s["running"]} running, ETA {eta}')
+        if s['fractions']:
+            i = min(range(len(s['fractions'])),
+                    key=lambda i: s['fractions'][i])
+            lag = (s['fractions'][i] - s['mean'])*100
+            text += f', slowest worker {i}: {lag:+.2f} %'
+        return text
+
+    def text(self):
+        '''Return the full summary with a line for each worker.'''
+        s = self.summary(update=False)
+        lines = [self.line(s)]
+        states = {RUNNING: 'running', DONE: 'done', STOPPED: 'stopped'}
+        for i, w in enumerate(s['workers']):
+            if w['R'] <= w['L']:
+                lines.append(f'worker {i}: not started')
+                continue
+            fraction = (w['T'] - w['L'])/(w['R'] - w['L'])
+            lines.append(f'worker {i}: {states.get(w["state"], "?")},'
+                         + f' T={w["T"]}, {fraction*100:.2f} %'
+                         + f' ({(fraction - s["mean"])*100:+.2f} %),'
+                         + f' {w["intervals"]} intervals, {w["hits"]}'
+                         + f' results, {w["primes"]} primes, updated'
+                         + f' {s["now"] - w["updated"]:.1f}s ago')
+        return '\n'.join(lines) + '\n'
+
+    def run(self):
+        while not self.stopped.wait(self.refresh):
+            print(self.line(self.summary()), file=self.out, flush=True)
+
+    def start(self):
+        '''Start printing and, with a port, serving the summary.'''
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+        if self.port is not None:
+            self.server = serve(self, self.port)
+
+    def stop(self):
+        '''Stop the background thread and print a final summary.'''
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.server is not None:
+            self.server.shutdown()
+        print(self.line(self.summary()), file=self.out, flush=True)
+
+
+def serve(monitor, port):
+    '''Serve the text summary of a monitor on 127.0.0.1:port in a thread.'''
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = monitor.text().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            # Requests are not logged.
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -4,30 +4,79 @@
 #
 # Sieving algorithm to find twin smooth integers using PTE solutions.
 
-import sys, time, datetime
-import ctypes
-from math import log, ceil
+import sys, time, datetime, json, shutil, tempfile
+from math import ceil
 from pathlib import Path
 from primes.parse import read_primes
-from sieve import sieve, c_log_sieve_64, c_log_sieve_128
-from pte_solutions import solutions, Collection, check_sols
+from sieve import SieveEngine, TreeScan, sieve_pipeline, tune_batch
+from sieve_cache import SieveCache
+from pte_solutions import (check_interval, check_classes, load_collection, 
+                           certify, primorial, verify_large_primes, 
+                           SmoothStats)
+from progress import ProgressBlock, ProgressMonitor, DONE, STOPPED
+from audit import SieveAudit
+from placement import default_workers, plan_layout, describe, pin
 
-def pte_sieve(L, R, b, primes, log_primes, logB, sols, proc_num, results_file,
-              status_path, use_c, resume):
-    print(f'{proc_num}: Sieving from {L} to {R}...')
+def pte_sieve(L, R, b, primes, log_primes, logB, sols, proc_num, results_files,
+              status_path, use_c, resume, threads=1, depth=1, cache_dir=None,
+              cache_size=2**32, certificates=False, memory=2**28, logL=0,
+              events=None, control=None, progress=None, quiet=False, 
+              status_every=0, exact=False, audit=0, placement=None, 
+              huge_pages=False, classes=None, c_scan=False, levels=0,
+              audit_channel=None):
+    '''Search [L, R) for twin smooth integers from the solutions sols.
+    With a queue events, found results and the progress after each 
+    interval are also put on the queue as dictionaries, see search.py.
+    With a pair control = (running, stop) of events, the search waits 
+    after an interval while running is not set and stops if stop is set.
+    With a ProgressBlock progress, the position and counts are published 
+    in slot proc_num after each interval. With quiet, nothing is printed. 
+    The status file is written at most every status_every seconds, and 
+    after every interval with results.
+    With exact, the C code runs the exact sieve instead of the log sieve.
+    With 0 < audit <= 1, this fraction of the intervals is also sieved 
+    exactly in the background to estimate the errors of the log sieve,
+    by the audit_server of the parent process if audit_channel is a pair
+    of its request queue and the reply queue of this process.
+    With a pair placement = (node, cpus), the process and its threads run 
+    on these CPUs of the NUMA node. With huge_pages, the sieve buffers are 
+    backed by transparent huge pages.
+    With a triple classes = (modulus, residues, name), only the positions
+    in these residue classes mod modulus are scanned, as the pass name of 
+    a search by classes with its own status file.
+    With c_scan, the patterns are checked by the C code, see TreeScan.
+    With levels >= logB, the exact sieve records the smallest bound up to 
+    2**levels of each position in the cache, see SieveEngine.
+    Returns whether the full range has been searched.
+    '''
+    def say(*args, **kwargs):
+        if not quiet:
+            print(*args, **kwargs)
+
+    # Pin the process before it starts threads and allocates its buffers, 
+    # so that both stay on one NUMA node.
+    if placement is not None:
+        node, cpus = placement
+        pin(cpus)
+        say(f'{proc_num}: Running on node {node}, CPUs {cpus}')
+
+    say(f'{proc_num}: Sieving from {L} to {R}...')
 
     # File name for logging last finished interval and prime stats.
-    status_filename = status_path 
-    status_filename += f'/{sols.solutions_name}_{logB}_from_{L}_to_{R}'
-    status_filename += f'_status_{proc_num}.txt'
+    status_filename = status_name(status_path, sols, logB, L, R, proc_num, 
+                                  classes)
+
+    # Names of the solution lists in the collection, results and counts 
+    # are kept separately for each of them.
+    names = sols.collection_names
 
     if not resume:
         # Start on the left of the interval [L,R].
         T = L
         # Count the number of x values that produce twin smooth integers.
-        num_x = 0
+        num_x = {name: 0 for name in names}
         # Count the number of x values that make p=2*f(x)-1 prime. 
-        num_primes = 0
+        num_primes = {name: 0 for name in names}
     else:
         # Read stats and where to resume from status file.
         with open(status_filename, 'r') as status_file:
@@ -35,99 +84,413 @@ def pte_sieve(L, R, b, primes, log_primes, logB, sols, proc_num, results_file,
             s = s.strip()
             params = [int(i) for i in s.split(',')]
             T = params[5]
-            num_x = params[6]
-            num_primes = params[7] 
+            if len(names) == 1:
+                num_x = {names[0]: params[6]}
+                num_primes = {names[0]: params[7]}
+            else:
+                # Counts per solution list follow the total counts.
+                num_x = dict(zip(names, params[8::2]))
+                num_primes = dict(zip(names, params[9::2]))
 
-    # Extend the range by the maximum range occurring in the solutions 
-    # to overlap the intervals.
-    b_ext = b + sols.max_range
+    # With b = 'auto', the interval length is tuned at the start and 
+    # whenever the bit length of the integers changes.
+    auto = (b == 'auto')
    
-    if use_c == 64 or use_c == 128:
-        # Prepare prime data and result byte array to pass to C.
-        np = len(primes)
-        numbers = bytearray(b_ext)
-        numbers = memoryview(numbers)
-        c_primes = (ctypes.c_int * np)(*primes)
-        c_log_primes = (ctypes.c_char * np)(*log_primes)
-        c_positions = (ctypes.c_char * b_ext)(*numbers)
+    # Reuse sieve results of previous runs over the same range.
+    cache = None
+    if cache_dir is not None:
+        cache = SieveCache(cache_dir, cache_size)
 
-    # Count the number of sieve steps.
-    sieve_count = 0
+    # Compare the log sieve to the exact sieve on sampled intervals. The 
+    # auditor starts its worker before this process runs other threads.
+    auditor = None
+    if audit and use_c in (64, 128) and not exact:
+        auditor = SieveAudit(audit, logB, primes, log_primes, use_c, logL, 
+                             sols, seed=f'{L}_{proc_num}', 
+                             channel=audit_channel, proc_num=proc_num)
 
-    while T < R:
-        start_interval_time = time.time()
-        sieve_count += 1
+    # Prepare prime data, shared by all threads of this process.
+    engine = SieveEngine(logB, primes, log_primes, use_c, threads, cache, 
+                         logL, exact, huge_pages, levels)
+
+    # Check the patterns in C, only the matches come back to python.
+    tree_scan = None
+    if c_scan and use_c in (64, 128) and sols.relax == 0:
+        tree_scan = TreeScan(sols, use_c)
+
+    # In large prime mode, positions marked 2 by the sieve are verified 
+    # with the primorial of the primes less than 2**logB.
+    P = primorial(primes) if logL else None
 
-        if R-T < b:
+    def intervals(T, end):
+        '''Generate the intervals [T, T+length) to be sieved.'''
+        while T < end:
             # At the end of the range, the interval might be shorter.
-            # Extend the range by the maximum range occurring in the solutions
-            # to overlap the intervals.
-            b_ext = R - T + sols.max_range
-        
-        #################################################
-        if use_c == 64:
-            # Call the C sieve using 64-bit data types.
-            c_log_sieve_64(T, b, logB, np, ctypes.byref(c_primes), 
-                        ctypes.byref(c_log_primes), ctypes.byref(c_positions))
-            positions = bytearray(c_positions)
-        
-        elif use_c == 128:
-            # Call the C sieve using 128-bit data types.
-            c_log_sieve_128(T, b, logB, np, ctypes.byref(c_primes), 
-                        ctypes.byref(c_log_primes), ctypes.byref(c_positions))
-            positions = bytearray(c_positions)
+            yield T, min(b, end-T)
+            T += b
 
+    def scan(T, positions, n):
+        '''Return the results in the first n positions.'''
+        if tree_scan is not None:
+            results = tree_scan.scan(T, n, positions, 
+                                     None if classes is None else classes[:2])
+        elif classes is not None:
+            results = check_classes(T, n, positions, sols, *classes[:2])
         else:
-            # Call the python sieve. 
-            positions = sieve(T, b_ext, logB, primes)
-
-        #################################################
-        after_sieving_time = time.time()
-
-        # Run through the bitstring
-        for j in range(b):
-            # Start at the next smooth number
-            if positions[j]:
-                # Check whether any of the solution root patterns occur 
-                # at this position in the string.
-                results = check_sols(T,j,positions,sols)
-                
-                if not results == []:
-                    print(f'\n{proc_num} ', end='')
-                    for found in results:
-                        num_x += 1
-                        print(found)
-                        if found.isprime:
-                            num_primes += 1
-                        # Write to file
-                        with open(results_file, 'a', newline='') as sols_file:
-                            sols_file.write(f'{proc_num}, {found}\n')
-        
+            results = check_interval(T, n, positions, sols)
+        if logL:
+            results = verify_large_primes(T, positions, results, P, logL)
+        return results
+
+    def report(results):
+        '''Print and write the results, routed to their solution lists.'''
+        say(f'\n{proc_num} ', end='')
+        for found in results:
+            if len(names) > 1:
+                say(', '.join(found.solution.collections) + ': ', end='')
+            say(found)
+            if certificates:
+                # The factorizations of p+1 and p-1, once for all lists 
+                # of the solution.
+                cert = json.dumps(certify(found.x, found.solution, primes,
+                                          found.large_primes))
+            for name in found.solution.collections:
+                num_x[name] += 1
+                if found.isprime:
+                    num_primes[name] += 1
+                # Write to file
+                with open(results_files[name], 'a', 
+                          newline='') as sols_file:
+                    sols_file.write(f'{proc_num}, {found}\n')
+                if events is not None:
+                    events.put({'type': 'result', 'proc': proc_num, 
+                                'collection': name, 'x': found.x, 
+                                'solution': [found.solution.ui, 
+                                             found.solution.vi],
+                                'p': found.p, 'isprime': found.isprime,
+                                'relaxed': found.relaxed,
+                                'large_primes': found.large_primes})
+                if certificates:
+                    # Write the certificate to a file next to the 
+                    # results file.
+                    with open(results_files[name][:-4] + '_cert.jsonl', 
+                              'a', newline='') as cert_file:
+                        cert_file.write(cert + '\n')
+
+    def write_status(T, n):
+        '''Write the status file after the interval [T, T+n).'''
+        nonlocal status_time, status_end
+        total_x = sum(num_x.values())
+        total_primes = sum(num_primes.values())
         with open(status_filename, 'w', newline='') as status_file:
-            status_file.write(f'{proc_num}, {logB}, {L}, {R}, {T}, {T+b},'
-                              + f' {num_x}, {num_primes}\n\n')
-            status_file.write(f'Status file for process {proc_num} searching'
-                              + f' for twin 2^{logB}-smooth numbers in the'
-                              + f' range from {L} to {R}\n')
-            status_file.write(f'Last finished sieve interval: [{T}, {T+b}],'
-                              + f' {(T+b-L)/(R-L)*100} % done.\n')
-            status_file.write(f'Number of x values that produce twin smooth'
-                              + f' integers in [{L}, {T+b}]: {num_x}\n')
-            status_file.write(f'Number of x values that produce prime 2*f(x)-1'
-                              + f' in [{L}, {T+b}]: {num_primes}\n')
+            status_file.write(f'{proc_num}, {logB}, {L}, {R}, {T},'
+                              + f' {T+n}, {total_x}, {total_primes}')
+            if len(names) > 1:
+                for name in names:
+                    status_file.write(f', {num_x[name]},'
+                                      + f' {num_primes[name]}')
+            status_file.write('\n\n')
+            status_file.write(f'Status file for process {proc_num}'
+                              + f' searching for twin 2^{logB}-smooth'
+                              + f' numbers in the range from {L} to {R}\n')
+            status_file.write(f'Last finished sieve interval:'
+                              + f' [{T}, {T+n}],'
+                              + f' {(T+n-L)/(R-L)*100} % done.\n')
+            status_file.write(f'Number of x values that produce twin'
+                              + f' smooth integers in [{L}, {T+n}]:'
+                              + f' {total_x}\n')
+            status_file.write(f'Number of x values that produce prime'
+                              + f' 2*f(x)-1 in [{L}, {T+n}]:'
+                              + f' {total_primes}\n')
+            if len(names) > 1:
+                for name in names:
+                    status_file.write(f'{name}: {num_x[name]} x values,'
+                                      + f' {num_primes[name]} primes\n')
+        status_time = time.time()
+        status_end = T + n
+
+    def report_audit(audits):
+        '''Print and write the finished audits and the running estimates
+        to audit files next to the results files.
+        '''
+        for (T, n), audited in audits:
+            lines = {name: [] for name in names}
+            for collections, found in audited['missed']:
+                for name in collections:
+                    lines[name].append(f'{proc_num}, missed, {found}')
+            for found in audited['false']:
+                for name in found.solution.collections:
+                    lines[name].append(f'{proc_num}, false, {found}')
+            summary = f'{proc_num}, [{T}, {T+n}), {auditor.summary()}'
+            say(summary)
+            for name in names:
+                with open(results_files[name][:-4] + '_audit.txt', 'a', 
+                          newline='') as audit_file:
+                    for line in lines[name] + [summary]:
+                        audit_file.write(line + '\n')
+            if events is not None:
+                events.put({'type': 'audit', 'proc': proc_num, 'T': T, 
+                            'end': T+n, 'intervals': auditor.intervals,
+                            'positions': tuple(auditor.positions), 
+                            'results': tuple(auditor.results),
+                            **auditor.estimates()})
+
+    # Count the number of sieve steps.
+    sieve_count = 0
+    stopped = False
+    # Time and end of the last interval written to the status file.
+    status_time = 0
+    status_end = T
+    if progress is not None:
+        progress.publish(proc_num, L, R, T, 0, sum(num_x.values()), 
+                         sum(num_primes.values()))
+
+    while T < R and not stopped:
+        end = R
+        if auto:
+            # Tune b for the integers of the current bit length.
+            end = min(R, 2**T.bit_length())
+            b = tune_batch(engine, T, sols.max_range, memory, depth, scan)
+            say(f'{proc_num}: Tuned b = {b} for [{T}, {end})')
+        # Extend the range by the maximum range occurring in the solutions 
+        # to overlap the intervals. The overlap is copied from the next 
+        # interval, which is cached independently of the solutions.
+        b_ext = b + sols.max_range
+
+        # Sieve the next intervals in the background while scanning with 
+        # depth > 1 result buffers.
+        start_interval_time = time.time()
+        for T, n, buffer in sieve_pipeline(engine, intervals(T, end), b_ext, 
+                                           depth, sols.max_range):
+            sieve_count += 1
+            # Copy the sieve result for fast indexing in python. The C scan
+            # reads the buffer in place, through a view of its bytes. The 
+            # bitstring might be shorter at the end of the range, reused 
+            # buffers hold stale data beyond n + max_range.
+            if tree_scan is not None:
+                positions = memoryview(buffer).cast('B')
+            else:
+                positions = bytearray(buffer)
+
+            #################################################
+            after_sieving_time = time.time()
+
+            results = scan(T, positions, n)
+            # Whether lines are appended to the results or audit files.
+            appended = not results == []
+            if appended:
+                report(results)
+            if auditor is not None:
+                auditor.submit(T, n, positions[:n+sols.max_range], results)
+                audits = auditor.collect()
+                appended = appended or len(audits) > 0
+                report_audit(audits)
         
-        end_interval_time = time.time()
-        print(f'\n{proc_num}: Interval [{T}, {T+b-1}], {(T+b-L)/(R-L)*100} %, '
-              + f'time: {round(end_interval_time - start_interval_time, 3)}s,'
-              + f' spent on sieving:'
-              + f' {round(after_sieving_time - start_interval_time, 3)}')
-        sys.stdout.flush()
+            total_x = sum(num_x.values())
+            total_primes = sum(num_primes.values())
+            if progress is not None:
+                progress.publish(proc_num, L, R, T+n, sieve_count, total_x, 
+                                 total_primes)
+            # With status_every, the status file is written less often, 
+            # but always after lines were appended, so that a resumed 
+            # search does not append them again.
+            if appended or time.time() - status_time >= status_every:
+                write_status(T, n)
         
-        T += b
+            end_interval_time = time.time()
+            if not quiet:
+                print(f'\n{proc_num}: Interval [{T}, {T+n-1}],'
+                      + f' {(T+n-L)/(R-L)*100} %, time:'
+                      + f' {round(end_interval_time - start_interval_time, 3)}s,'
+                      + f' spent on sieving:'
+                      + f' {round(after_sieving_time - start_interval_time, 3)}')
+                sys.stdout.flush()
+
+            if events is not None:
+                events.put({'type': 'progress', 'proc': proc_num, 'L': L, 
+                            'R': R, 'T': T, 'end': T+n, 
+                            'done': (T+n-L)/(R-L), 'x': total_x, 
+                            'primes': total_primes,
+                            'seconds': end_interval_time 
+                                       - start_interval_time})
+            if control is not None:
+                running, stop = control
+                # Pause after a finished interval, the status file is up 
+                # to date.
+                if not running.is_set() and status_end < T+n:
+                    write_status(T, n)
+                running.wait()
+                if stop.is_set():
+                    stopped = True
+                    break
+
+            start_interval_time = time.time()
+
+        # Continue after the last interval.
+        T += n
     
+    engine.close()
+    if auditor is not None:
+        report_audit(auditor.close())
+
+    # Write the status of the last interval if it was skipped.
+    if status_end < T:
+        write_status(T-n, n)
+    if progress is not None:
+        progress.publish(proc_num, L, R, T, sieve_count, 
+                         sum(num_x.values()), sum(num_primes.values()),
+                         STOPPED if stopped else DONE)
+
+    if stopped:
+        # Continue with -r from the status file.
+        say(f'{proc_num}: Stopped at {T}.')
+        return False
+
     with open(status_filename, 'a', newline='') as status_file:
         status_file.write(f'Done!\n')
 
+    return True
+
+
+def status_name(status_path, sols, logB, L, R, proc_num, classes=None):
+    '''Return the name of the status file of process proc_num, for a pass
+    of a search by classes if classes = (modulus, residues, name).
+    '''
+    name = f'{status_path}/{sols.solutions_name}_{logB}_from_{L}_to_{R}'
+    if classes is not None:
+        name += f'_classes_{classes[2]}'
+    return name + f'_status_{proc_num}.txt'
+
+
+def prepare_files(sols, logB, L, R, logL=0, path='.', quiet=False):
+    '''Create the folders for the status and results files of a search of
+    [L, R) and start the results files with a header line. With quiet, 
+    the names of the results files are not printed.
+    Returns the status folder and a dictionary of results file names for 
+    the solution lists of the collection.
+    '''
+    # Create folders if they don't exist already.
+    status_path = str(Path(path) / f'status_{sols.solutions_name}_{logB}')
+    Path(status_path).mkdir(parents=True, exist_ok=True)
+    results_files = {}
+    for name in sols.collection_names:
+        results_path = str(Path(path) / f'results_{name}_{logB}')
+        Path(results_path).mkdir(parents=True, exist_ok=True)
+        # File name to store value x and solutions that generate found 
+        # twin smooth numbers.
+        results_file = results_path + f'/{name}_{logB}_{L}_to_{R}.txt'
+        if not quiet:
+            print('Printing results to file ' + results_file)
+        results_files[name] = results_file
+
+        with open(results_file, 'a', newline='') as sols_file:
+            sols_file.write(f'x values, solutions and p values of'
+                            + f' 2^{logB}-smooth twin numbers for x in the'
+                            + f' range from {L} to {R}'
+                            + (f', with one large prime up to 2^{logL}'
+                               + f' per linear term' if logL else '')
+                            + f' - {datetime.datetime.now()}\n')
+
+    return status_path, results_files
+
+
+def tune_tree(sols, engine, T, size=2**16):
+    '''Rebuild the solution tree of sols with the cost model of 
+    build_cost_tree, using the smoothness statistics of a sample sieve of 
+    size positions at T. Returns the expected costs of the checks at a 
+    smooth position before and after.
+    '''
+    buffer = engine.new_buffer(size + sols.max_range)
+    engine.sieve_threads(T, size + sols.max_range, buffer)
+    stats = SmoothStats(bytearray(buffer), sols.max_range)
+    before = sols.expected_cost(stats)
+    return before, sols.build_cost_tree(stats)
+
+
+def prime_powers(m):
+    '''Return the prime powers exactly dividing m.'''
+    powers = []
+    p = 2
+    while m > 1:
+        if p*p > m:
+            p = m
+        q = 1
+        while m % p == 0:
+            m //= p
+            q *= p
+        if q > 1:
+            powers.append(q)
+        p += 1
+    return powers
+
+
+def rank_classes(sols, engine, T, modulus, size=2**18):
+    '''Rank the residue classes mod modulus of the positions by their 
+    expected number of pattern matches, see Collection.class_yields, with 
+    the smooth densities of the residues mod the prime powers dividing 
+    modulus in a sample sieve of size positions at T. 
+    Returns the classes in decreasing order and the list of their rates
+    relative to the average rate.
+    '''
+    buffer = engine.new_buffer(size)
+    engine.sieve_threads(T, size, buffer)
+    positions = bytearray(buffer)
+    density = (size - positions.count(0))/size
+    weights = {}
+    for q in prime_powers(modulus):
+        weights[q] = []
+        for a in range(q):
+            residue = positions[(a - T) % q::q]
+            smooth = len(residue) - residue.count(0)
+            weights[q].append(smooth/len(residue)/density if density else 1.0)
+    rates = sols.class_yields(density, weights)
+    mean = sum(rates)/len(rates)
+    rates = [rate/mean if mean else 1.0 for rate in rates]
+    return sorted(range(modulus), key=lambda c: -rates[c]), rates
+
+
+def class_passes(classes, explore=1.0, first=64, bounds=()):
+    '''Split the first explore fraction of a number of ranked classes into
+    passes of a search by classes: the first 1/first of all classes, then 
+    as many as all passes before, and so on. Passes are also split at the
+    ranks in bounds, e.g. the ends of the passes of an earlier search with
+    a smaller fraction. Returns the ranges [start, end) of the ranks of 
+    the classes of each pass.
+    '''
+    end = min(classes, ceil(explore*classes))
+    splits = {end}
+    size = ceil(classes/first)
+    while size < end:
+        splits.add(size)
+        size *= 2
+    splits.update(bound for bound in bounds if 0 < bound < end)
+    splits = sorted(splits)
+    return list(zip([0] + splits[:-1], splits))
+
+
+def worker_memory(b, sols, use_c, depth=1, memory=2**28):
+    '''Estimate the memory in bytes used by a process of pte_sieve: the 
+    result buffers with the one held back by sieve_pipeline, the copy of 
+    the current one and, for the python sieve, 
+    the logs of the positions, or the budget for b = 'auto', and a fixed 
+    amount for the interpreter, the primes and the solutions.
+    '''
+    if b == 'auto':
+        return memory + 2**26
+    b_ext = b + sols.max_range
+    per_position = depth + 2 if use_c in (64, 128) else depth + 18
+    return per_position*b_ext + 2**26
+
+
+def split_range(L, R, num_proc):
+    '''Split [L, R) into num_proc subintervals, returns their bounds.'''
+    # Interval size (rounded up), the last process gets the rest.
+    interval = ceil((R-L)/num_proc)
+    # Left and right bounds for the subintervals.
+    Li = [L + i*interval for i in range(num_proc)]
+    Ri = [Li[i] for i in range(1, num_proc)] + [R]
+    return Li, Ri
+
 
 def main(args):
     import multiprocessing as mp
@@ -140,7 +503,8 @@ def main(args):
     if not L < R:
         raise RuntimeError('Left bound L must be less than right bound R.')
     
-    # Length of the batches to be sieved at one time.
+    # Length of the batches to be sieved at one time, or 'auto' to tune 
+    # it with calibration sieves.
     b = args[3]
 
     # Log of the smoothness bound, currently only allowing powers of 2.
@@ -149,22 +513,18 @@ def main(args):
     # Read a precomputed table of all primes less than B=2**logB.
     primes, log_primes = read_primes(logB)
 
-    # Number of processes among which to divide up the full interval.
-    num_proc = args[5]
-    # Interval size (rounded up), the last process gets the rest.
-    interval = ceil((R-L)/num_proc)
-    # Left and right bounds for the subintervals.
-    Li = [L + i*interval for i in range(num_proc)]
-    Ri = [Li[i] for i in range(1, num_proc)] + [R]
-
     # Relax to allow non-smooth factors.
     relax = args[7]
 
-    # Get the solutions.
-    solutions_name = args[6]
-    soldata = solutions[solutions_name]
-    # Parse the solutions.
-    sols = Collection(soldata, solutions_name, relax)
+    # Get the solutions, possibly several lists.
+    solutions_names = args[6]
+    if isinstance(solutions_names, str):
+        solutions_names = [solutions_names]
+    # Parse the solutions and combine them into a single collection such 
+    # that all lists are checked in one sieve pass. Use the compiled 
+    # artifact if there is one.
+    sols = load_collection(solutions_names, relax)
+    solutions_name = sols.solutions_name
 
     # Choose which implementation to use for the sieve.
     use_c = args[8]
@@ -172,37 +532,190 @@ def main(args):
     # Resume or start from scratch.
     resume = args[9]
 
-    # Create folders if they don't exist already.
-    results_path = f'results_{solutions_name}_{logB}'
-    Path(results_path).mkdir(parents=True, exist_ok=True)
-    status_path = f'status_{solutions_name}_{logB}'
-    Path(status_path).mkdir(parents=True, exist_ok=True)
-    # File name to store value x and solutions that generate found 
-    # twin smooth numbers.
-    results_file = results_path + f'/{solutions_name}_{logB}_{L}_to_{R}.txt'
-    print('Printing results to file ' + results_file)
+    # Number of threads per process for sieving each interval.
+    threads = args[10]
+
+    # Number of result buffers per process for overlapping sieve and scan.
+    depth = args[11]
+
+    # Directory and size in MB of the cache for sieve results.
+    cache_dir = args[12]
+    cache_size = args[13]*2**20
+
+    # Write factorization certificates for the results.
+    certificates = args[14]
 
-    with open(results_file, 'a', newline='') as sols_file:
-        sols_file.write(f'x values, solutions and p values of 2^{logB}-smooth'
-                        + f' twin numbers for x in the range from {L} to {R}'
-                        + f' - {datetime.datetime.now()}\n')
+    # Memory budget in MB per process for tuning b automatically.
+    memory = args[15]*2**20
+
+    # Allow one large prime of at most logL bits in each linear term.
+    logL = args[16]
+    if logL and not logB < logL <= 2*logB:
+        raise RuntimeError('The large prime bound logL must satisfy'
+                           + ' logB < logL <= 2*logB.')
+
+    # Print only a live summary of all processes instead of the output of 
+    # each process, every refresh seconds.
+    quiet = args[17]
+    refresh = args[18]
+
+    # Serve the summary as text on this local port.
+    port = args[19]
+
+    # Minimal number of seconds between writes of the status files.
+    status_every = args[20]
+
+    # Use the exact C sieve instead of the log sieve.
+    exact = args[21]
+
+    # Fraction of the intervals on which the log sieve is audited.
+    audit = args[22]
+    if audit and (use_c not in (64, 128) or exact):
+        raise RuntimeError('The audit compares the log sieve in C to the exact'
+                           + ' sieve, use it with -c and without -e.')
+
+    # Order the solution tree by a cost model sampled at L.
+    cost_tree = args[23]
+    if cost_tree and relax == 0:
+        engine = SieveEngine(logB, primes, log_primes, use_c, threads, None, 
+                             logL, exact)
+        before, after = tune_tree(sols, engine, L)
+        engine.close()
+        print(f'Solution tree: {before:.3f} -> {after:.3f} expected probes'
+              + f' per smooth position')
+
+    # Number of processes among which to divide up the full interval, with
+    # 0 as many as the CPUs, the CPU quota and the memory limit allow.
+    num_proc = args[5]
+    if num_proc == 0:
+        num_proc, text = default_workers(worker_memory(b, sols, use_c, depth,
+                                                       memory), threads)
+        print(f'Processes: {text}')
+    Li, Ri = split_range(L, R, num_proc)
+
+    # Pin each process to its own CPUs on one NUMA node.
+    pinned = args[24]
+    layout = [None]*num_proc
+    if pinned:
+        layout = plan_layout(num_proc, threads)
+        for line in describe(layout):
+            print(line)
+
+    # Back the sieve buffers with transparent huge pages.
+    huge_pages = args[25]
+
+    # Create folders and results files.
+    status_path, results_files = prepare_files(sols, logB, L, R, logL)
+
+    # Scan the residue classes mod this modulus with the most expected 
+    # pattern matches first, in passes over [L, R), up to the fraction 
+    # explore of the classes.
+    modulus = args[26]
+    explore = args[27]
+
+    # Check the patterns with the C code.
+    c_scan = args[28]
+    if c_scan and (use_c not in (64, 128) or relax):
+        raise RuntimeError('The scan in C needs -c and cannot be used with'
+                           + ' -x.')
+
+    # Sieve the smallest bound up to 2**levels of each position into the 
+    # cache, for later searches of the range with other bounds.
+    levels = args[29]
+    if levels and not (cache_dir is not None and logB <= levels 
+                       and not logL and not audit):
+        raise RuntimeError('The levels are stored in the cache, use --levels'
+                           + ' with --cache, at least logB and without -l'
+                           + ' or -a.')
+
+    passes = [None]
+    if modulus:
+        if relax or audit:
+            raise RuntimeError('The search by classes cannot be used with -x'
+                               + ' or -a.')
+        if not 0 < explore <= 1:
+            raise RuntimeError('The explored fraction must be in (0, 1].')
+        engine = SieveEngine(logB, primes, log_primes, use_c, threads, None, 
+                             logL, exact)
+        ranked, rates = rank_classes(sols, engine, L, modulus)
+        engine.close()
+        # The status files of a pass are named by the ranks of its classes.
+        # A resumed search keeps the passes of the earlier one.
+        bounds = []
+        if resume:
+            pattern = Path(status_name(status_path, sols, logB, Li[0], Ri[0],
+                                       0, (modulus, None, '*'))).name
+            for status in Path(status_path).glob(pattern):
+                bounds += status.name.split('_classes_')[1].split('_')[1:3]
+        passes = []
+        for start, end in class_passes(modulus, explore, 
+                                       bounds=map(int, bounds)):
+            residues = ranked[start:end]
+            rate = sum(rates[c] for c in residues)/len(residues)
+            print(f'Classes mod {modulus}, pass {len(passes) + 1}: classes'
+                  + f' {start} to {end - 1} by rank, {rate:.3f} times the'
+                  + f' average rate of matches')
+            passes.append((modulus, residues, f'{modulus}_{start}_{end}'))
+
+    # Every pass sieves all of [L, R). Without a cache, the later passes 
+    # read the sieve results of the first one from a temporary cache next
+    # to the status files. It does not hold the results with -l.
+    temporary_cache = None
+    if len(passes) > 1 and cache_dir is None and not logL:
+        temporary_cache = tempfile.mkdtemp(prefix='cache_', dir=status_path)
+        cache_dir = temporary_cache
+
+    # Progress counters of the processes in shared memory.
+    progress = ProgressBlock(num_proc)
+    monitor = None
+    if quiet or port is not None:
+        monitor = ProgressMonitor(progress, refresh, port, sys.stdout)
+        if port is not None:
+            print(f'Serving progress on http://127.0.0.1:{port}/')
 
     # #profiling
     # pr = cProfile.Profile()
     # pr.enable()
     
     start_time = time.time()
-    # Set up and start the parallel processes.
-    processes = []
-    for i in range(num_proc):
-        p = mp.Process(target=pte_sieve, args=(Li[i], Ri[i], b, primes, 
-                       log_primes, logB, sols, i, results_file, 
-                       status_path, use_c, resume))
-        processes.append(p)
-        p.start()
-
-    for p in processes:
-        p.join()
+    if monitor is not None:
+        monitor.start()
+    try:
+        for number, classes in enumerate(passes, 1):
+            if classes is not None:
+                print(f'Pass {number} of {len(passes)} over [{L}, {R})')
+            # A pass of a search by classes is resumed if it has been 
+            # started.
+            resume_pass = resume and (classes is None or Path(status_name(
+                            status_path, sols, logB, Li[0], Ri[0], 0, 
+                            classes)).exists())
+            # Set up and start the parallel processes.
+            processes = []
+            for i in range(num_proc):
+                p = mp.Process(target=pte_sieve, args=(Li[i], Ri[i], b, 
+                               primes, log_primes, logB, sols, i, 
+                               results_files, status_path, use_c, 
+                               resume_pass, threads, depth, cache_dir, 
+                               cache_size, certificates, memory, logL),
+                               kwargs={'progress': progress, 'quiet': quiet, 
+                                       'status_every': status_every, 
+                                       'exact': exact, 'audit': audit, 
+                                       'placement': layout[i], 
+                                       'huge_pages': huge_pages, 
+                                       'classes': classes, 
+                                       'c_scan': c_scan, 'levels': levels})
+                processes.append(p)
+                p.start()
+
+            for p in processes:
+                p.join()
+    finally:
+        if temporary_cache is not None:
+            shutil.rmtree(temporary_cache, ignore_errors=True)
+
+    if monitor is not None:
+        monitor.stop()
+    progress.close(unlink=True)
 
     end_time = time.time()
     print(f'Time: {round(end_time - start_time, 3)}s')
@@ -215,6 +728,11 @@ def main(args):
     # print(s.getvalue())
  
 
+def batch_size(s):
+    '''Parse the interval size b, an integer or 'auto'.'''
+    return 'auto' if s == 'auto' else int(s)
+
+
 if __name__ == '__main__':
     import argparse
 
@@ -223,24 +741,91 @@ if __name__ == '__main__':
                         help="left bound L of the sieving interval")
     parser.add_argument("R", type=int, 
                         help="right bound R of the sieving interval")
-    parser.add_argument("b", type=int, 
-                        help="size b of subintervals sieved in one iteration")
+    parser.add_argument("b", type=batch_size, 
+                        help="size b of subintervals sieved in one iteration,"
+                        + " 'auto' to tune it")
     parser.add_argument("logB", type=int, 
                         help="logarithm of the smoothness bound B")
-    parser.add_argument("-p", "--processes", type=int, default=1, 
-                        help="number of processes to be started in parallel")
+    parser.add_argument("-p", "--processes", type=int, default=0, 
+                        help="number of processes to be started in parallel,"
+                        + " by default as many as the CPUs, the CPU quota"
+                        + " and the memory limit allow")
     parser.add_argument("-s", "--solutions", type=str, default="size-6", 
-                        help="name of the solution list")
+                        help="name of the solution list, or several names"
+                        + " separated by commas to check in a single pass")
     parser.add_argument("-r", "--resume", default=False, 
                         help="resume from status files", action="store_true")
     parser.add_argument("-x", "--relax", type=int, default=0, 
-                        help="relax to allow non-smooth factors")
+                        help="relax to allow up to RELAX non-smooth linear"
+                        + " factors in each of f and g")
     parser.add_argument("-c", "--use_c", type=int, default=0, 
                         help="use the 64- or 128-bit C code (USE_C = 64/128)")
+    parser.add_argument("-t", "--threads", type=int, default=1, 
+                        help="number of threads per process sharing the C sieve")
+    parser.add_argument("-d", "--depth", type=int, default=1, 
+                        help="number of result buffers per process, sieving"
+                        + " ahead in the background if DEPTH > 1")
+    parser.add_argument("--cache", type=str, default=None, 
+                        help="directory to cache sieve results in")
+    parser.add_argument("--cache-size", type=int, default=4096, 
+                        help="maximal size of the cache in MB")
+    parser.add_argument("--certify", default=False, action="store_true",
+                        help="write factorizations of p+1 and p-1 for the"
+                        + " results to certificate files")
+    parser.add_argument("-m", "--memory", type=int, default=256, 
+                        help="memory budget in MB per process for b=auto")
+    parser.add_argument("-l", "--large-prime", type=int, default=0, 
+                        help="allow one large prime of at most LARGE_PRIME"
+                        + " bits in each linear factor, for logB <"
+                        + " LARGE_PRIME <= 2*logB")
+    parser.add_argument("-q", "--quiet", default=False, action="store_true",
+                        help="print a live summary of all processes instead"
+                        + " of the output of each process")
+    parser.add_argument("--refresh", type=float, default=5.0, 
+                        help="seconds between two lines of the live summary")
+    parser.add_argument("--http", type=int, default=None, 
+                        help="serve the live summary as text on"
+                        + " http://127.0.0.1:HTTP/")
+    parser.add_argument("--status-every", type=float, default=0, 
+                        help="minimal seconds between writes of the status"
+                        + " files without new results")
+    parser.add_argument("-e", "--exact", default=False, action="store_true",
+                        help="use the exact sieve in C instead of the log"
+                        + " sieve, with -c")
+    parser.add_argument("-a", "--audit", type=float, default=0, 
+                        help="fraction of the intervals on which the log"
+                        + " sieve is compared to the exact sieve")
+    parser.add_argument("--cost-tree", default=False, action="store_true",
+                        help="order the solution tree by the smoothness"
+                        + " statistics of a sample sieve at L")
+    parser.add_argument("--pin", default=False, action="store_true",
+                        help="pin each process to its own CPUs on one NUMA"
+                        + " node")
+    parser.add_argument("--huge-pages", default=False, action="store_true",
+                        help="back the sieve buffers with transparent huge"
+                        + " pages")
+    parser.add_argument("--classes", type=int, default=0, 
+                        help="scan the residue classes mod CLASSES with the"
+                        + " most expected matches first, e.g. 30030")
+    parser.add_argument("--explore", type=float, default=1.0, 
+                        help="fraction of the classes to be scanned with"
+                        + " --classes")
+    parser.add_argument("--c-scan", default=False, action="store_true",
+                        help="check the patterns with the C code, with -c")
+    parser.add_argument("--levels", type=int, default=0, 
+                        help="sieve exactly the smallest bound up to"
+                        + " 2^LEVELS of each integer into the cache, which"
+                        + " then serves searches with -e and any logB up to"
+                        + " LEVELS")
     args = parser.parse_args()
 
     filename = sys.argv[0]
     
     main([filename, args.L, args.R, args.b, args.logB, args.processes, 
-          args.solutions, args.relax, args.use_c, args.resume==True])
+          args.solutions.split(','), args.relax, args.use_c, args.resume==True, 
+          args.threads, args.depth, args.cache, args.cache_size, 
+          args.certify, args.memory, args.large_prime, args.quiet, 
+          args.refresh, args.http, args.status_every, args.exact, 
+          args.audit, args.cost_tree, args.pin, args.huge_pages, 
+          args.classes, args.explore, args.c_scan, args.levels])
     
\ No newline at end of file
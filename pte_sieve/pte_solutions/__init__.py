@@ -2,4 +2,9 @@
 # Licensed under the MIT license.
 # __init__()
 
-from .solutions import solutions, Collection, check_sols
\ No newline at end of file
+from .solutions import (solutions, Collection, check_sols, check_relaxed,
+                        check_interval, check_classes, combined_collection, 
+                        SmoothStats)
+from .compiled import compile_collection, load_collection
+from .certificate import (certify, verify_certificate, primorial, 
+                          large_primes, verify_large_primes)
\ No newline at end of file
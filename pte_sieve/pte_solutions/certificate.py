@@ -0,0 +1,174 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+# certificate.py
+#
+# Factorization certificates of p+1 and p-1 for found twin smooth integers.
+
+from math import prod, gcd
+from .primality import is_prime
+
+
+def factor_term(n, primes, large_primes=()):
+    '''Factor the positive integer n over the increasing list of primes 
+    by trial division. Known large primes dividing n are split off first,
+    and the division stops as soon as the remaining part is 1 or prime, 
+    so that smooth terms need only the primes up to their second largest
+    prime factor.
+    Returns a pair (factors, cofactor) of a dictionary mapping primes to 
+    exponents and the remaining cofactor without prime factors from the 
+    list.
+    '''
+    cofactor = 1
+    for q in large_primes:
+        while n % q == 0:
+            n //= q
+            cofactor *= q
+    factors = {}
+    for p in primes:
+        if n == 1:
+            break
+        if p*p > n:
+            # The remaining part is prime.
+            break
+        if n % p == 0:
+            e = 0
+            while n % p == 0:
+                n //= p
+                e += 1
+            factors[p] = e
+    if n > 1:
+        if n <= primes[-1]:
+            factors[n] = factors.get(n, 0) + 1
+        else:
+            cofactor *= n
+
+    return factors, cofactor
+
+
+def add_factors(total, factors, multiplicity=1):
+    '''Add the exponents of factors to the dictionary total.'''
+    for q, e in factors.items():
+        total[q] = total.get(q, 0) + multiplicity*e
+
+
+def certify(x, solution, primes, large_primes=()):
+    '''Compute the factorizations of p+1 = 2*f(x)/c and p-1 = 2*g(x)/c 
+    for p = 2*f(x)/c - 1 from the factorizations of the linear terms 
+    x-ui and x-vi instead of factoring p+1 and p-1. The large primes of 
+    a result are divided out of the linear terms before trial division.
+    Returns a dictionary that can be checked with verify_certificate. 
+    Its entries 'p+1' and 'p-1' are lists of pairs [q, e] of primes and 
+    exponents, 'cofactors' lists the parts of linear terms that are not 
+    smooth with respect to the primes.
+    '''
+    p = 2*solution.f_div_c(x) - 1
+    term_factors = {r: factor_term(abs(x - r), primes, large_primes or ())
+                    for r in solution.setroots}
+
+    cert = {'x': x, 'p': p, 'solution': [solution.ui, solution.vi], 
+            'cofactors': []}
+    for key, roots in [('p+1', solution.ui), ('p-1', solution.vi)]:
+        total = {2: 1}
+        for r in roots:
+            factors, cofactor = term_factors[r]
+            add_factors(total, factors)
+            if cofactor > 1:
+                # Non-smooth part of a linear term, e.g. for relaxed hits.
+                add_factors(total, {cofactor: 1})
+                if cofactor not in cert['cofactors']:
+                    cert['cofactors'].append(cofactor)
+        # Divide by c, whose prime factors all divide f(x) and g(x).
+        c = abs(solution.c)
+        for q in list(total):
+            while c % q == 0 and total[q] > 0:
+                c //= q
+                total[q] -= 1
+        if c != 1:
+            raise RuntimeError(f'c does not divide the linear terms at {x}.')
+        cert[key] = sorted([q, e] for q, e in total.items() if e > 0)
+
+    # Bit length of the largest prime factor of p+1 and p-1.
+    cert['smooth_bits'] = max(q.bit_length() 
+                              for key in ['p+1', 'p-1'] for q, _ in cert[key])
+
+    return cert
+
+
+def verify_certificate(cert, max_bits=None):
+    '''Check a certificate from certify: the factorizations multiply to 
+    p+1 and p-1, all factors are (probable) primes and, if max_bits is 
+    given, have at most max_bits bits.
+    '''
+    p = cert['p']
+    for key, value in [('p+1', p + 1), ('p-1', p - 1)]:
+        if prod(q**e for q, e in cert[key]) != abs(value):
+            return False
+        for q, _ in cert[key]:
+            if not is_prime(q):
+                return False
+            if max_bits is not None and q.bit_length() > max_bits:
+                return False
+
+    return True
+
+
+def primorial(primes):
+    '''Return the product of the primes, multiplied in a balanced tree.'''
+    values = list(primes) or [1]
+    while len(values) > 1:
+        values = [prod(values[i:i+2]) for i in range(0, len(values), 2)]
+    return values[0]
+
+
+def smooth_cofactor(n, P):
+    '''Return n without its prime factors that divide P, the primorial of
+    the factor base. Uses gcds instead of trial division.
+    '''
+    g = gcd(n, P % n)
+    while g > 1:
+        n //= g
+        g = gcd(n, g)
+    return n
+
+
+def large_primes(x, solution, P, logL, terms=None):
+    '''Check that the linear terms |x-r| of the solution are smooth up to
+    one large prime of at most logL bits, where P is the primorial of the 
+    primes less than 2**logB with logB < logL <= 2*logB. Only the terms in
+    the set terms are checked if it is given.
+    Returns the sorted list of the large primes, or None if a term has a 
+    larger cofactor.
+    '''
+    found = set()
+    for r in solution.setroots:
+        n = abs(x - r)
+        if terms is not None and n not in terms:
+            continue
+        # The cofactor has no prime factors less than 2**logB, so it is 
+        # prime if it has at most 2*logB bits.
+        cofactor = smooth_cofactor(n, P)
+        if cofactor.bit_length() > logL:
+            return None
+        if cofactor > 1:
+            found.add(cofactor)
+
+    return sorted(found)
+
+
+def verify_large_primes(T, positions, results, P, logL):
+    '''Keep the results whose linear terms marked as smooth up to a large 
+    prime by the sieve, i.e. with a 2 in positions for [T, T+len), have a 
+    prime cofactor of at most logL bits, and set their large primes.
+    '''
+    verified = []
+    for found in results:
+        terms = set()
+        for r in found.solution.setroots:
+            j = abs(found.x - r) - T
+            if 0 <= j < len(positions) and positions[j] == 2:
+                terms.add(T + j)
+        found.large_primes = large_primes(found.x, found.solution, P, logL, 
+                                          terms)
+        if found.large_primes is not None:
+            verified.append(found)
+    return verified
@@ -0,0 +1,179 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+# compiled.py
+#
+# Compiled collection artifacts for fast startup.
+
+import json, mmap, struct, hashlib
+from pathlib import Path
+from .solutions import solutions, Solution, Collection, combined_collection
+
+# Artifacts start with a fixed header holding the magic string, the format
+# version and the length of the JSON metadata that follows. The tree arrays
+# come after the metadata, each aligned to 8 bytes.
+ARTIFACT_MAGIC = b'PTECOLL\x00'
+ARTIFACT_VERSION = 1
+ARTIFACT_HEADER = struct.Struct('<8sII')
+
+# The flat arrays describing the solution tree of a Collection.
+TREE_ARRAYS = ['node_number', 'child_start', 'leaf_start', 'pattern_sol', 
+               'pattern_dir', 'pattern_start', 'pattern_roots']
+
+# Default directory for the artifacts.
+COMPILED_PATH = Path(__file__).parent / 'compiled'
+
+
+def source_hash():
+    '''Hash of the solution data and of the code building the tree. 
+    Artifacts built from other sources are ignored.
+    '''
+    h = hashlib.sha256()
+    for name in ['solution_data.py', 'solutions.py']:
+        h.update((Path(__file__).parent / name).read_bytes())
+    return h.hexdigest()
+
+
+def artifact_filename(solutions_names, relax, path=COMPILED_PATH):
+    '''Return the file name of the artifact for a (combined) collection.'''
+    return Path(path) / f'{"+".join(solutions_names)}_relax{relax}.ptec'
+
+
+def compile_collection(solutions_names, relax, path=COMPILED_PATH):
+    '''Build the collection of one or several solution lists and write it 
+    to a versioned binary artifact. Returns the file name.
+    '''
+    if len(solutions_names) == 1:
+        sols = Collection(solutions[solutions_names[0]], solutions_names[0], 
+                          relax)
+    else:
+        sols = combined_collection(solutions_names, relax)
+
+    meta = {
+        'source_hash': source_hash(),
+        'solutions_name': sols.solutions_name,
+        'relax': relax,
+        'collection_names': sols.collection_names,
+        'max_range': sols.max_range,
+        # Solutions as given in the solution data, with their lists.
+        'solutions': [sol.solution for sol in sols.solutions.values()],
+        'collections': [sol.collections for sol in sols.solutions.values()],
+        # Constants c for a quick check of the data, as strings since they 
+        # might not fit into JSON numbers.
+        'c': [str(sol.c) for sol in sols.solutions.values()],
+        'arrays': {},
+    }
+    # Place the arrays after the header and metadata.
+    blobs = []
+    offset = 0
+    for name in TREE_ARRAYS:
+        a = getattr(sols, name)
+        meta['arrays'][name] = [a.typecode, offset, len(a)]
+        blob = a.tobytes()
+        blob += bytes(-len(blob) % 8)
+        blobs.append(blob)
+        offset += len(blob)
+    meta_bytes = json.dumps(meta).encode()
+    meta_bytes += b' '*(-(ARTIFACT_HEADER.size + len(meta_bytes)) % 8)
+
+    filename = artifact_filename(solutions_names, relax, path)
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    with open(filename, 'wb') as file:
+        file.write(ARTIFACT_HEADER.pack(ARTIFACT_MAGIC, ARTIFACT_VERSION, 
+                                        len(meta_bytes)))
+        file.write(meta_bytes)
+        for blob in blobs:
+            file.write(blob)
+
+    return filename
+
+
+def read_artifact(filename):
+    '''Memory-map an artifact and return the Collection it describes, 
+    or None if it is missing, of another version, out of date or cannot 
+    be decoded, e.g. after an interrupted write.
+    '''
+    try:
+        with open(filename, 'rb') as file:
+            mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        return decode_artifact(mm, filename)
+    except (struct.error, ValueError, TypeError, KeyError, IndexError):
+        # ValueError includes the errors of json and of memoryview.cast.
+        return None
+
+
+def decode_artifact(mm, filename):
+    '''Return the Collection of the artifact mapped to mm, or None if it
+    is of another version or out of date. Raises the errors of struct, 
+    json and memoryview if it is corrupt.
+    '''
+    magic, version, meta_len = ARTIFACT_HEADER.unpack_from(mm)
+    if magic != ARTIFACT_MAGIC or version != ARTIFACT_VERSION:
+        return None
+    start = ARTIFACT_HEADER.size
+    meta = json.loads(bytes(mm[start:start+meta_len]))
+    if meta['source_hash'] != source_hash():
+        return None
+
+    # Fill in a collection without building the tree.
+    sols = Collection.__new__(Collection)
+    sols.solutions_name = meta['solutions_name']
+    sols.relax = meta['relax']
+    sols.collection_names = meta['collection_names']
+    sols.num_sols = len(meta['solutions'])
+    sols.solutions = {}
+    for i, (sol, names) in enumerate(zip(meta['solutions'], 
+                                         meta['collections'])):
+        sols.solutions[i] = Solution(sol, sols.relax)
+        sols.solutions[i].collections = names
+    sols.max_range = meta['max_range']
+    sols.artifact = str(filename)
+    if sols.relax >= 1:
+        sols.build_relaxed_patterns()
+
+    # The tree arrays are read-only views of the mapped file.
+    data = memoryview(mm)[start+meta_len:]
+    for name, (typecode, offset, length) in meta['arrays'].items():
+        size = struct.calcsize(typecode)
+        if offset + size*length > len(data):
+            # Truncated, e.g. by an interrupted write.
+            return None
+        setattr(sols, name, 
+                data[offset:offset+size*length].cast(typecode))
+
+    return sols
+
+
+def load_collection(solutions_names, relax, path=COMPILED_PATH):
+    '''Return the collection of one or several solution lists, from its
+    compiled artifact if there is an up-to-date one. Otherwise, the 
+    collection is built from the solution data.
+    '''
+    sols = read_artifact(artifact_filename(solutions_names, relax, path))
+    if sols is not None:
+        return sols
+    return build_collection(solutions_names, relax)
+
+
+def restore_collection(filename, solutions_names, relax):
+    '''Unpickle a collection that was read from the artifact filename in
+    another process. If the artifact has been deleted or replaced in the
+    meantime, the collection is built from the solution data instead.
+    '''
+    sols = read_artifact(filename)
+    if sols is not None:
+        return sols
+    return build_collection(solutions_names, relax)
+
+
+def build_collection(solutions_names, relax):
+    '''Build the collection of one or several solution lists from the 
+    solution data.
+    '''
+    if len(solutions_names) == 1:
+        return Collection(solutions[solutions_names[0]], solutions_names[0], 
+                          relax)
+    return combined_collection(solutions_names, relax)
+
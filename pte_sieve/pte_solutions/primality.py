@@ -12,7 +12,7 @@ def is_prime(n: int, t: int = 20):
         n = -n
     if n == 1:
         return False
-    if n == 2:
+    if n == 2 or n == 3:
         return True
     if n & 1 == 0:
         return False
@@ -5,14 +5,43 @@
 # Classes to handle solutions and collections of solution.
 
 from math import prod
-from collections import Counter
+from array import array
+from operator import mul
+from itertools import compress, chain
+from collections import Counter, deque
+from collections.abc import Mapping
 from .primality import is_prime
 
-# Import the solution data.
-from .solution_data import solutions
+
+class SolutionData(Mapping):
+    '''Dictionary of the solution lists by name. The solution data is 
+    only imported when a list is first accessed, which is not needed 
+    for collections loaded from compiled artifacts.
+    '''
+    def data(self):
+        # Import the solution data.
+        from .solution_data import solutions
+        return solutions
+
+    def __getitem__(self, name):
+        return self.data()[name]
+
+    def __iter__(self):
+        return iter(self.data())
+
+    def __len__(self):
+        return len(self.data())
+
+solutions = SolutionData()
+
 
 class Solution:
     '''Class to represent a PTE solution and its associated data.'''
+    __slots__ = ('solution', 'ui', 'vi', 'symmetric', 'degree', 'allroots',
+                 'shift', 'f0', 'g0', 'c', 'len_c', 'setroots', 'setui', 
+                 'setvi', 'maxroot', 'range', 'setroots_flip', 'single_ui', 
+                 'single_vi', 'collections')
+
     def __init__(self, solution, relax):
         # The solution, given as a tuple of two lists, 
         # each containing the roots of f or g.
@@ -63,36 +92,14 @@ class Solution:
         self.setroots_flip = sorted([-root + self.maxroot 
                                     for root in self.setroots])
 
-        if relax==1:
-            # Relax 1 of the linear terms in either f or g to be allowed to
-            # have larger factors, i.e. to be non-smooth.
-            self.relaxed_setroots = {}
-            self.relaxed_setroots_flip = {}
-            # Count multiplicities of roots.
+        if relax >= 1:
+            # Relax up to relax of the linear terms in each of f and g to be
+            # allowed to have larger factors, i.e. to be non-smooth. Only 
+            # single roots are relaxed.
             ctr_ui = Counter(self.ui)
             ctr_vi = Counter(self.vi)
-            # Collect only single roots.
             self.single_ui = [root for root in ctr_ui if ctr_ui[root] == 1]
             self.single_vi = [root for root in ctr_vi if ctr_vi[root] == 1]
-            if len(self.single_ui) == 0:
-                self.single_roots = [[v] for v in self.single_vi]
-            elif len(self.single_vi) == 0:
-                self.single_roots = [[u] for u in self.single_ui]
-            else:
-                self.single_roots = [[u,v] for u in self.single_ui 
-                                           for v in self.single_vi] 
-            # Produce rootsets with at most one single root removed from 
-            # each of the ui or vi.
-            for root in self.single_roots:
-                key = f'{root[0]}'
-                for r in root[1:]:
-                    key += f', {r}'
-                self.relaxed_setroots[key] = sorted([r for r in self.setroots 
-                                                     if not r in root])
-                relaxed_maxroot = (self.relaxed_setroots[key]
-                                        [len(self.relaxed_setroots[key]) - 1])
-                self.relaxed_setroots_flip[key] = sorted([-r + relaxed_maxroot 
-                                        for r in self.relaxed_setroots[key]])
 
     def f_eval(self, x):
         '''Evaluate the polynomial f(x) = prod(x-ui).'''
@@ -127,29 +134,208 @@ def check_sols(T, j, positions, sols):
     xL = T + j
     results = []
 
-    results = sols.traverse('0', xL, j, positions, results)
+    results = sols.traverse(xL, j, positions, results)
+
+    return results
+
+
+# Table to translate bytes to ASCII '0' for 0x00 and '1' otherwise.
+_TO_ASCII = bytes([48] + [49]*255)
+
+def to_bits(positions):
+    '''Convert a byte string into an integer that has bit j set if 
+    position j is non-zero.
+    '''
+    if len(positions) == 0:
+        return 0
+    return int(bytes(positions).translate(_TO_ASCII)[::-1], 2)
+
+
+def check_relaxed(T, n, positions, sols, chunk=2**16):
+    '''Collect solutions with matching bit strings at all positions j < n,
+    allowing up to sols.relax non-smooth single roots in each of f and g.
+    The positions are checked in parallel as bits of large integers in 
+    chunks of the given length. For each pattern, the failures of the 
+    single roots are counted with bit-sliced counters.
+    '''
+    relax = sols.relax
+    hits = []
+    for start in range(0, n, chunk):
+        m = min(chunk, n - start)
+        mask = (1 << m) - 1
+        bits = to_bits(positions[start:start + m + sols.max_range])
+        # Bitmaps shifted by each offset, computed when first needed.
+        shifted = {}
+
+        for key, direction, required, single_u, single_v in (
+                                                    sols.relaxed_patterns):
+            # Positions at which all required offsets are smooth.
+            match = mask
+            for offset in required:
+                if offset not in shifted:
+                    shifted[offset] = (bits >> offset) & mask
+                match &= shifted[offset]
+                if not match:
+                    break
+            
+            for single in (single_u, single_v):
+                if not match:
+                    break
+                # at_least[t] marks positions with more than t failures.
+                at_least = [0]*(relax+1)
+                for offset in single:
+                    if offset not in shifted:
+                        shifted[offset] = (bits >> offset) & mask
+                    fail = mask ^ shifted[offset]
+                    for t in range(relax, 0, -1):
+                        at_least[t] |= at_least[t-1] & fail
+                    at_least[0] |= fail
+                match &= ~at_least[relax]
+            
+            # Go through the matching positions.
+            while match:
+                j = (match & -match).bit_length() - 1
+                match &= match - 1
+                J = start + j
+                relaxed = [r for r, offset in zip(
+                           sols.solutions[key].single_ui 
+                           + sols.solutions[key].single_vi, 
+                           single_u + single_v) if not positions[J+offset]]
+                hits.append((J, key, direction, relaxed))
+
+    # Report the results in the order of their positions.
+    hits.sort(key=lambda hit: hit[0])
+    results = []
+    for J, key, direction, relaxed in hits:
+        sols.found_x(key, direction, T + J, results, relaxed)
+
+    return results
+
 
+def check_interval(T, n, positions, sols):
+    '''Collect the solutions matching at the first n positions, with 
+    check_relaxed if sols allows non-smooth factors.
+    '''
+    if sols.relax >= 1:
+        # Check all positions at once, allowing non-smooth factors.
+        return check_relaxed(T, n, positions, sols)
+    results = []
+    # Run through the bitstring
+    for j in range(n):
+        # Start at the next smooth number
+        if positions[j]:
+            # Check whether any of the solution root patterns occur at this 
+            # position in the string.
+            results += check_sols(T, j, positions, sols)
     return results
 
 
+def check_classes(T, n, positions, sols, modulus, residues):
+    '''Collect the solutions matching at the first n positions J for which
+    T+J is in one of the residue classes mod modulus, in the order of J.
+    '''
+    # Smooth positions of each class, picked with strided slices.
+    smooth = sorted(chain.from_iterable(
+                compress(range((r - T) % modulus, n, modulus), 
+                         positions[(r - T) % modulus:n:modulus])
+                for r in residues))
+    results = []
+    for j in smooth:
+        results += check_sols(T, j, positions, sols)
+    return results
+
+
+# Number of set bits of an integer, int.bit_count needs Python 3.10.
+popcount = getattr(int, 'bit_count', lambda m: bin(m).count('1'))
+
+
+class SmoothStats:
+    '''Class to estimate the probability that an offset d from a smooth
+    position is smooth, given that the offsets in a set S are smooth,
+    from the positions of a sample sieve. The estimate is the fraction of
+    the sample positions J with J+s smooth for all s in S at which J+d is
+    smooth. It is smoothed towards the largest pairwise probability with
+    prior pseudo-counts, since larger sets S occur rarely in the sample.
+    '''
+    def __init__(self, positions, max_range, prior=20):
+        self.n = len(positions) - max_range
+        self.mask = (1 << self.n) - 1
+        self.bits = to_bits(positions)
+        self.prior = prior
+        # Counts of sample positions for sets of smooth offsets.
+        self.counts = {}
+        self.probabilities = {}
+
+    def count(self, S):
+        '''Number of sample positions J with J+s smooth for all s in S.'''
+        if S not in self.counts:
+            match = self.mask
+            for s in S:
+                match &= self.bits >> s
+            self.counts[S] = popcount(match)
+        return self.counts[S]
+
+    def probability(self, d, S):
+        '''Probability that offset d is smooth given the smooth offsets S,
+        a frozenset containing 0.
+        '''
+        if (d, S) not in self.probabilities:
+            prior = max(self.count(frozenset([s, d]))
+                        / max(self.count(frozenset([s])), 1) for s in S)
+            self.probabilities[d, S] = ((self.count(S | {d})
+                                         + self.prior*prior)
+                                        / (self.count(S) + self.prior))
+        return self.probabilities[d, S]
+
+
 class Node: 
     '''Class to describe a rudimentary version of a node in a tree. 
     The only feature we need is that the node has the concept of 
     children and knows when it is a leaf and in that case has some 
     additional data to store the leaf solution.
+
+    The tree itself is stored in flat arrays in the Collection, a Node is
+    only a view of one of its entries for inspecting the tree.
     '''
-    def __init__(self, name, level, number, children=None, leaf_solution=None):
-        self.name = name
-        self.level = level
-        self.number = number
-        self.children = children
-        self.leaf_solution = leaf_solution
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def number(self):
+        '''The root that is checked to enter this node.'''
+        return self.tree.node_number[self.index]
+
+    @property
+    def children(self):
+        '''The child nodes, None for a leaf.'''
+        if self.is_leaf():
+            return None
+        return [Node(self.tree, c) for c in range(
+                self.tree.child_start[self.index], 
+                self.tree.child_start[self.index+1])]
+
+    @property
+    def leaf_solution(self):
+        '''Dictionary of the root sets still to be checked at a leaf.'''
+        if not self.is_leaf():
+            return None
+        tree = self.tree
+        return {(tree.pattern_sol[k], ('plus', 'minus')[tree.pattern_dir[k]]): 
+                list(tree.pattern_roots[tree.pattern_start[k]:
+                                        tree.pattern_start[k+1]])
+                for k in range(tree.leaf_start[self.index], 
+                               tree.leaf_start[self.index+1])}
     
     def is_leaf(self):
-        return self.children==None
+        return (self.tree.child_start[self.index] 
+                == self.tree.child_start[self.index+1])
     
     def __repr__(self):
-        return (f"Node('{self.name}: children: {self.children}, "
+        return (f"Node('{self.index}: {self.number}, children: "
+                + f"{[c.number for c in self.children or []]}, "
                 + f"sol: {self.leaf_solution})")
 
 
@@ -157,15 +343,26 @@ class Found:
     '''Class to collect information for a found x that gives twin 
     smooth integers.
     '''
-    def __init__(self, x, solution):
+    __slots__ = ('x', 'solution', 'p', 'isprime', 'relaxed', 'large_primes')
+
+    def __init__(self, x, solution, relaxed=None):
             self.x = x
             self.solution = solution
             self.p = 2*solution.f_div_c(x) - 1
             self.isprime = is_prime(self.p)
+            # Roots whose linear terms may be non-smooth in relaxed mode.
+            self.relaxed = relaxed
+            # Large primes of the linear terms in large prime mode.
+            self.large_primes = None
 
     def __repr__(self):
+        relaxed = ''
+        if self.relaxed is not None:
+            relaxed = f' relaxed: {self.relaxed},'
+        if self.large_primes is not None:
+            relaxed += f' large primes: {self.large_primes},'
         return (f'x={self.x}, solution: {self.solution.ui}, {self.solution.vi},'
-               + f' p={self.p}, p prime? {self.isprime}')
+               + f'{relaxed} p={self.p}, p prime? {self.isprime}')
 
     def makelist(self):
         '''Return a list of the information of a found x.'''
@@ -177,75 +374,90 @@ class Collection:
     '''Class to organize a family of solutions and collect data 
     associated with the whole family.
     '''
-    def __init__(self, solutions, solutions_name, relax):
+    def __init__(self, solutions, solutions_name, relax, 
+                 collection_names=None):
         # Make a dictionary of parsed solutions and attach some 
         # additional information.
 
         # Name of the solution list.
         self.solutions_name = solutions_name
 
+        # Relax to allow non-smooth factors.
+        self.relax = relax
+
+        # File name of the compiled artifact the collection was read from.
+        self.artifact = None
+
+        # Names of the solution lists each solution belongs to. For a 
+        # collection combined from several lists, found x values are 
+        # reported per list.
+        if collection_names is None:
+            collection_names = [[solutions_name]]*len(solutions)
+        self.collection_names = list(dict.fromkeys(
+                        name for names in collection_names for name in names))
+
         # The number of solutions.
         self.num_sols = len(solutions)
         
         # Create a dictionary for holding the parsed solutions.
         self.solutions = {}
-        if relax==1:
-            self.relaxed_solutions = {}
 
         # Parse the solutions.
         for i in range(self.num_sols):
             self.solutions[i] = Solution(solutions[i], relax)
+            self.solutions[i].collections = collection_names[i]
         
         # Get the maximum range of the roots over all solutions 
         # in this collection.
         self.max_range = max([sol.range for sol in self.solutions.values()])
         
         # Collect the sets of roots to be used for constructing the tree.
-        self.rootsets = self.tree_rootsets(relax)
+        self.rootsets = self.tree_rootsets()
         
         # Generate the tree given by the hitting sets for solution checking.
-        self.tree = {}
-        self.next_level('0',0,0,0,self.rootsets)
+        self.build_tree(self.rootsets)
+
+        if relax >= 1:
+            # Relaxed matching checks patterns directly on the bitmap.
+            self.build_relaxed_patterns()
     
-    def tree_rootsets(self, relax):
+    def tree_rootsets(self):
         '''Takes all root sets constructed from the chosen solutions.'''
         rootsets = {}
         for key in self.solutions:
-            if relax==1:
-                # Predetermined hitting set
-                hitset = [1,2,5]
-                for root in self.solutions[key].relaxed_setroots:
-                    # Only use the root set if it has a common element 
-                    # with a given hitting set.
-                    if ([r for r in 
-                        self.solutions[key].relaxed_setroots_flip[root][1:] 
-                        if r in hitset] != []):
-                        # Flip solutions to allow checks of values x+ri to
-                        # avoid overlapping on the left of the interval.
-                        rootsets[key, 'plus', root] = (self.solutions[key]
-                                         .relaxed_setroots_flip[root][1:])
-                    if not self.solutions[key].symmetric:
-                        # Only use the root set if it has a common element with
-                        # a given hitting set.
-                        if ([r for r in 
-                            self.solutions[key].relaxed_setroots[root][1:]
-                            if r in hitset] != []):
-                            # For non-symmetric solutions, negative x values
-                            # lead to different polynomials, include those too.
-                            rootsets[key, 'minus', root] = (self.solutions[key]
-                                                   .relaxed_setroots[root][1:])
-            else:
-                # Flip solutions to allow checks of values x+ri to avoid 
-                # overlapping on the left of the interval.
-                rootsets[key, 'plus'] = self.solutions[key].setroots_flip[1:]
-                if not self.solutions[key].symmetric:
-                    # For non-symmetric solutions, negative x values lead to 
-                    # different polynomials, include those as well.
-                    rootsets[key, 'minus'] = self.solutions[key].setroots[1:]
+            # Flip solutions to allow checks of values x+ri to avoid 
+            # overlapping on the left of the interval.
+            rootsets[key, 'plus'] = self.solutions[key].setroots_flip[1:]
+            if not self.solutions[key].symmetric:
+                # For non-symmetric solutions, negative x values lead to 
+                # different polynomials, include those as well.
+                rootsets[key, 'minus'] = self.solutions[key].setroots[1:]
 
         return rootsets
 
-    
+    def build_relaxed_patterns(self):
+        '''Collect the patterns for relaxed matching, see check_relaxed.
+        Each pattern is a tuple (key, direction, required, single_u, 
+        single_v) of lists of offsets from the pattern start. The offsets 
+        of the single roots of f and g may fail, all others are required.
+        '''
+        self.relaxed_patterns = []
+        for key, sol in self.solutions.items():
+            directions = [0] if sol.symmetric else [0, 1]
+            for direction in directions:
+                if direction == 0:
+                    # Flipped roots as for the tree, see tree_rootsets.
+                    offset = {r: sol.maxroot - r for r in sol.setroots}
+                else:
+                    offset = {r: r for r in sol.setroots}
+                single = sol.single_ui + sol.single_vi
+                required = sorted(offset[r] for r in sol.setroots 
+                                  if r not in single)
+                self.relaxed_patterns.append(
+                        (key, direction, required,
+                         [offset[r] for r in sol.single_ui],
+                         [offset[r] for r in sol.single_vi]))
+
     def max_occurrence(self, rootset_dict):
         '''Returns the most common element in a dictionary of root
         sets and its frequency.
@@ -257,96 +469,372 @@ class Collection:
 
         return c.most_common(1)[0]
 
-   
-    def next_level(self, name, level, number, frequency, rootset_dict):
-        '''Function to recursively construct the solution tree.'''
+
+    def hitting_children(self, rootset_dict):
+        '''Split a dictionary of root sets by a greedy hitting set. 
+        Returns a list of triples (num, freq, new_rootset_dict), where 
+        new_rootset_dict holds the root sets containing num, but with num 
+        removed, and freq is their number.
+        '''
+        children = []
+        # Work through all solutions in the set.
+        while not rootset_dict == {}:
+            # Get the most frequent element in the root sets.
+            (num, freq) = self.max_occurrence(rootset_dict)
+            # Remove those from the starting set and include them in the 
+            # set for the number num for the next iteration, but with num 
+            # removed.
+            new_rootset_dict = {}
+            remove_list = [ind for ind in rootset_dict 
+                           if num in rootset_dict[ind]]
+            for ind in remove_list:
+                s = rootset_dict.pop(ind)
+                s.remove(num)
+                new_rootset_dict[ind] = s
+            children.append((num, freq, new_rootset_dict))
         
-        # Generate a node in the tree
-        self.tree[name] = Node(name, level, number)
+        return children
+
+    def build_tree(self, rootset_dict):
+        '''Construct the solution tree given by the hitting sets in flat
+        arrays. Node 0 is the root. The children of node n are the nodes 
+        child_start[n] to child_start[n+1]-1, node_number holds the root 
+        checked to enter a node. The root sets to check at a leaf n are the 
+        patterns leaf_start[n] to leaf_start[n+1]-1. Pattern k belongs to 
+        solution pattern_sol[k] with direction pattern_dir[k] (0 for plus, 
+        1 for minus) and has the roots pattern_roots[pattern_start[k]:
+        pattern_start[k+1]].
+        '''
+        self.node_number = array('i', [0])
+        self.child_start = array('i')
+        self.leaf_start = array('i')
+        self.pattern_sol = array('i')
+        self.pattern_dir = array('b')
+        self.pattern_start = array('i')
+        self.pattern_roots = array('i')
+
+        # Nodes are numbered in breadth-first order, such that the 
+        # children of each node are consecutive.
+        queue = deque([(0, rootset_dict)])
+        while queue:
+            frequency, rootset_dict = queue.popleft()
+            self.child_start.append(len(self.node_number))
+            self.leaf_start.append(len(self.pattern_sol))
+            if frequency == 1:
+                # This node is a leaf.
+                # All remaining solutions in the set need to be checked.
+                for key, roots in rootset_dict.items():
+                    self.pattern_sol.append(key[0])
+                    self.pattern_dir.append(0 if key[1] == 'plus' else 1)
+                    self.pattern_start.append(len(self.pattern_roots))
+                    self.pattern_roots.extend(roots)
+            else:
+                # This node has children.
+                for num, freq, new_rootset_dict in self.hitting_children(
+                                                                rootset_dict):
+                    self.node_number.append(num)
+                    queue.append((freq, new_rootset_dict))
+        
+        # Close the ranges of the last node and pattern.
+        self.child_start.append(len(self.node_number))
+        self.leaf_start.append(len(self.pattern_sol))
+        self.pattern_start.append(len(self.pattern_roots))
+
+    def probe_cost(self, d, locality):
+        '''Cost of checking offset d, increasing by locality for each cache
+        line of 64 bytes between the position and the offset.
+        '''
+        return 1 + locality*(d // 64)
 
-        if frequency == 1:
-            # This node is a leaf.
-            # All remaining solutions in the set need to be checked.
-            self.tree[name].leaf_solution = rootset_dict
-        else:
-            # This node has children.
-            self.tree[name].children = []
-            # Collect frequencies of the most frequent numbers.
-            freqs = {}
-            # Collect the root sets for the next level of the tree.
-            new_rootset_dicts = {}
-
-            # Work through all solutions in the set.
-            while not rootset_dict == {}:
-                # Get the most frequent element in the root sets.
-                (num, freq) = self.max_occurrence(rootset_dict)
-                # Include the most frequent number in the hitting set.
-                self.tree[name].children.append(num)
-                # Keep its frequency.
-                freqs[num] = freq
-                # Start a dictionary for the solution set for all those that
-                # include num.
-                new_rootset_dicts[num] = {}
-                # Remove those from the starting set and include them in the 
-                # set for the number num for the next iteration, but with num 
-                # removed.
-                remove_list = [ind for ind in rootset_dict 
-                               if num in rootset_dict[ind]]
-                for ind in remove_list:
-                    s = rootset_dict.pop(ind)
-                    s.remove(num)
-                    new_rootset_dicts[num][ind] = s
-
-            # Iterate over all children of the node and recurse.
-            for num in self.tree[name].children:
-                new_name = name + f'->{num}'
-                self.next_level(new_name, level+1, num, freqs[num], 
-                                new_rootset_dicts[num])
-                        
+    def leaf_order(self, roots, S, stats, locality):
+        '''Order the roots of a pattern to be checked at a leaf such that
+        the roots most likely to fail come first. Returns the expected
+        cost of the check and the ordered roots.
+        '''
+        roots = list(roots)
+        ordered = []
+        cost = 0
+        reach = 1
+        while roots:
+            # The next root is the least likely to be smooth.
+            r = min(roots, key=lambda r: (stats.probability(r, S), r))
+            cost += reach*self.probe_cost(r, locality)
+            reach *= stats.probability(r, S)
+            S = S | {r}
+            roots.remove(r)
+            ordered.append(r)
+        return cost, ordered
+
+    def cost_subtree(self, rootset_dict, S, stats, locality, score):
+        '''Build the subtree for the root sets in rootset_dict at a node
+        entered with the smooth offsets S. The children are chosen greedily
+        by score(freq, p, cost) for a root in freq of the root sets that is
+        smooth with probability p and costs cost to check. A leaf checking
+        the root sets directly is used if it is cheaper.
+        Returns the expected cost and the subtree, either ('leaf', list of
+        (key, ordered roots)) or ('node', list of (root, subtree)).
+        '''
+        leaf = None
+        exhausted = any(not roots for roots in rootset_dict.values())
+        if len(rootset_dict) <= 4 or exhausted:
+            patterns = []
+            leaf_cost = 0
+            for key, roots in rootset_dict.items():
+                cost, ordered = self.leaf_order(roots, S, stats, locality)
+                leaf_cost += cost
+                patterns.append((key, ordered))
+            leaf = (leaf_cost, ('leaf', patterns))
+            # A node cannot hold a pattern without roots left to check.
+            if len(rootset_dict) == 1 or exhausted:
+                return leaf
+
+        remaining = dict(rootset_dict)
+        children = []
+        split_cost = 0
+        while remaining:
+            freqs = Counter(r for roots in remaining.values() for r in roots)
+            num = max(freqs, key=lambda r: (score(freqs[r],
+                            stats.probability(r, S),
+                            self.probe_cost(r, locality)), freqs[r], -r))
+            child_dict = {}
+            for key in [key for key in remaining if num in remaining[key]]:
+                child_dict[key] = [r for r in remaining.pop(key) if r != num]
+            cost, subtree = self.cost_subtree(child_dict, S | {num}, stats,
+                                              locality, score)
+            split_cost += (self.probe_cost(num, locality)
+                           + stats.probability(num, S)*cost)
+            children.append((num, subtree))
+        # Check the children in the order of their offsets for locality.
+        children.sort(key=lambda child: child[0])
+
+        if leaf is not None and leaf[0] <= split_cost:
+            return leaf
+        return split_cost, ('node', children)
+
+    def build_cost_tree(self, stats, locality=0.05):
+        '''Rebuild the solution tree to minimize the expected cost of the
+        checks at a smooth position, mostly the number of probes of the
+        bitmap, under the probabilities of the SmoothStats stats. Trees
+        from several greedy scores are compared, which prefer roots in many 
+        root sets that are unlikely to be smooth to different degrees. The
+        cheapest one is kept unless the current tree is cheaper.
+        Returns the expected cost of the tree.
+        '''
+        scores = [lambda freq, p, cost: freq/cost,
+                  lambda freq, p, cost: freq/(p**0.5*cost),
+                  lambda freq, p, cost: freq/(p*cost),
+                  lambda freq, p, cost: (freq - 0.5)/(p*cost)]
+        trees = []
+        for score in scores:
+            rootset_dict = {key: list(roots) for key, roots in
+                            self.tree_rootsets().items()}
+            trees.append(self.cost_subtree(rootset_dict, frozenset([0]),
+                                           stats, locality, score))
+        cost, tree = min(trees, key=lambda t: t[0])
+        current = self.expected_cost(stats, locality)
+        if current <= cost:
+            return current
+
+        self.node_number = array('i', [0])
+        self.child_start = array('i')
+        self.leaf_start = array('i')
+        self.pattern_sol = array('i')
+        self.pattern_dir = array('b')
+        self.pattern_start = array('i')
+        self.pattern_roots = array('i')
+
+        # Nodes are numbered in breadth-first order as in build_tree.
+        queue = deque([tree])
+        while queue:
+            kind, items = queue.popleft()
+            self.child_start.append(len(self.node_number))
+            self.leaf_start.append(len(self.pattern_sol))
+            if kind == 'leaf':
+                for key, roots in items:
+                    self.pattern_sol.append(key[0])
+                    self.pattern_dir.append(0 if key[1] == 'plus' else 1)
+                    self.pattern_start.append(len(self.pattern_roots))
+                    self.pattern_roots.extend(roots)
+            else:
+                for num, subtree in items:
+                    self.node_number.append(num)
+                    queue.append(subtree)
+
+        # Close the ranges of the last node and pattern.
+        self.child_start.append(len(self.node_number))
+        self.leaf_start.append(len(self.pattern_sol))
+        self.pattern_start.append(len(self.pattern_roots))
+
+        # The tree no longer matches a compiled artifact.
+        self.artifact = None
+        return cost
+
+    def expected_cost(self, stats, locality=0.05):
+        '''Return the expected cost of the checks of the solution tree at a
+        smooth position under the probabilities of the SmoothStats stats.
+        '''
+        def cost(node, S):
+            first, last = self.child_start[node], self.child_start[node+1]
+            total = 0
+            if first == last:
+                for k in range(self.leaf_start[node],
+                               self.leaf_start[node+1]):
+                    reach = 1
+                    checked = S
+                    for i in range(self.pattern_start[k],
+                                   self.pattern_start[k+1]):
+                        r = self.pattern_roots[i]
+                        total += reach*self.probe_cost(r, locality)
+                        reach *= stats.probability(r, checked)
+                        checked = checked | {r}
+                return total
+            for child in range(first, last):
+                r = self.node_number[child]
+                total += (self.probe_cost(r, locality)
+                          + stats.probability(r, S)*cost(child, S | {r}))
+            return total
+
+        return cost(0, frozenset([0]))
+
+    def class_yields(self, density, weights):
+        '''Return the expected number of pattern matches at a position in 
+        each residue class c mod M as a list indexed by c. weights maps 
+        pairwise coprime moduli q with product M to lists of the smooth 
+        densities of the residues mod q relative to the average density. 
+        The offsets r of a pattern are taken to be smooth independently 
+        with the density times the weights of the residues of c+r.
+        The classes are split into residues mod m1 and m2 with m1*m2 = M 
+        by the Chinese remainder theorem. The rate of a pattern factors into
+        parts depending on c mod m1 and c mod m2, so the sum over the 
+        patterns is one dot product for each pair of residues.
+        '''
+        # Split the moduli into two groups with products close to sqrt(M).
+        groups = ([], [])
+        sizes = [1, 1]
+        for q in sorted(weights, reverse=True):
+            g = 0 if sizes[0] <= sizes[1] else 1
+            groups[g].append(q)
+            sizes[g] *= q
+
+        # Columns of the pattern rates for the residues mod m1 and m2.
+        columns = ([array('d') for _ in range(sizes[0])],
+                   [array('d') for _ in range(sizes[1])])
+        # All offsets of each pattern, not only those left in its leaf,
+        # so that the rates do not depend on the shape of the tree.
+        for rootset in self.tree_rootsets().values():
+            roots = [0] + list(rootset)
+            for g in range(2):
+                # Product over the offsets for each residue mod q.
+                factors = {q: [prod(weights[q][(a + r) % q] for r in roots)
+                               for a in range(q)] for q in groups[g]}
+                scale = density**len(roots) if g == 0 else 1.0
+                for a, column in enumerate(columns[g]):
+                    column.append(scale*prod(factors[q][a % q] 
+                                             for q in groups[g]))
+
+        m1, m2 = sizes
+        table = [[sum(map(mul, a, b)) for b in columns[1]] 
+                 for a in columns[0]]
+        return [table[c % m1][c % m2] for c in range(m1*m2)]
+
+    def __reduce_ex__(self, protocol):
+        '''Collections read from a compiled artifact are passed to other 
+        processes by file name and memory-mapped again there, or built 
+        from their solution lists if the artifact cannot be read.
+        '''
+        if self.artifact is not None:
+            from .compiled import restore_collection
+            return (restore_collection, (self.artifact, 
+                                         self.solutions_name.split('+'), 
+                                         self.relax))
+        return super().__reduce_ex__(protocol)
+
+    def node(self, index=0):
+        '''Return a view of a node of the solution tree.'''
+        return Node(self, index)
                         
-    def traverse(self, name, xL, J, positions, results):
+    def traverse(self, xL, J, positions, results):
         '''Traverse the solution tree for pattern checking.'''
-        node = self.tree[name]
-        if node.is_leaf():
-            # Check solutions in leave node.
-            soldict = node.leaf_solution
-            for key in soldict:
-                sol = soldict[key]
-                # Check the solution pattern against the smoothness bit string.
-                found = check_pattern(J, positions, sol)
-                if found:
-                    num_sol = key[0]
-                    solution = self.solutions[num_sol]
-                    if key[1] == 'plus':
-                        # This case uses (x+ri) in the checks, standard for 
-                        # symmetric solutions. To account for the flipped set 
-                        # of roots, the x value needs to be taken at the end 
-                        # of the root set.
-                        x = xL + solution.maxroot
+        # Local names for the flat tree arrays.
+        node_number = self.node_number
+        child_start = self.child_start
+        leaf_start = self.leaf_start
+        pattern_start = self.pattern_start
+        pattern_roots = self.pattern_roots
+
+        # Depth-first traversal with an explicit stack of nodes.
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            first_child = child_start[node]
+            last_child = child_start[node+1]
+            if first_child == last_child:
+                # Check solutions in leaf node.
+                for k in range(leaf_start[node], leaf_start[node+1]):
+                    # Check the solution pattern against the smoothness bit
+                    # string.
+                    for i in range(pattern_start[k], pattern_start[k+1]):
+                        if not positions[J+pattern_roots[i]]:
+                            break
                     else:
-                        # This case uses (x-ri) in the checks and is added for
-                        # non-symmetric solutions. It corresponds to taking 
-                        # negative x.
-                        x = -xL
-                    # Correct for a possible shift if the minimal root was 
-                    # not 0.
-                    x += solution.shift
-                    # Does the polynomial f evaluate to an integer?
-                    is_int = solution.is_int_f_div_c(x)
-                    if is_int:
-                        results.append(Found(x, solution))
-        else:
-            # If the node is not a leaf, go through all its children and 
-            # recurse.
-            for num in node.children:
-                if positions[J+num]:
-                    new_name = name + f'->{num}'
-                    results = self.traverse(new_name, xL, J, positions, 
-                                            results)
+                        self.found(k, xL, results)
+            else:
+                # If the node is not a leaf, go through all its children,
+                # in reverse order to visit them in order.
+                for child in range(last_child-1, first_child-1, -1):
+                    if positions[J+node_number[child]]:
+                        stack.append(child)
         
         return results
-    
-
-
 
+    def found(self, k, xL, results):
+        '''Append the result for a pattern k found at xL to results.'''
+        self.found_x(self.pattern_sol[k], self.pattern_dir[k], xL, results)
 
+    def found_x(self, key, direction, xL, results, relaxed=None):
+        '''Append the result for solution key with direction 0 (plus) or
+        1 (minus) found at xL to results.
+        '''
+        solution = self.solutions[key]
+        if direction == 0:
+            # This case uses (x+ri) in the checks, standard for 
+            # symmetric solutions. To account for the flipped set 
+            # of roots, the x value needs to be taken at the end 
+            # of the root set.
+            x = xL + solution.maxroot
+        else:
+            # This case uses (x-ri) in the checks and is added for
+            # non-symmetric solutions. It corresponds to taking 
+            # negative x.
+            x = -xL
+        # Correct for a possible shift if the minimal root was 
+        # not 0.
+        x += solution.shift
+        # Does the polynomial f evaluate to an integer?
+        is_int = solution.is_int_f_div_c(x)
+        if is_int:
+            results.append(Found(x, solution, relaxed))
+
+
+def combined_collection(solutions_names, relax):
+    '''Combine several solution lists into a single Collection, such 
+    that one pass over a sieve result checks the patterns of all of them.
+    Solutions occurring in several lists are only included once and keep
+    the names of all their lists in solution.collections.
+    '''
+    # Map each distinct solution to its index in the combined list.
+    index = {}
+    soldata = []
+    collection_names = []
+    for name in solutions_names:
+        for sol in solutions[name]:
+            key = frozenset([tuple(sorted(sol[0])), tuple(sorted(sol[1]))])
+            if key not in index:
+                index[key] = len(soldata)
+                soldata.append(sol)
+                collection_names.append([])
+            if name not in collection_names[index[key]]:
+                collection_names[index[key]].append(name)
+
+    return Collection(soldata, '+'.join(solutions_names), relax, 
+                      collection_names)
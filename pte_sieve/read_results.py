@@ -0,0 +1,57 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+# read_results.py
+#
+# Read and analyze results from the pte_sieve without Sage, 
+# see results/read_results.sage.
+
+from multiprocessing import Pool
+from results import analyse_file
+
+
+def main(args):
+    '''Analyse the results files.
+    Arguments:
+        args[0]: list of results files
+        args[1]: bit sizes of p to print
+        args[2]: maximal bit size of the prime factors of M and N
+        args[3]: minimal bit size of M and N
+        args[4]: number of processes
+    '''
+    filenames, bitsizes, maxB, minMN, processes = args
+    total_ints = 0
+    total_primes = 0
+
+    with Pool(processes) as pool:
+        for filename in filenames:
+            ints, primes, _ = analyse_file(filename, bitsizes, maxB, minMN, 
+                                           pool if processes > 1 else None)
+            total_ints += ints
+            total_primes += primes
+            print()
+
+    if len(filenames) > 1 and total_ints:
+        print(f'Total integers: {total_ints}, primes: {total_primes} ' 
+              + f'({round(100*total_primes/total_ints,2)}%)')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+                description='analyse results files of the pte_sieve')
+    parser.add_argument("files", type=str, nargs='+', 
+                        help="results files to analyse")
+    parser.add_argument("-b", "--bits", type=int, nargs=2, 
+                        default=[240, 259], metavar=('MIN', 'MAX'),
+                        help="print primes p with MIN <= log(p) < MAX bits")
+    parser.add_argument("-B", "--maxB", type=int, default=16, 
+                        help="maximal bit size of prime factors of M and N")
+    parser.add_argument("-m", "--minMN", type=int, default=210, 
+                        help="minimal bit size of M and N")
+    parser.add_argument("-p", "--processes", type=int, default=1, 
+                        help="number of processes")
+    args = parser.parse_args()
+
+    main([args.files, range(*args.bits), args.maxB, args.minMN, 
+          args.processes])
@@ -0,0 +1,7 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+# __init__()
+
+from .parse import Result, read_header, read_large_prime, read_results
+from .analysis import analyse_result, analyse_file
+from .store import ResultsStore
@@ -0,0 +1,129 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+# analysis.py
+#
+# Analysis of results files without Sage, see read_results.sage.
+
+from itertools import islice
+from pte_solutions.solutions import Solution
+from pte_solutions.certificate import certify
+from pte_solutions.primality import is_prime
+from primes.parse import read_primes
+from .parse import read_header, read_results
+
+# Prime tables by logB, read once per process.
+_primes = {}
+
+def primes_upto(logB):
+    '''Return the table of primes less than 2**logB, the largest 
+    available table for larger logB.
+    '''
+    logB = min(logB, 25)
+    if logB not in _primes:
+        _primes[logB] = read_primes(logB)[0]
+    return _primes[logB]
+
+
+def split_bits(factors, minMN):
+    '''Multiply the prime powers of a factorization in increasing order 
+    until the product has at least minMN bits. Returns the bit lengths of 
+    the product and of its largest prime factor.
+    '''
+    M = 1
+    largest = 1
+    for q, e in sorted(factors):
+        if M.bit_length() >= minMN:
+            break
+        M *= q**e
+        largest = q
+    return M.bit_length(), largest.bit_length()
+
+
+def analyse_result(result, logB, minMN):
+    '''Factor p+1 and p-1 of a prime result from the factorizations of 
+    its linear terms over the prime table and compute the M/N split.
+    Returns a dictionary with the statistics.
+    '''
+    # The recorded roots are normalized, so x needs no shift.
+    solution = Solution([result.ui, result.vi, 0], 0)
+    cert = certify(result.x, solution, primes_upto(logB), 
+                   result.large_primes)
+    lM_total, lM = split_bits(cert['p+1'], minMN)
+    lN_total, lN = split_bits(cert['p-1'], minMN)
+
+    return {
+        'result': result,
+        'bits': result.p.bit_length(),
+        'p+1': cert['p+1'],
+        'p-1': cert['p-1'],
+        'largest_plus': max(q for q, _ in cert['p+1']).bit_length(),
+        'largest_minus': max(q for q, _ in cert['p-1']).bit_length(),
+        'logM': lM_total, 'largest_M': lM,
+        'logN': lN_total, 'largest_N': lN,
+    }
+
+
+def _analyse(args):
+    '''Wrapper for analyse_result to be used with a process pool.'''
+    return analyse_result(*args)
+
+
+def format_factors(factors):
+    '''Format a factorization like Sage does.'''
+    return ' * '.join(f'{q}^{e}' if e > 1 else f'{q}' for q, e in factors)
+
+
+def analyse_file(filename, bitsizes, maxB, minMN, pool=None, 
+                 batch_size=1024, out=print):
+    '''Analyse a results file as read_results in read_results.sage does:
+    factor p+1 and p-1 for all prime p and print those with bit size in 
+    bitsizes whose M and N parts have no prime factor above maxB bits.
+    The file is streamed in batches of prime results, which are analysed 
+    in parallel if a process pool is given.
+    Returns the number of results, of primes and the printed statistics.
+    '''
+    header = read_header(filename)
+    logB = header[0] if header is not None else maxB
+    out(f'{filename}: 2^{logB}-smooth')
+
+    ints = 0
+    primes = set()
+    selected = []
+
+    def prime_results():
+        nonlocal ints
+        for result in read_results(filename):
+            ints += 1
+            if result.isprime:
+                primes.add(result.x)
+                yield (result, logB, minMN)
+
+    tasks = prime_results()
+    while True:
+        batch = list(islice(tasks, batch_size))
+        if not batch:
+            break
+        if pool is None:
+            stats = map(_analyse, batch)
+        else:
+            stats = pool.map(_analyse, batch)
+        for s in stats:
+            if (s['bits'] in bitsizes and s['largest_M'] <= maxB 
+                    and s['largest_N'] <= maxB):
+                selected.append(s)
+                out(f'\n{s["result"]}')
+                out(f'is_prime? {is_prime(s["result"].p)}')
+                out(f'p+1 = {format_factors(s["p+1"])}')
+                out(f'p-1 = {format_factors(s["p-1"])}')
+                out(f'log(p) = {s["bits"]}, largest prime factors: '
+                    + f'{s["largest_plus"]}, {s["largest_minus"]} bits')
+                out(f'log(M) = {s["logM"]}, largest prime factor:'
+                    + f' {s["largest_M"]} bits')
+                out(f'log(N) = {s["logN"]}, largest prime factor:'
+                    + f' {s["largest_N"]} bits')
+
+    if ints:
+        out(f'\nFound integers: {ints}, primes: {len(primes)} ' 
+            + f'({round(100*len(primes)/ints,2)}%)')
+
+    return ints, len(primes), selected
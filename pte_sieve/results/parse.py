@@ -0,0 +1,103 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+# parse.py
+#
+# Streaming parser for the results files written by the PTE sieve.
+
+import re
+
+# A results line, e.g.
+# 17, x=1391570590520, solution: [6, 6, 55, ...], [0, 16, 39, ...], 
+#   p=1233..., p prime? False
+# with optional 'relaxed: [...],' and 'large primes: [...],' before p.
+RESULT_LINE = re.compile(r'(?:(\d+), )?x=(-?\d+), solution: \[([\d, ]*)\], '
+                         + r'\[([\d, ]*)\],(?: relaxed: \[([\d, ]*)\],)?'
+                         + r'(?: large primes: \[([\d, ]*)\],)? '
+                         + r'p=(-?\d+), p prime\? (True|False)')
+
+# The header line written at the start of each run.
+HEADER_LINE = re.compile(r'x values, solutions and p values of 2\^(\d+)-smooth'
+                         + r' twin numbers for x in the range from (\d+)'
+                         + r' to (\d+)')
+
+# The large prime bound at the end of the header line of a run with -l.
+LARGE_PRIME = re.compile(r'with one large prime up to 2\^(\d+)')
+
+
+def int_list(s):
+    '''Parse a comma-separated list of integers.'''
+    return [int(i) for i in s.split(',')] if s.strip() else []
+
+
+class Result:
+    '''Class to hold one line of a results file.'''
+    __slots__ = ('proc_num', 'x', 'ui', 'vi', 'relaxed', 'p', 'isprime', 
+                 'large_primes')
+
+    def __init__(self, proc_num, x, ui, vi, relaxed, p, isprime, 
+                 large_primes=None):
+        self.proc_num = proc_num
+        self.x = x
+        self.ui = ui
+        self.vi = vi
+        self.relaxed = relaxed
+        self.p = p
+        self.isprime = isprime
+        self.large_primes = large_primes
+
+    @classmethod
+    def parse(cls, line):
+        '''Parse a results line, returns None if it is not one.'''
+        m = RESULT_LINE.search(line)
+        if m is None:
+            return None
+        proc_num, x, ui, vi, relaxed, large, p, isprime = m.groups()
+        return cls(None if proc_num is None else int(proc_num), int(x), 
+                   int_list(ui), int_list(vi), 
+                   None if relaxed is None else int_list(relaxed), int(p), 
+                   isprime == 'True', 
+                   None if large is None else int_list(large))
+
+    def __repr__(self):
+        relaxed = ''
+        if self.relaxed is not None:
+            relaxed = f' relaxed: {self.relaxed},'
+        if self.large_primes is not None:
+            relaxed += f' large primes: {self.large_primes},'
+        return (f'{self.proc_num}, x={self.x}, solution: {self.ui}, {self.vi},'
+                + f'{relaxed} p={self.p}, p prime? {self.isprime}')
+
+
+def read_header(filename):
+    '''Return logB, L and R from the first header line of a results file,
+    or None if there is none.
+    '''
+    with open(filename, 'r') as results_file:
+        for line in results_file:
+            m = HEADER_LINE.search(line)
+            if m is not None:
+                return tuple(int(i) for i in m.groups())
+    return None
+
+
+def read_large_prime(filename):
+    '''Return the large prime bound logL from the first header line of a
+    results file, or 0 if the run did not allow a large prime.
+    '''
+    with open(filename, 'r') as results_file:
+        for line in results_file:
+            if HEADER_LINE.search(line) is not None:
+                m = LARGE_PRIME.search(line)
+                return 0 if m is None else int(m.group(1))
+    return 0
+
+
+def read_results(filename):
+    '''Generator for the results in a results file, one line at a time.
+    Header lines of the appended runs are skipped.
+    '''
+    with open(filename, 'r') as results_file:
+        for line in results_file:
+            result = Result.parse(line)
+            if result is not None:
+                yield result
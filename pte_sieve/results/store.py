@@ -0,0 +1,227 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+# store.py
+#
+# SQLite store for the results of the PTE sieve with indexed queries.
+
+import os
+import re
+import sqlite3
+from .parse import Result, HEADER_LINE, LARGE_PRIME, read_large_prime
+
+# Results files are named {solutions}_{logB}_{L}_to_{R}.txt.
+RESULTS_FILENAME = re.compile(r'(.+)_(\d+)_(\d+)_to_(\d+)\.txt$')
+
+# x is stored as zero-padded decimal text, so that the text order is the 
+# numerical order also for x beyond 64 bits. Negative x, of the minus 
+# direction, are stored as '-' and the complement 10**(X_DIGITS-1) + x, 
+# which sort before the positive ones and in increasing order.
+X_DIGITS = 40
+
+# Version of the schema in PRAGMA user_version.
+SCHEMA_VERSION = 2
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    x TEXT NOT NULL,
+    solutions TEXT NOT NULL,
+    ui TEXT NOT NULL,
+    vi TEXT NOT NULL,
+    relaxed TEXT,
+    large_primes TEXT,
+    logB INTEGER NOT NULL,
+    logL INTEGER NOT NULL,
+    p TEXT NOT NULL,
+    p_bits INTEGER NOT NULL,
+    isprime INTEGER NOT NULL,
+    proc_num INTEGER,
+    UNIQUE (x, ui, vi, logB, logL, solutions)
+);
+CREATE INDEX IF NOT EXISTS results_x ON results (x);
+CREATE INDEX IF NOT EXISTS results_solution ON results (ui, vi);
+CREATE INDEX IF NOT EXISTS results_query 
+    ON results (solutions, logB, logL, isprime, p_bits);
+CREATE INDEX IF NOT EXISTS results_bits ON results (p_bits, isprime);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    imported INTEGER NOT NULL
+);
+'''
+
+
+def pad_x(x):
+    '''Return x as text in the order of the store.'''
+    if x >= 0:
+        return f'{x:0{X_DIGITS}d}'
+    return f'-{10**(X_DIGITS-1) + x:0{X_DIGITS-1}d}'
+
+
+def unpad_x(text):
+    '''Return x from its text in the store, the inverse of pad_x.'''
+    if text.startswith('-'):
+        return int(text[1:]) - 10**(X_DIGITS-1)
+    return int(text)
+
+
+class ResultsStore:
+    '''Class for a SQLite database of results.
+    Hits are unique by x, solution, logB, large prime bound logL and 
+    solution list, so hits that overlapping or resumed runs report twice 
+    are stored once, and a hit of a combined run is stored for each of 
+    its lists. Runs with one large prime (pte_sieve.py -l) store their 
+    hits with their logL and large primes, strict runs with logL = 0.
+    '''
+
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename)
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version < SCHEMA_VERSION:
+            # Stores of an older schema are emptied, the files are then 
+            # imported again from the start.
+            self.db.executescript('DROP TABLE IF EXISTS results;'
+                                  + ' DROP TABLE IF EXISTS files;')
+            self.db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def import_file(self, filename, solutions=None, logB=None):
+        '''Import the results of a results file. The solutions name and logB
+        are taken from the file name and header if not given, the large 
+        prime bound logL from the header.
+        Files that are appended to by later runs are imported incrementally
+        from the byte offset reached by the previous import.
+        Returns the number of lines read and of new results.
+        '''
+        match = RESULTS_FILENAME.match(os.path.basename(filename))
+        if solutions is None:
+            if match is None:
+                raise ValueError(f'No solutions name in {filename}.')
+            solutions = match.group(1)
+        if logB is None and match is not None:
+            logB = int(match.group(2))
+
+        path = os.path.abspath(filename)
+        row = self.db.execute('SELECT imported FROM files WHERE path = ?', 
+                              (path,)).fetchone()
+        offset = row[0] if row is not None else 0
+        if offset > os.path.getsize(filename):
+            # The file was replaced, import it again.
+            offset = 0
+
+        # The bound of the first run, later header lines update it.
+        logL = read_large_prime(filename)
+        lines = 0
+        rows = []
+        with open(filename, 'rb') as results_file:
+            results_file.seek(offset)
+            for line in results_file:
+                if not line.endswith(b'\n'):
+                    # An incomplete line of a running search.
+                    break
+                offset += len(line)
+                lines += 1
+                line = line.decode()
+                header = HEADER_LINE.search(line)
+                if header is not None:
+                    logB = int(header.group(1))
+                    m = LARGE_PRIME.search(line)
+                    logL = 0 if m is None else int(m.group(1))
+                    continue
+                result = Result.parse(line)
+                if result is None:
+                    continue
+                if logB is None:
+                    raise ValueError(f'No logB for {filename}.')
+                rows.append(self.row(result, solutions, logB, logL))
+
+        with self.db:
+            before = self.db.total_changes
+            self.db.executemany('INSERT OR IGNORE INTO results VALUES '
+                                + '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', 
+                                rows)
+            new = self.db.total_changes - before
+            self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?)', 
+                            (path, offset))
+
+        return lines, new
+
+    @staticmethod
+    def row(result, solutions, logB, logL=0):
+        '''Return the database row for a result.'''
+        relaxed = None
+        if result.relaxed is not None:
+            relaxed = ','.join(map(str, result.relaxed))
+        large_primes = None
+        if result.large_primes is not None:
+            large_primes = ','.join(map(str, result.large_primes))
+        return (pad_x(result.x), solutions, ','.join(map(str, result.ui)), 
+                ','.join(map(str, result.vi)), relaxed, large_primes, logB, 
+                logL, str(result.p), result.p.bit_length(), 
+                int(result.isprime), result.proc_num)
+
+    def query(self, solutions=None, logB=None, min_bits=None, max_bits=None,
+              isprime=None, x_min=None, x_max=None, solution=None, 
+              limit=None, logL=None):
+        '''Generator for the results matching all given conditions, as pairs
+        (solutions name, logB, logL) and Result, ordered by x.
+        Arguments:
+            solutions: name of the solution list
+            logB: smoothness bound
+            logL: large prime bound, 0 for the strictly smooth results
+            min_bits, max_bits: bounds for the bit length of p, inclusive
+            isprime: only primes or only non-primes
+            x_min, x_max: bounds for x, inclusive
+            solution: pair of lists of roots ui and vi
+            limit: maximal number of results
+        '''
+        conditions = []
+        values = []
+        for column, op, value in [
+                ('solutions', '=', solutions), ('logB', '=', logB), 
+                ('logL', '=', logL), 
+                ('p_bits', '>=', min_bits), ('p_bits', '<=', max_bits),
+                ('isprime', '=', None if isprime is None else int(isprime)),
+                ('x', '>=', None if x_min is None else pad_x(x_min)),
+                ('x', '<=', None if x_max is None else pad_x(x_max))]:
+            if value is not None:
+                conditions.append(f'{column} {op} ?')
+                values.append(value)
+        if solution is not None:
+            conditions.append('ui = ? AND vi = ?')
+            values += [','.join(map(str, roots)) for roots in solution]
+
+        sql = ('SELECT solutions, logB, logL, proc_num, x, ui, vi, relaxed, '
+               + 'large_primes, p, isprime FROM results')
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY x'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+
+        for (name, logB, logL, proc_num, x, ui, vi, relaxed, large_primes, 
+                p, isprime) in self.db.execute(sql, values):
+            yield (name, logB, logL), Result(
+                    proc_num, unpad_x(x), [int(r) for r in ui.split(',')], 
+                    [int(r) for r in vi.split(',')], 
+                    None if relaxed is None 
+                        else [int(r) for r in relaxed.split(',') if r], 
+                    int(p), bool(isprime),
+                    None if large_primes is None
+                        else [int(r) for r in large_primes.split(',') if r])
+
+    def count(self):
+        '''Return the numbers of results and of primes, counting the hits
+        stored for several lists once.
+        '''
+        return self.db.execute('SELECT COUNT(*), SUM(isprime) FROM'
+                               + ' (SELECT DISTINCT x, ui, vi, logB, logL,'
+                               + ' isprime'
+                               + ' FROM results)').fetchone()
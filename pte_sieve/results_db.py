@@ -0,0 +1,75 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+# results_db.py
+#
+# Import results files of the pte_sieve into a SQLite database and query it.
+
+from results import ResultsStore
+
+
+def main(args):
+    '''Import results files and/or query the database.
+    Arguments:
+        args[0]: database file
+        args[1]: list of results files to import
+        args[2]: dictionary with the query conditions, None for no query
+    '''
+    database, filenames, query = args
+
+    with ResultsStore(database) as store:
+        for filename in filenames:
+            lines, new = store.import_file(filename)
+            print(f'{filename}: {lines} lines read, {new} new results')
+        if filenames:
+            ints, primes = store.count()
+            print(f'Database: {ints} results, {primes or 0} primes')
+
+        if query is not None:
+            for (name, logB, logL), result in store.query(**query):
+                bound = f'2^{logB}'
+                if logL:
+                    bound += f' with a large prime up to 2^{logL}'
+                print(f'{name}, {bound}: {result}')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+                description='import and query results of the pte_sieve')
+    parser.add_argument("files", type=str, nargs='*', 
+                        help="results files to import")
+    parser.add_argument("-D", "--database", type=str, default='results.db',
+                        help="database file")
+    parser.add_argument("-q", "--query", action='store_true', 
+                        help="print the results matching the conditions")
+    parser.add_argument("-s", "--solutions", type=str, default=None, 
+                        help="name of the solution list")
+    parser.add_argument("-l", "--logB", type=int, default=None, 
+                        help="log of the smoothness bound")
+    parser.add_argument("-L", "--large-prime", type=int, default=None, 
+                        help="large prime bound in bits, 0 for the results"
+                        + " without a large prime")
+    parser.add_argument("-b", "--bits", type=int, nargs=2, default=None,
+                        metavar=('MIN', 'MAX'),
+                        help="MIN <= log(p) <= MAX bits")
+    parser.add_argument("-x", "--xrange", type=int, nargs=2, default=None,
+                        metavar=('L', 'R'), help="L <= x <= R")
+    parser.add_argument("--primes", action='store_true', 
+                        help="only results with p prime")
+    parser.add_argument("-n", "--limit", type=int, default=None, 
+                        help="maximal number of results")
+    args = parser.parse_args()
+
+    query = None
+    if args.query:
+        bits = args.bits or [None, None]
+        xrange = args.xrange or [None, None]
+        query = {'solutions': args.solutions, 'logB': args.logB, 
+                 'logL': args.large_prime, 
+                 'min_bits': bits[0], 'max_bits': bits[1], 
+                 'x_min': xrange[0], 'x_max': xrange[1], 
+                 'isprime': True if args.primes else None, 
+                 'limit': args.limit}
+
+    main([args.database, args.files, query])
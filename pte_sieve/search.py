@@ -0,0 +1,245 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+# search.py
+#
+# Asynchronous API to run the PTE sieve from other python code.
+
+import asyncio
+import multiprocessing as mp
+import queue
+from primes.parse import read_primes
+from pte_solutions import load_collection
+from sieve import SieveEngine
+from audit import audit_server
+from pte_sieve import (pte_sieve, prepare_files, split_range, tune_tree, 
+                       worker_memory)
+from placement import default_workers, plan_layout
+
+
+def search_worker(events, args, kwargs):
+    '''Run pte_sieve in a worker process and report how it ended.'''
+    proc_num = args[7]
+    try:
+        completed = pte_sieve(*args, **kwargs)
+        events.put({'type': 'done', 'proc': proc_num,
+                    'completed': completed})
+    except Exception as e:
+        events.put({'type': 'error', 'proc': proc_num, 'error': repr(e)})
+
+
+class PTESearch:
+    '''Class to run a search for twin smooth integers in [L, R) in worker
+    processes and to stream its events, e.g.
+
+        async with PTESearch(L, R, logB, ['size-6'], use_c=64) as search:
+            async for event in search:
+                if event['type'] == 'result':
+                    print(event['x'], event['p'])
+
+    The events are dictionaries with a 'type' and the number 'proc' of the
+    worker process:
+        'result': a found x with its 'collection', 'solution', 'p',
+                  'isprime', 'relaxed' and 'large_primes',
+        'progress': the finished interval ['T', 'end') of the subrange
+                    ['L', 'R') of the worker, the fraction 'done' and the
+                    counts 'x' and 'primes' of the worker so far,
+        'done': the worker finished, 'completed' is False if it was
+                cancelled,
+        'error': the worker failed with 'error',
+        'audit': with audit > 0, an interval ['T', 'end') was compared to 
+                 the exact sieve, with the running counts and estimates.
+    The iteration ends when all workers have finished.
+
+    pause() lets the workers wait after their current interval, resume()
+    continues. cancel() stops them after their current interval. The
+    status and results files are written as by pte_sieve.py, so a
+    cancelled search continues with resume=True. With quiet, the workers
+    print nothing and the events are the only output. With processes=0, 
+    the number of workers is derived from the CPUs, the CPU quota and the
+    memory limit. With pin, each worker runs on its own CPUs of one NUMA 
+    node, with huge_pages its sieve buffers use transparent huge pages.
+    With levels, the smallest bound up to 2**levels of each position is 
+    stored in the cache, which then serves searches with other bounds.
+    The workers are daemons, so with audit > 0, their audits run in one 
+    more process started by start(), which they share.
+    The remaining arguments are those of pte_sieve.py.
+    '''
+    def __init__(self, L, R, logB, solutions='size-6', use_c=0, b=2**20,
+                 processes=1, relax=0, resume=False, threads=1, depth=1,
+                 cache_dir=None, cache_size=2**32, certificates=False,
+                 memory=2**28, logL=0, path='.', quiet=False, exact=False,
+                 audit=0, cost_tree=False, pin=False, huge_pages=False,
+                 c_scan=False, levels=0):
+        if not L < R:
+            raise RuntimeError('Left bound L must be less than right bound R.')
+        if logL and not logB < logL <= 2*logB:
+            raise RuntimeError('The large prime bound logL must satisfy'
+                               + ' logB < logL <= 2*logB.')
+        if levels and not (cache_dir is not None and logB <= levels 
+                           and not logL and not audit):
+            raise RuntimeError('The levels are stored in the cache, use'
+                               + ' levels with cache_dir, at least logB and'
+                               + ' without logL or audit.')
+        if isinstance(solutions, str):
+            solutions = solutions.split(',')
+        self.L = L
+        self.R = R
+        self.logB = logB
+        self.solutions = solutions
+        self.processes = processes
+        self.path = path
+        self.options = {'b': b, 'use_c': use_c, 'relax': relax,
+                        'resume': resume, 'threads': threads,
+                        'depth': depth, 'cache_dir': cache_dir,
+                        'cache_size': cache_size,
+                        'certificates': certificates, 'memory': memory,
+                        'logL': logL, 'quiet': quiet, 'exact': exact,
+                        'audit': audit, 'cost_tree': cost_tree, 'pin': pin,
+                        'huge_pages': huge_pages, 'c_scan': c_scan,
+                        'levels': levels}
+        self.workers = []
+        self.auditor = None
+        self.audit_requests = None
+        self.events = None
+        self.running = None
+        self.stop = None
+        self.finished = set()
+
+    def start(self):
+        '''Start the worker processes.'''
+        o = self.options
+        primes, log_primes = read_primes(self.logB)
+        sols = load_collection(self.solutions, o['relax'])
+        if o['cost_tree'] and o['relax'] == 0:
+            engine = SieveEngine(self.logB, primes, log_primes, o['use_c'], 
+                                 o['threads'], None, o['logL'], o['exact'])
+            tune_tree(sols, engine, self.L)
+            engine.close()
+        status_path, results_files = prepare_files(sols, self.logB, self.L,
+                                                   self.R, o['logL'],
+                                                   self.path, o['quiet'])
+
+        self.events = mp.Queue()
+        self.running = mp.Event()
+        self.running.set()
+        self.stop = mp.Event()
+
+        if self.processes == 0:
+            self.processes, _ = default_workers(
+                worker_memory(o['b'], sols, o['use_c'], o['depth'],
+                              o['memory']), o['threads'])
+        Li, Ri = split_range(self.L, self.R, self.processes)
+        layout = [None]*self.processes
+        if o['pin']:
+            layout = plan_layout(self.processes, o['threads'])
+
+        # Daemon workers cannot start their own audit processes, they send
+        # their intervals to a server and each gets the reports on its own 
+        # queue.
+        replies = [None]*self.processes
+        if o['audit'] and o['use_c'] in (64, 128) and not o['exact']:
+            self.audit_requests = mp.Queue()
+            replies = [mp.Queue() for _ in range(self.processes)]
+            initargs = (self.logB, primes, log_primes, o['use_c'], 
+                        o['logL'], sols)
+            self.auditor = mp.Process(target=audit_server,
+                                      args=(self.audit_requests, replies, 
+                                            initargs), daemon=True)
+            self.auditor.start()
+
+        for i in range(self.processes):
+            args = (Li[i], Ri[i], o['b'], primes, log_primes, self.logB,
+                    sols, i, results_files, status_path, o['use_c'],
+                    o['resume'], o['threads'], o['depth'], o['cache_dir'],
+                    o['cache_size'], o['certificates'], o['memory'],
+                    o['logL'])
+            kwargs = {'events': self.events,
+                      'control': (self.running, self.stop),
+                      'quiet': o['quiet'], 'exact': o['exact'],
+                      'audit': o['audit'], 'placement': layout[i],
+                      'huge_pages': o['huge_pages'], 'c_scan': o['c_scan'],
+                      'levels': o['levels']}
+            if self.auditor is not None:
+                kwargs['audit_channel'] = (self.audit_requests, replies[i])
+            p = mp.Process(target=search_worker,
+                           args=(self.events, args, kwargs), daemon=True)
+            self.workers.append(p)
+            p.start()
+
+    def pause(self):
+        '''Let the workers wait after their current interval.'''
+        self.running.clear()
+
+    def resume(self):
+        '''Continue paused workers.'''
+        self.running.set()
+
+    @property
+    def paused(self):
+        return not self.running.is_set()
+
+    def cancel(self):
+        '''Stop the workers after their current interval.'''
+        self.stop.set()
+        # Wake up paused workers to let them stop.
+        self.running.set()
+
+    def done(self):
+        '''Return whether all workers have finished.'''
+        return len(self.finished) == len(self.workers)
+
+    def next_event(self, timeout=0.5):
+        '''Return the next event, or None if there is none within the
+        timeout. Workers that died without an event are reported as errors.
+        '''
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            for i, p in enumerate(self.workers):
+                if i not in self.finished and not p.is_alive():
+                    # Events of the worker may still be in the queue.
+                    try:
+                        return self.events.get(timeout=timeout)
+                    except queue.Empty:
+                        return {'type': 'error', 'proc': i, 'error':
+                                f'worker exited with code {p.exitcode}'}
+            return None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        loop = asyncio.get_running_loop()
+        while not self.done():
+            event = await loop.run_in_executor(None, self.next_event)
+            if event is None:
+                continue
+            if event['type'] in ('done', 'error'):
+                self.finished.add(event['proc'])
+            return event
+        raise StopAsyncIteration
+
+    async def wait(self):
+        '''Wait for all workers to finish, discarding the events.'''
+        async for _ in self:
+            pass
+
+    async def __aenter__(self):
+        # Loading the collection, tuning the tree and creating the files 
+        # take a while, keep the event loop running meanwhile.
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.start)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if not self.done():
+            self.cancel()
+            await self.wait()
+        loop = asyncio.get_running_loop()
+        for p in self.workers:
+            await loop.run_in_executor(None, p.join)
+        if self.auditor is not None:
+            # The workers waited for their audits, stop the server.
+            self.audit_requests.put(None)
+            await loop.run_in_executor(None, self.auditor.join)
+        return False
@@ -5,51 +5,186 @@
 # Sieving algorithms to identify smooth integers.
 
 import sys, time
+import os, mmap, struct
 import ctypes
+from array import array
+from itertools import repeat, compress
+from operator import add, mul
 from math import floor, log, log2, ceil
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from collections import deque
+from threading import Thread, Event
 from primes.parse import read_primes
+from placement import local_buffer
 
 
-def sieve(T, b, logB, primes):
+def sieve(T, b, logB, primes, logL=0, levels=None):
     """Pure python sieve to find smooth numbers
     Arguments: 
     T: the starting integer for the sieve,
     b: the length of the interval that will be sieved [T, T+b),
     logB: the sieve identifies 2**logB-smooth integers,
-    primes: the list of primes that are less than 2**logB.
+    primes: the list of primes that are less than 2**logB,
+    logL: if larger than logB, integers that are smooth up to one large 
+          prime of at most logL bits are marked with 0x02,
+    levels: if a bytearray of length b, the bit length of the largest 
+            prime less than 2**logB dividing each position is written to it.
     
     Returns a bytearray containing only 0x00 or 0x01 indicating the 
     smooth integers are in the positions with 0x01 in the interval.
-    """
-    numbers = [1 for j in range(b)]  # Start with 1s in all positions.
-    logTpb = log(T+b)
 
+    The smooth part of each position is kept as the sum of the natural 
+    logs of the prime powers dividing it, in an array of doubles. The 
+    array starts as copies of the precomputed sums of the small prime 
+    powers in WHEEL, and the other prime powers are added with one slice 
+    operation each, or one addition per position if they hit only a few.
+    The cofactor of a non-smooth integer is at least 2, so its sum is at 
+    least log(2) below log(T+j), far more than the rounding errors, and 
+    the result is exact.
+    """
+    # The prime powers of the wheel are periodic with the product W of 
+    # the moduli, the array is filled with copies from T % W on.
+    moduli = tuple(q for q in WHEEL if min_prime(q) in primes[:len(WHEEL)])
+    wheel = wheel_logs(moduli)
+    s = T % len(wheel)
+    logs = wheel[s:] + wheel*((b + s)//len(wheel) + 1)
+    del logs[b:]
+    done = {min_prime(q): q for q in moduli}
+    
     for p in primes:
-        # Compute the max exponent to be considered for this prime.
-        # I.e. such that p^a = R.
-        exponent = floor(logTpb/log(p))
-        # Iterate through the possible exponents
-        q = 1
-        for _ in range(exponent):
-            # Update to the corresponding prime power
-            q *= p
+        log_p = log(p)
+        if levels is not None:
+            # The primes are increasing, the last level written to a 
+            # position is that of its largest prime factor.
+            j = (-T) % p
+            levels[j::p] = bytes([p.bit_length()])*len(range(j, b, p))
+        # Iterate through the prime powers q = p^a up to T+b-1 that are
+        # not in the wheel.
+        q = done.get(p, 1)*p
+        while q < T+b:
             # Determine the offset for sieving
             j = (-T) % q
-            # Sieve
-            while j < b:
-                numbers[j] = numbers[j]*p
-                j += q
+            if q >= b:
+                # At most one position is divisible by q.
+                if j < b:
+                    logs[j] += log_p
+            elif b < 8*q:
+                # A few positions, cheaper than building the slices.
+                for k in range(j, b, q):
+                    logs[k] += log_p
+            else:
+                # Sieve all positions divisible by q at once.
+                logs[j::q] = array('d', map(add, logs[j::q], repeat(log_p)))
+            q *= p
 
     # Create all-zero byte array to mark the smooth numbers.
     positions = bytearray(b)
-    # Mark the 2**logB-smooth numbers in the interval.
-    for j in range(b):
-        if numbers[j]==T+j:
-            positions[j] = 1
+    log2 = log(2)
+    s = 0
+    while s < b:
+        # On [T+s, T+e), log(T+j) varies by less than log(1.25), so one 
+        # threshold halfway to the next smaller cofactor separates the 
+        # smooth integers from the others.
+        e = min(b, s + max(1, (T+s)//4))
+        threshold = log(max(T+e-1, 1)) - log2/2
+        # Mark the 2**logB-smooth numbers in the interval.
+        positions[s:e] = bytes(map(threshold.__lt__, logs[s:e]))
+        if logL:
+            # Candidates for a cofactor less than 2**logL.
+            bound = log(max(T+s, 1)) - logL*log2 - 1e-6
+            for j in compress(range(s, e), map(bound.__lt__, logs[s:e])):
+                if not positions[j] and large_cofactor(T+j, logs[j], logL, 
+                                                       primes):
+                    positions[j] = 2
+        s = e
+    if T == 0:
+        # All prime powers divide 0, its cofactor is 0.
+        positions[0] = 2 if logL else 0
     
     return positions
 
 
+# Prime powers whose logs are added to all positions by copying one 
+# period of their sums, 55440 doubles.
+WHEEL = (16, 9, 5, 7, 11)
+
+
+def min_prime(q):
+    """Return the smallest prime factor of q > 1."""
+    return next(d for d in range(2, q+1) if q % d == 0)
+
+
+@lru_cache(maxsize=4)
+def wheel_logs(moduli):
+    """Return an array of doubles with the sum of the logs of the prime 
+    powers p**a dividing j, for the prime powers dividing one of the 
+    moduli and all residues j modulo the product of the moduli.
+    """
+    W = 1
+    for q in moduli:
+        W *= q
+    logs = array('d', bytes(8*W))
+    for q in moduli:
+        p = min_prime(q)
+        log_p = log(p)
+        r = p
+        while r <= q:
+            logs[0::r] = array('d', map(add, logs[0::r], repeat(log_p)))
+            r *= p
+    return logs
+
+
+def level_sieve(T, b, logB, primes):
+    """Pure python sieve to find for each integer in [T, T+b) the smallest
+    logB' <= logB for which it is 2**logB'-smooth, the bit length of its 
+    largest prime factor, as in the C function level_sieve.
+    Arguments: 
+    T: the starting integer for the sieve,
+    b: the length of the interval that will be sieved [T, T+b),
+    logB: the largest smoothness bound,
+    primes: the list of primes that are less than 2**logB.
+    
+    Returns a bytearray with the level of each position, 0 if it is not 
+    2**logB-smooth. smooth_at turns it into the result of the sieve for 
+    any smaller bound.
+    """
+    levels = bytearray(b)
+    positions = sieve(T, b, logB, primes, levels=levels)
+    # Without prime factors, the integer 1 is smooth for all bounds.
+    if T <= 1 < T+b:
+        levels[1-T] = 1
+    return bytearray(map(mul, levels, positions))
+
+
+def smooth_at(levels, logB):
+    """Return the 0x00/0x01 sieve result for the bound 2**logB from the 
+    levels of level_sieve, with one translation at C speed.
+    """
+    return bytearray(levels).translate(_LEVEL_TABLES[logB])
+
+
+# Translation tables from levels to the sieve results for each logB.
+_LEVEL_TABLES = [bytes(1 if 0 < level <= logB else 0 
+                       for level in range(256)) for logB in range(256)]
+
+
+def large_cofactor(n, log_smooth, logL, primes):
+    '''Return whether the cofactor of n without prime factors less than 
+    2**logB is less than 2**logL, given the log of the smooth part of n.
+    '''
+    # The cofactor is prime for logL <= 2*logB.
+    d = log(n) - log_smooth - logL*log(2)
+    if abs(d) > 1e-6:
+        return d < 0
+    # Too close to the bound for the rounding errors, divide exactly.
+    for p in primes:
+        while n % p == 0:
+            n //= p
+    return n < 2**logL
+
+
 def log_sieve(T, b, logB, primes, log_primes):
     """Pure python sieve to find smooth numbers
     Arguments: 
@@ -103,7 +238,8 @@ def log_sieve(T, b, logB, primes, log_primes):
     return positions
 
 
-def c_log_sieve_64(T, b, logB, np, c_primes, c_log_primes, c_log_positions):
+def c_log_sieve_64(T, b, logB, np, c_primes, c_log_primes, c_log_positions,
+                   logL=0):
     '''Sieve to find smooth numbers calling a faster C function.
     Arguments: 
     T: the starting integer for the sieve,
@@ -112,18 +248,27 @@ def c_log_sieve_64(T, b, logB, np, c_primes, c_log_primes, c_log_positions):
     np: the number of primes less than 2**logB,
     c_primes: pointer to the list of primes less than 2**logB,
     c_log_primes: pointer to their rounded logarithms,
-    c_log_positions: pointer to bytearray for the result.
+    c_log_positions: pointer to bytearray for the result,
+    logL: if larger than logB, positions that are smooth up to one large 
+          prime of at most logL bits are marked with 2.
 
     This code calls the 64-bit version of the C code, which 
     requires that T+b is less than 2**64.
     '''
     libsieve = ctypes.CDLL("c/libsieve.so")
+    if logL:
+        libsieve.log_sieve_lp(ctypes.c_uint64(T), ctypes.c_uint(b), 
+                              ctypes.c_uint(logB), ctypes.c_uint(logL), 
+                              ctypes.c_uint(np), c_primes, c_log_primes, 
+                              c_log_positions)
+        return
     libsieve.log_sieve(ctypes.c_uint64(T), ctypes.c_uint(b), 
                        ctypes.c_uint(logB), ctypes.c_uint(np), 
                        c_primes, c_log_primes, c_log_positions)
 
 
-def c_log_sieve_128(T, b, logB, np, c_primes, c_log_primes, c_log_positions):
+def c_log_sieve_128(T, b, logB, np, c_primes, c_log_primes, c_log_positions,
+                    logL=0):
     '''Sieve to find smooth numbers calling a faster C function.
     Arguments: 
     T: the starting integer for the sieve,
@@ -132,7 +277,9 @@ def c_log_sieve_128(T, b, logB, np, c_primes, c_log_primes, c_log_positions):
     np: the number of primes less than 2**logB,
     c_primes: pointer to the list of primes less than 2**logB,
     c_log_primes: pointer to their rounded logarithms,
-    c_log_positions: pointer to bytearray for the result.
+    c_log_positions: pointer to bytearray for the result,
+    logL: if larger than logB, positions that are smooth up to one large 
+          prime of at most logL bits are marked with 2.
 
     This code calls the 128-bit version of the C code, which 
     requires that T+b is less than 2**127. It uses __int128 
@@ -145,11 +292,691 @@ def c_log_sieve_128(T, b, logB, np, c_primes, c_log_primes, c_log_positions):
     T0 = T % 2**64
     T1 = int((T-T0)/2**64)
     Tpt = (ctypes.c_uint64 * 2)(*[T0,T1])
+    if logL:
+        libsieve.log_sieve_128_lp(ctypes.byref(Tpt), ctypes.c_uint(log2T), 
+                                  ctypes.c_uint(b), ctypes.c_uint(log2Tpb), 
+                                  ctypes.c_uint(logB), ctypes.c_uint(logL), 
+                                  ctypes.c_uint(np), c_primes, c_log_primes, 
+                                  c_log_positions)
+        return
     libsieve.log_sieve_128(ctypes.byref(Tpt), ctypes.c_uint(log2T), 
                        ctypes.c_uint(b), ctypes.c_uint(log2Tpb), 
                        ctypes.c_uint(logB), ctypes.c_uint(np), 
                        c_primes, c_log_primes, c_log_positions)
+
+
+def c_exact_sieve_64(T, b, logB, np, c_primes, c_positions, logL=0):
+    '''Exact sieve to find smooth numbers calling a C function.
+    Arguments: 
+    T: the starting integer for the sieve,
+    b: the length of the interval that will be sieved [T, T+b),
+    logB: the sieve identifies 2**logB-smooth integers,
+    np: the number of primes less than 2**logB,
+    c_primes: pointer to the list of primes less than 2**logB,
+    c_positions: pointer to bytearray for the result,
+    logL: if larger than logB, positions that are smooth up to one large 
+          prime of at most logL bits are marked with 2.
+
+    This code calls the 64-bit version of the C code, which keeps the 
+    cofactor of each position in a 64-bit word and requires that T+b is 
+    less than 2**64. The result equals that of sieve().
+    '''
+    libsieve = ctypes.CDLL("c/libsieve.so")
+    libsieve.exact_sieve(ctypes.c_uint64(T), ctypes.c_uint(b), 
+                         ctypes.c_uint(logB), ctypes.c_uint(logL), 
+                         ctypes.c_uint(np), c_primes, c_positions)
+
+
+def c_exact_sieve_128(T, b, logB, np, c_primes, c_positions, logL=0):
+    '''Exact sieve to find smooth numbers calling a C function.
+    Arguments: 
+    T: the starting integer for the sieve,
+    b: the length of the interval that will be sieved [T, T+b),
+    logB: the sieve identifies 2**logB-smooth integers,
+    np: the number of primes less than 2**logB,
+    c_primes: pointer to the list of primes less than 2**logB,
+    c_positions: pointer to bytearray for the result,
+    logL: if larger than logB, positions that are smooth up to one large 
+          prime of at most logL bits are marked with 2.
+
+    This code calls the 128-bit version of the C code, which keeps the 
+    cofactor of each position in an __int128 and requires that T+b is 
+    less than 2**128. The result equals that of sieve().
+    '''
+    libsieve = ctypes.CDLL("c/libsieve128.so") 
+    T0 = T % 2**64
+    T1 = T >> 64
+    Tpt = (ctypes.c_uint64 * 2)(*[T0,T1])
+    libsieve.exact_sieve_128(ctypes.byref(Tpt), ctypes.c_uint(b), 
+                             ctypes.c_uint(logB), ctypes.c_uint(logL), 
+                             ctypes.c_uint(np), c_primes, c_positions)
+
+
+def c_level_sieve_64(T, b, np, c_primes, c_levels):
+    '''Exact sieve to find the smoothness level of each position calling
+    a C function, see level_sieve.
+    Arguments: 
+    T: the starting integer for the sieve,
+    b: the length of the interval that will be sieved [T, T+b),
+    np: the number of primes less than the largest bound 2**logB,
+    c_primes: pointer to the list of these primes,
+    c_levels: pointer to bytearray for the result.
+
+    This code calls the 64-bit version of the C code, which requires that 
+    T+b is less than 2**64.
+    '''
+    libsieve = ctypes.CDLL("c/libsieve.so")
+    libsieve.level_sieve(ctypes.c_uint64(T), ctypes.c_uint(b), 
+                         ctypes.c_uint(np), c_primes, c_levels)
+
+
+def c_level_sieve_128(T, b, np, c_primes, c_levels):
+    '''Exact sieve to find the smoothness level of each position calling
+    a C function, see level_sieve and c_level_sieve_64.
+
+    This code calls the 128-bit version of the C code, which requires that 
+    T+b is less than 2**128.
+    '''
+    libsieve = ctypes.CDLL("c/libsieve128.so") 
+    T0 = T % 2**64
+    T1 = T >> 64
+    Tpt = (ctypes.c_uint64 * 2)(*[T0,T1])
+    libsieve.level_sieve_128(ctypes.byref(Tpt), ctypes.c_uint(b), 
+                             ctypes.c_uint(np), c_primes, c_levels)
+
+
+class TreeScan:
+    '''Class to check the patterns of the solution tree of a collection at 
+    the smooth positions of sieve results with the C code, as 
+    Collection.traverse does. The flat tree arrays are converted to C 
+    arrays only once. The C function only returns the pairs of a position
+    and a pattern that match, for which python checks whether c divides 
+    f(x). The python work per interval then depends on the number of 
+    matches instead of the length of the interval. The scan only reads 
+    the sieve results, both libraries export the same function, which is
+    taken from the library of use_c = 64 or 128.
+    '''
+    def __init__(self, sols, use_c=64, max_candidates=2**12):
+        self.sols = sols
+        library = "c/libsieve.so" if use_c == 64 else "c/libsieve128.so"
+        self.scan_tree = ctypes.CDLL(library).scan_tree
+        self.scan_tree.restype = ctypes.c_uint
+
+        # Prepare the tree data to pass to C.
+        self.tree = [(ctypes.c_int * len(values))(*values) 
+                     for values in (sols.node_number, sols.child_start, 
+                                    sols.leaf_start, sols.pattern_start, 
+                                    sols.pattern_roots)]
+        self.num_patterns = len(sols.pattern_start) - 1
+        # The stack holds at most all nodes of the tree.
+        self.stack = (ctypes.c_int * (len(sols.node_number) + 1))()
+        # Room for the matches of all patterns at two positions at least.
+        self.max_candidates = max(max_candidates, 2*self.num_patterns)
+        self.candidates = (ctypes.c_uint * (2*self.max_candidates))()
+        self.next = ctypes.c_uint()
+
+    def scan(self, T, n, positions, classes=None):
+        '''Return the results in the first n positions of a writable buffer
+        such as a bytearray or the ctypes buffer of the sieve, which holds 
+        at least n + max_range positions. With classes = (modulus, 
+        residues), only the positions J for which T+J is in one of the 
+        residue classes are checked as starts, as check_classes does.
+        '''
+        buffer = (ctypes.c_char * len(positions)).from_buffer(positions)
+        starts = None
+        if classes is not None:
+            # One period of the classes, rotated to start at T and repeated.
+            modulus, residues = classes
+            period = bytearray(modulus)
+            for r in residues:
+                period[(r - T) % modulus] = 1
+            starts = bytes(period*(n//modulus + 1))
+        results = []
+        start = 0
+        while start < n:
+            # The C code stops early when the candidates are full.
+            count = self.scan_tree(buffer, ctypes.c_uint(start), 
+                                   ctypes.c_uint(n), *self.tree, 
+                                   ctypes.c_uint(self.num_patterns), 
+                                   self.stack, 
+                                   ctypes.c_uint(self.max_candidates), 
+                                   self.candidates, ctypes.byref(self.next),
+                                   starts)
+            for i in range(count):
+                j = self.candidates[2*i]
+                self.sols.found(self.candidates[2*i+1], T + j, results)
+            start = self.next.value
+        return results
+
+
+class SieveEngine:
+    '''Class to hold the prime data for sieving many intervals with the 
+    same smoothness bound and sieve implementation.
+
+    The prime tables are converted to C arrays only once and are shared by
+    all threads of the engine. With threads > 1, an interval is split into 
+    consecutive segments that are sieved in parallel by a thread pool. 
+    The ctypes calls release the GIL, so the threads run concurrently and 
+    write into disjoint parts of the same result buffer.
+
+    With a SieveCache, results for intervals that have been sieved before
+    are read from the cache instead.
+
+    With logL > logB, positions that are smooth up to one large prime of 
+    at most logL bits are marked with 2. The cache only holds bits, so it 
+    is not used in that case.
+
+    With exact, the C code runs the exact sieve instead of the log sieve, 
+    which gives the same results as the python sieve.
+
+    With huge_pages, the result buffers are memory maps backed by 
+    transparent huge pages, allocated on the NUMA node of the caller.
+
+    With levels >= logB, the exact sieve finds for each position the 
+    smallest bound up to 2**levels for which it is smooth, see 
+    level_sieve. The results for logB are read off the levels, which are
+    also stored in the cache, so that searches with any bound up to 
+    2**levels later read their results from the cache.
+    '''
+    def __init__(self, logB, primes, log_primes, use_c=0, threads=1, 
+                 cache=None, logL=0, exact=False, huge_pages=False, 
+                 levels=0):
+        self.logB = logB
+        self.logL = logL
+        self.primes = primes
+        self.log_primes = log_primes
+        self.np = len(primes)
+        self.use_c = use_c
+        self.huge_pages = huge_pages
+        self.levels = levels
+        self.exact = exact or use_c not in (64, 128) or levels > 0
+        # The exact sieves and the log sieves give different results.
+        self.kind = 'exact' if self.exact else 'log'
+        self.cache = cache if not logL else None
+        # The python sieve holds the GIL, threads only help the C code.
+        self.threads = threads if use_c in (64, 128) else 1
+
+        if self.use_c in (64, 128):
+            # Prepare prime data to pass to C.
+            self.c_primes = (ctypes.c_int * self.np)(*primes)
+            self.c_log_primes = (ctypes.c_char * self.np)(*log_primes)
+
+        if self.levels:
+            # The level sieve uses the primes up to the largest bound.
+            self.level_primes = primes
+            if levels > logB:
+                self.level_primes, _ = read_primes(levels)
+            if self.use_c in (64, 128):
+                self.c_level_primes = (ctypes.c_int * len(
+                                        self.level_primes))(*self.level_primes)
+
+        self.pool = None
+        if self.threads > 1:
+            self.pool = ThreadPoolExecutor(max_workers=self.threads)
+
+    def new_buffer(self, size):
+        '''Return a zeroed result buffer of the given size.'''
+        if self.huge_pages:
+            return local_buffer(size, huge_pages=True)
+        if self.use_c in (64, 128):
+            return (ctypes.c_char * size)()
+        return bytearray(size)
+
+    def copy_into(self, buffer, offset, data):
+        '''Copy the bytes data to buffer[offset:offset+len(data)]. For C
+        buffers, memmove is much faster than the slice assignment.
+        '''
+        if isinstance(buffer, bytearray):
+            buffer[offset:offset+len(data)] = data
+        else:
+            ctypes.memmove(ctypes.byref(buffer, offset), bytes(data), 
+                           len(data))
+
+    def level_segment(self, T, b, buffer, offset=0):
+        '''Write the levels of [T, T+b) to buffer[offset:offset+b].'''
+        if self.use_c == 64:
+            c_level_sieve_64(T, b, len(self.level_primes), 
+                             ctypes.byref(self.c_level_primes), 
+                             ctypes.byref(buffer, offset))
+        elif self.use_c == 128:
+            c_level_sieve_128(T, b, len(self.level_primes), 
+                              ctypes.byref(self.c_level_primes), 
+                              ctypes.byref(buffer, offset))
+        else:
+            buffer[offset:offset+b] = level_sieve(T, b, self.levels, 
+                                                  self.level_primes)
+
+    def sieve_segment(self, T, b, buffer, offset=0):
+        '''Sieve [T, T+b) and write the result to buffer[offset:offset+b].'''
+        if self.levels:
+            self.level_segment(T, b, buffer, offset)
+            self.copy_into(buffer, offset, 
+                           smooth_at(buffer[offset:offset+b], self.logB))
+        elif self.use_c == 64 and self.exact:
+            c_exact_sieve_64(T, b, self.logB, self.np, 
+                             ctypes.byref(self.c_primes), 
+                             ctypes.byref(buffer, offset), self.logL)
+        elif self.use_c == 128 and self.exact:
+            c_exact_sieve_128(T, b, self.logB, self.np, 
+                              ctypes.byref(self.c_primes), 
+                              ctypes.byref(buffer, offset), self.logL)
+        elif self.use_c == 64:
+            c_log_sieve_64(T, b, self.logB, self.np, 
+                           ctypes.byref(self.c_primes), 
+                           ctypes.byref(self.c_log_primes), 
+                           ctypes.byref(buffer, offset), self.logL)
+        elif self.use_c == 128:
+            c_log_sieve_128(T, b, self.logB, self.np, 
+                            ctypes.byref(self.c_primes), 
+                            ctypes.byref(self.c_log_primes), 
+                            ctypes.byref(buffer, offset), self.logL)
+        else:
+            buffer[offset:offset+b] = sieve(T, b, self.logB, self.primes, 
+                                            self.logL)
+
+    def sieve(self, T, b, buffer, offset=0):
+        '''Sieve the interval [T, T+b) into buffer[offset:offset+b], 
+        splitting it across the thread pool if there is one.
+        '''
+        if self.cache is not None:
+            positions = self.cache.get(T, b, self.logB, self.kind)
+            if positions is not None:
+                self.copy_into(buffer, offset, positions)
+                return
+
+        if self.levels:
+            # Keep the levels for the cache, the result is read off them.
+            self.sieve_threads(T, b, buffer, offset, self.level_segment)
+            levels = bytes(buffer[offset:offset+b])
+            self.copy_into(buffer, offset, smooth_at(levels, self.logB))
+            if self.cache is not None:
+                self.cache.put(T, b, self.levels, 'levels', levels)
+            return
+
+        self.sieve_threads(T, b, buffer, offset)
+
+        if self.cache is not None:
+            self.cache.put(T, b, self.logB, self.kind, 
+                           bytes(buffer[offset:offset+b]))
+
+    def sieve_threads(self, T, b, buffer, offset=0, segment=None):
+        '''Sieve [T, T+b) into buffer[offset:offset+b] with the threads,
+        with sieve_segment or another function with the same arguments.
+        '''
+        if segment is None:
+            segment = self.sieve_segment
+        if self.pool is None:
+            segment(T, b, buffer, offset)
+            return
+
+        # Split the interval into one segment per thread, the last 
+        # thread gets the rest.
+        seg = ceil(b/self.threads)
+        futures = [self.pool.submit(segment, T+i, min(seg, b-i), buffer, 
+                                    offset+i)
+                   for i in range(0, b, seg)]
+        for f in futures:
+            # Propagate exceptions from the threads.
+            f.result()
+
+    def sieve_windows(self, starts, width, buffer):
+        '''Sieve the windows [T, T+width) for T in starts into consecutive
+        parts of buffer, window i into buffer[i*width:(i+1)*width]. Each
+        window is a separate call to the sieve, the windows are split into
+        one run of consecutive windows per thread. The cache is not used,
+        the windows are too small to be worth storing.
+        '''
+        def sieve_run(first, last):
+            for i in range(first, last):
+                self.sieve_segment(starts[i], width, buffer, i*width)
+
+        if self.pool is None:
+            sieve_run(0, len(starts))
+            return
+
+        run = ceil(len(starts)/self.threads)
+        futures = [self.pool.submit(sieve_run, i, min(i+run, len(starts)))
+                   for i in range(0, len(starts), run)]
+        for f in futures:
+            f.result()
+
+    def close(self):
+        '''Shut down the thread pool.'''
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+def sieve_pipeline(engine, intervals, size, depth=2, overlap=0):
+    '''Generator that sieves a sequence of intervals ahead of the consumer.
+    Arguments: 
+    engine: the SieveEngine used for sieving,
+    intervals: an iterable of pairs (T, b) to be sieved in this order,
+    size: the size of the result buffers, at least the largest b + overlap,
+    depth: the number of result buffers,
+    overlap: the number of positions after each interval that are needed 
+             with it, e.g. to match patterns across interval boundaries.
+
+    Yields triples (T, b, buffer) with the sieve result for [T, T+b+overlap)
+    in the first b+overlap positions of the buffer. The buffer is only 
+    valid until the next triple is requested, after which it is reused for 
+    sieving.
+
+    Each interval [T, T+b) is sieved as one block through the cache of 
+    the engine, under a key that does not depend on the overlap, so that
+    searches with other solution lists share the cached blocks. The 
+    overlap after a block is the head of the next one, so it is copied 
+    from there instead of being sieved again. An interval is held back 
+    until the next block is sieved, which takes one more buffer. Only 
+    the overlap after the last block, or before a gap between intervals,
+    is sieved separately without the cache. Each position is sieved once.
+
+    With depth > 1, a background thread sieves the next intervals into 
+    the free buffers while the consumer works on the current one, so that 
+    sieving and scanning overlap. With depth = 1, each interval is sieved 
+    when it is requested.
+    '''
+    # Held back intervals (T, b, buffer, filled), whose overlap is known 
+    # up to the position filled. All of them are complete up to the end 
+    # of the last block, except for the last ones.
+    waiting = deque()
+
+    def fill(T, n, source, offset):
+        '''Copy the sieve result for [T, T+n) from source[offset:] to the 
+        overlaps of the waiting intervals that continue at T.
+        '''
+        for i, (wT, wb, wbuffer, filled) in enumerate(waiting):
+            if filled == T:
+                m = min(wT + wb + overlap - T, n)
+                engine.copy_into(wbuffer, filled - wT, 
+                                 source[offset:offset+m])
+                waiting[i] = (wT, wb, wbuffer, filled + m)
+
+    def sieve_rest():
+        '''Sieve the rest of the overlap of the last waiting interval, 
+        which covers the rest of those before it.
+        '''
+        wT, wb, wbuffer, filled = waiting[-1]
+        n = wT + wb + overlap - filled
+        engine.sieve_segment(filled, n, wbuffer, filled - wT)
+        fill(filled, n, wbuffer, filled - wT)
+
+    def complete():
+        '''Yield the waiting intervals whose overlap is filled, in order.'''
+        while waiting:
+            T, b, buffer, filled = waiting[0]
+            if filled < T + b + overlap:
+                break
+            waiting.popleft()
+            yield T, b, buffer
+
+    def windows(buffers):
+        '''Generate the triples (T, b, buffer) in order, sieving each 
+        block into the next of buffers.
+        '''
+        for T, b in intervals:
+            buffer = next(buffers, None)
+            if buffer is None:
+                return
+            engine.sieve(T, b, buffer)
+            if waiting and waiting[-1][3] != T:
+                # The intervals are not consecutive.
+                sieve_rest()
+            fill(T, b, buffer, 0)
+            yield from complete()
+            waiting.append((T, b, buffer, T + b))
+            yield from complete()
+        if waiting:
+            sieve_rest()
+            yield from complete()
+
+    # One more buffer for the interval that is held back.
+    num_buffers = max(depth, 1) + (1 if overlap else 0)
+
+    if depth <= 1:
+        spare = []
+
+        def buffers():
+            while True:
+                yield spare.pop() if spare else engine.new_buffer(size)
+
+        for item in windows(buffers()):
+            yield item
+            # The consumer is done with this buffer, reuse it.
+            spare.append(item[2])
+        return
+
+    # Buffers that can be sieved into and sieved buffers ready to be used.
+    free = Queue()
+    ready = Queue()
+    for _ in range(num_buffers):
+        free.put(engine.new_buffer(size))
+    stop = Event()
+
+    def buffers():
+        while True:
+            if len(waiting) > 1 and free.empty():
+                # Intervals shorter than the overlap hold back more
+                # buffers, which might all be waiting.
+                yield engine.new_buffer(size)
+                continue
+            buffer = free.get()
+            if buffer is None or stop.is_set():
+                return
+            yield buffer
+
+    def produce():
+        try:
+            for item in windows(buffers()):
+                ready.put(item)
+            ready.put(None)
+        except Exception as e:
+            # Hand the exception to the consumer.
+            ready.put(e)
+
+    producer = Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = ready.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+            # The consumer is done with this buffer, hand it back.
+            free.put(item[2])
+    finally:
+        # Stop the producer if the consumer quits early.
+        stop.set()
+        free.put(None)
+        producer.join()
+
+
+# Bounds on the integers the C sieves can handle, by USE_C value.
+C_LIMITS = {64: 2**64, 128: 2**127}
+
+
+def fastest_engine(R):
+    '''Return the fastest available sieve implementation (the USE_C value)
+    for integers less than R, falling back to the exact python sieve.
+    The C values select the approximate log sieve unless the engine is 
+    created with exact set.
+    '''
+    if R <= C_LIMITS[64] and os.path.exists('c/libsieve.so'):
+        return 64
+    if R <= C_LIMITS[128] and os.path.exists('c/libsieve128.so'):
+        return 128
+    return 0
+
+
+def tune_batch(engine, T, extra=0, memory=2**28, depth=1, scan=None,
+               min_log=12, max_log=26):
+    '''Pick the interval length b that sieves and scans the most integers 
+    per second at T by running short calibration sieves.
+    Arguments: 
+    engine: the SieveEngine to be used,
+    T: the start of the calibration intervals,
+    extra: the overlap added to each interval, e.g. the solution range,
+    memory: the memory budget in bytes for the result buffers,
+    depth: the number of result buffers,
+    scan: a function scan(T, positions, b) that is run on each result like
+          the search does, which adds the per position and per interval 
+          costs of scanning,
+    min_log, max_log: the range of log2(b) that is tried.
+
+    Returns the best power of 2 for b within the memory budget. Each 
+    buffer takes b + extra bytes, with an overlap sieve_pipeline holds 
+    one more buffer, the positions are copied once more and the exact 
+    sieves take up to 16 bytes per position on top.
+    The overlap is copied from the next block by sieve_pipeline, it is 
+    left out of the calibration.
+    '''
+    per_position = (depth + (2 if extra else 1) 
+                    + (0 if engine.kind == 'log' else 16))
+    best_b = 2**min_log
+    best_rate = 0
+    slower = 0
+    for l in range(min_log, max_log + 1):
+        b = 2**l
+        if (b + extra)*per_position > memory and l > min_log:
+            break
+        buffer = engine.new_buffer(b + extra)
+        start = time.perf_counter()
+        # Do not use the cache for calibration.
+        engine.sieve_threads(T, b, buffer)
+        positions = bytearray(buffer)
+        if scan is not None:
+            scan(T, positions, b)
+        rate = b/(time.perf_counter() - start)
+        if rate > best_rate:
+            best_b, best_rate = b, rate
+            slower = 0
+        else:
+            # Stop once larger intervals keep getting slower.
+            slower += 1
+            if slower == 2:
+                break
     
+    return best_b
+
+
+def iter_smooth(L, R, logB, b=2**20, use_c=None, threads=1, depth=2, 
+                bitmaps=False, primes=None, log_primes=None, exact=False):
+    '''Generator for the 2**logB-smooth integers in the range [L, R).
+    Arguments: 
+    L, R: the range [L, R) to be sieved,
+    logB: the sieve identifies 2**logB-smooth integers,
+    b: the length of the chunks sieved at one time, which bounds the memory,
+    use_c: the sieve implementation (USE_C = 0/64/128), picks the fastest
+           available one if None, 0 is the exact python sieve,
+    threads: the number of threads sharing the C sieve,
+    depth: the number of result buffers for sieving ahead,
+    bitmaps: yield bit-packed chunks instead of integers,
+    primes, log_primes: prime tables, read from the table files if None,
+    exact: use the exact sieve in C instead of the log sieve.
+
+    Yields the smooth integers in increasing order or, if bitmaps is set,
+    pairs (T, bits) for consecutive chunks [T, T+len) where bit i of the
+    packed bytes (see pack_bits) marks whether T+i is smooth. The log 
+    sieve in C, the default where it is available, is approximate: it can
+    miss smooth integers and yield a few that are not smooth. With exact
+    or use_c = 0, exactly the smooth integers are yielded.
+    '''
+    if primes is None:
+        primes, log_primes = read_primes(logB)
+    if use_c is None:
+        use_c = fastest_engine(R)
+    engine = SieveEngine(logB, primes, log_primes, use_c, threads, 
+                         exact=exact)
+
+    intervals = ((T, min(b, R-T)) for T in range(L, R, b))
+    try:
+        for T, length, buffer in sieve_pipeline(engine, intervals, b, depth):
+            positions = bytes(buffer[:length])
+            if bitmaps:
+                yield T, pack_bits(positions)
+                continue
+            # Skip to the smooth positions at C speed.
+            j = positions.find(1)
+            while j >= 0:
+                yield T + j
+                j = positions.find(1, j+1)
+    finally:
+        engine.close()
+
+
+# Tables to translate between 0x00/0x01 bytes and ASCII '0'/'1'.
+_TO_ASCII = bytes.maketrans(b'\x00\x01', b'01')
+_FROM_ASCII = bytes.maketrans(b'01', b'\x00\x01')
+
+def pack_bits(positions):
+    '''Pack a byte array of 0x00/0x01 values into bits. Bit i % 8 of byte 
+    i // 8 of the result is the value at position i.
+    '''
+    n = len(positions)
+    if n == 0:
+        return b''
+    # Conversion through a binary string keeps the work in C.
+    bits = bytes(positions).translate(_TO_ASCII)[::-1]
+    return int(bits, 2).to_bytes((n+7)//8, 'little')
+
+
+def unpack_bits(bits, n):
+    '''Unpack the first n positions of bit-packed bytes into a bytearray 
+    of 0x00/0x01 values, the inverse of pack_bits.
+    '''
+    if n == 0:
+        return bytearray()
+    ascii = format(int.from_bytes(bits, 'little'), f'0{8*len(bits)}b')
+    return bytearray(ascii[::-1][:n].encode().translate(_FROM_ASCII))
+
+
+# Bitmap files start with a header of fixed size holding the magic string,
+# the format version, T as a 128-bit integer, the length b and logB.
+BITMAP_MAGIC = b'SMOOTHBM'
+BITMAP_VERSION = 1
+BITMAP_HEADER = struct.Struct('<8sI16sQI')
+BITMAP_OFFSET = 64
+
+def write_bitmap(filename, L, R, logB, b=2**20, **kwargs):
+    '''Sieve [L, R) and write the bit-packed smoothness bitmap to a file.
+    The chunk length b must be a multiple of 8. Further keyword arguments 
+    are passed to iter_smooth.
+    '''
+    if b % 8:
+        raise ValueError('Chunk length b must be a multiple of 8.')
+    header = BITMAP_HEADER.pack(BITMAP_MAGIC, BITMAP_VERSION, 
+                                L.to_bytes(16, 'little'), R-L, logB)
+    with open(filename, 'wb') as file:
+        file.write(header.ljust(BITMAP_OFFSET, b'\x00'))
+        for _, bits in iter_smooth(L, R, logB, b, bitmaps=True, **kwargs):
+            file.write(bits)
+
+
+def open_bitmap(filename):
+    '''Memory-map a bitmap file written by write_bitmap.
+    Returns (T, b, logB, bits), where bits is a memoryview of the packed 
+    bitmap for [T, T+b). Integer T+i is smooth iff bit i % 8 of bits[i//8] 
+    is set, see bitmap_smooth.
+    '''
+    with open(filename, 'rb') as file:
+        mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, T, b, logB = BITMAP_HEADER.unpack_from(mm)
+    if magic != BITMAP_MAGIC or version != BITMAP_VERSION:
+        raise RuntimeError(f'{filename} is not a version {BITMAP_VERSION}'
+                           + ' bitmap file.')
+    T = int.from_bytes(T, 'little')
+    bits = memoryview(mm)[BITMAP_OFFSET:BITMAP_OFFSET + (b+7)//8]
+
+    return T, b, logB, bits
+
+
+def bitmap_smooth(bits, i):
+    '''Check whether position i is marked in a bit-packed bitmap.'''
+    return (bits[i >> 3] >> (i & 7)) & 1
+
+
 def main(args):
     # import cProfile, pstats, io
 
@@ -165,6 +992,20 @@ def main(args):
     # Read a precomputed table of all primes less than B=2**logB.
     primes, log_primes = read_primes(logB)
     np = len(primes)
+
+    # Write the bitmap of [T, T+b) to a file instead of comparing sieves.
+    output = args[6]
+    if output:
+        use_c = args[4] if args[4] is not None else fastest_engine(T+b)
+        print(f'Writing bitmap of [{T}, {T+b}) to {output}...')
+        start_interval_time = time.time()
+        write_bitmap(output, T, T+b, logB, args[7], use_c=use_c, 
+                     threads=args[5], primes=primes, log_primes=log_primes,
+                     exact=args[8])
+        end_interval_time = time.time()
+        print(f'Interval [{T}, {T+b-1}], '
+              + f'time: {round(end_interval_time - start_interval_time, 3)}s')
+        return
      
     # #profiling
     # pr = cProfile.Profile()
@@ -199,26 +1040,16 @@ def main(args):
     use_c = args[4]
     if use_c == 64 or use_c == 128:
         print(f'Sieving from {T} to {T+b} with logs using C implementation...')
-        # Start with 0s in all positions.
-        numbers = bytearray(b)
-        numbers = memoryview(numbers)
         # Prepare prime data and result byte array to pass to C.
-        c_primes = (ctypes.c_int * np)(*primes)
-        c_log_primes = (ctypes.c_char * np)(*log_primes)
-        c_numbers = (ctypes.c_char * b)(*numbers)
+        engine = SieveEngine(logB, primes, log_primes, use_c, args[5])
+        c_numbers = engine.new_buffer(b)
     
         start_interval_time = time.time()   
 
-        if use_c == 64:
-            c_log_sieve_64(T, b, logB, np, ctypes.byref(c_primes), 
-                           ctypes.byref(c_log_primes), 
-                           ctypes.byref(c_numbers))
-        elif use_c == 128:
-            c_log_sieve_128(T, b, logB, np, ctypes.byref(c_primes), 
-                           ctypes.byref(c_log_primes), 
-                           ctypes.byref(c_numbers))
+        engine.sieve(T, b, c_numbers)
 
         end_interval_time = time.time()
+        engine.close()
 
         c_log_positions = bytearray(c_numbers)
         print(c_log_positions[0:100])
@@ -229,6 +1060,27 @@ def main(args):
         diff = [c_log_positions[i] - log_positions[i] for i in range(b)]
         print(f'Wrong: {sum([abs(diff[i]) for i in range(len(diff))])}/{b}')
 
+    # Use the exact C implementation.
+    if args[8] and use_c in (64, 128):
+        print(f'\nSieving from {T} to {T+b} exactly using C implementation...')
+        engine = SieveEngine(logB, primes, log_primes, use_c, args[5], 
+                             exact=True)
+        c_numbers = engine.new_buffer(b)
+    
+        start_interval_time = time.time()   
+
+        engine.sieve(T, b, c_numbers)
+
+        end_interval_time = time.time()
+        engine.close()
+
+        c_positions = bytearray(c_numbers)
+        print(c_positions[0:100])
+        print(f'Interval [{T}, {T+b-1}], '
+              + f'time: {round(end_interval_time - start_interval_time, 3)}s')
+        print(f'c result equal to exact python result:'
+              + f' {c_positions == positions}')
+
     # pr.disable()
     # s = io.StringIO()
     # sortby = 'cumulative'
@@ -246,11 +1098,24 @@ if __name__ == '__main__':
                         help="length b of the sieving interval")
     parser.add_argument("logB", type=int, 
                         help="logarithm of the smoothness bound B")
-    parser.add_argument("-c", "--use_c", type=int, default=0, 
-                        help="use the 64- or 128-bit C code (USE_C = 64/128)")
+    parser.add_argument("-c", "--use_c", type=int, default=None, 
+                        help="use the 64- or 128-bit C code (USE_C = 64/128)"
+                        + " or the exact python sieve (USE_C = 0), for -o"
+                        + " the fastest available one by default")
+    parser.add_argument("-t", "--threads", type=int, default=1, 
+                        help="number of threads sharing the C sieve")
+    parser.add_argument("-e", "--exact", default=False, action="store_true",
+                        help="also run the exact C sieve, or write its"
+                        + " bitmap with -o")
+    parser.add_argument("-o", "--output", type=str, default=None, 
+                        help="write the bit-packed bitmap to file OUTPUT")
+    parser.add_argument("-k", "--chunk", type=int, default=2**20, 
+                        help="length of the chunks sieved at one time for"
+                        + " the bitmap output")
     args = parser.parse_args()
 
     filename = sys.argv[0]
     
-    main([filename, args.T, args.b, args.logB, args.use_c])
+    main([filename, args.T, args.b, args.logB, args.use_c, args.threads,
+          args.output, args.chunk, args.exact])
     
\ No newline at end of file
@@ -0,0 +1,143 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+# sieve_cache.py
+#
+# On-disk cache of sieve results to avoid sieving the same intervals again.
+
+import os, mmap, zlib
+from pathlib import Path
+from sieve import pack_bits, unpack_bits, smooth_at
+
+# Largest bound of level entries, the C sieves take 32-bit primes.
+MAX_LEVELS = 32
+
+class SieveCache:
+    '''Class to store bit-packed, compressed sieve results in a local 
+    directory, keyed by the interval [T, T+b), logB and the kind of sieve 
+    (exact or log). The smoothness bitmap does not depend on the PTE 
+    solutions, so a rerun over the same range with another solution set
+    only needs the pattern matching.
+
+    The kind levels holds the bytes of level_sieve for the bound 2**logB
+    instead. Exact results for a smaller bound that are not in the cache 
+    are read off the levels, so that one sieve of a range serves the 
+    searches with all bounds up to 2**logB. The levels entries are looked
+    up by file name for each bound from logB to MAX_LEVELS.
+
+    Entries are memory-mapped on read. When the total size of the 
+    directory exceeds max_size bytes, the least recently used entries 
+    are deleted, down to a low-water mark of low_water times max_size, so
+    that the directory is only scanned again after that many bytes have
+    been written. Each instance tracks the total size from its last scan 
+    and its own entries. Several processes can share a cache directory.
+    '''
+    def __init__(self, directory, max_size=2**32, low_water=0.9):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.low_water = low_water
+        # Estimated size of the directory, None until the first scan.
+        self.total = None
+        # Cache statistics of this instance.
+        self.hits = 0
+        self.misses = 0
+
+    def filename(self, T, b, logB, kind):
+        '''Return the file name of the entry for [T, T+b).'''
+        return self.directory / f'{kind}_{logB}_{T}_{b}.bmz'
+
+    def read(self, filename):
+        '''Return the decompressed data of an entry, or None.'''
+        try:
+            with open(filename, 'rb') as file:
+                with mmap.mmap(file.fileno(), 0, 
+                               access=mmap.ACCESS_READ) as mm:
+                    data = zlib.decompress(mm)
+        except (FileNotFoundError, ValueError, zlib.error):
+            # Missing, empty or damaged entry, e.g. evicted by another
+            # process.
+            return None
+        try:
+            # Mark the entry as recently used for the eviction.
+            os.utime(filename)
+        except OSError:
+            # Evicted by another process after the read.
+            pass
+        return data
+
+    def get(self, T, b, logB, kind):
+        '''Return the cached sieve result for [T, T+b) as a bytearray of
+        0x00/0x01 values, or of levels for the kind levels, or None if it 
+        is not in the cache.
+        '''
+        data = self.read(self.filename(T, b, logB, kind))
+        if data is not None:
+            self.hits += 1
+            if kind == 'levels':
+                return bytearray(data)
+            return unpack_bits(data, b)
+
+        if kind == 'exact':
+            # The levels for the smallest larger bound, a few failed opens
+            # instead of a scan of the directory.
+            for bound in range(logB, MAX_LEVELS + 1):
+                levels = self.read(self.filename(T, b, bound, 'levels'))
+                if levels is not None:
+                    self.hits += 1
+                    return smooth_at(levels, logB)
+
+        self.misses += 1
+        return None
+
+    def put(self, T, b, logB, kind, positions):
+        '''Store the sieve result for [T, T+b) given as 0x00/0x01 bytes,
+        or the levels for the kind levels.
+        '''
+        filename = self.filename(T, b, logB, kind)
+        # The fastest compression level costs much less time for a little 
+        # more space, e.g. 5 ms instead of 33 ms for 2**20 bits at 2**40 
+        # with logB = 16 and 3% more space, which is about the time of the
+        # C sieve for them.
+        if kind == 'levels':
+            data = zlib.compress(bytes(positions[:b]), 1)
+        else:
+            data = zlib.compress(pack_bits(positions[:b]), 1)
+        # Write to a temporary file first such that other processes never 
+        # read partial entries.
+        tmp_filename = filename.with_suffix(f'.tmp{os.getpid()}')
+        with open(tmp_filename, 'wb') as file:
+            file.write(data)
+        try:
+            # An entry written again replaces the old one.
+            replaced = filename.stat().st_size
+        except OSError:
+            replaced = 0
+        os.replace(tmp_filename, filename)
+
+        if self.total is None:
+            self.evict()
+        else:
+            self.total += len(data) - replaced
+            if self.total > self.max_size:
+                self.evict()
+
+    def evict(self):
+        '''Scan the directory and, if it exceeds max_size bytes, delete
+        least recently used entries until it fits into low_water times 
+        max_size bytes.
+        '''
+        entries = []
+        for f in self.directory.glob('*.bmz'):
+            try:
+                st = f.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, f))
+        total = sum(entry[1] for entry in entries)
+        if total > self.max_size:
+            for _, size, f in sorted(entries):
+                if total <= self.low_water*self.max_size:
+                    break
+                f.unlink(missing_ok=True)
+                total -= size
+        self.total = total